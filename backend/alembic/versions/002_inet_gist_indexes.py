@@ -0,0 +1,31 @@
+"""gist inet indexes
+
+Revision ID: 002
+Revises: 001
+Create Date: 2024-02-01 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '002'
+down_revision = '001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # GiST inet_ops indexes back the &&, >>= and <<= operators used by SubnetService
+    op.create_index(
+        'ix_subnets_cidr_gist', 'subnets', ['cidr'], unique=False,
+        postgresql_using='gist', postgresql_ops={'cidr': 'inet_ops'}
+    )
+    op.create_index(
+        'ix_ip_addresses_address_gist', 'ip_addresses', ['address'], unique=False,
+        postgresql_using='gist', postgresql_ops={'address': 'inet_ops'}
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_ip_addresses_address_gist', table_name='ip_addresses')
+    op.drop_index('ix_subnets_cidr_gist', table_name='subnets')
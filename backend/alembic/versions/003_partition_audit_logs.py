@@ -0,0 +1,125 @@
+"""partition audit_logs by month
+
+Revision ID: 003
+Revises: 002
+Create Date: 2024-03-01 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '003'
+down_revision = '002'
+branch_labels = None
+depends_on = None
+
+COLUMNS = 'id, user_id, action, target_type, target_id, before_data, after_data, ip_address, "timestamp", details'
+
+
+def upgrade() -> None:
+    # Move the existing table out of the way; index names are schema-wide
+    op.execute('ALTER TABLE audit_logs RENAME TO audit_logs_unpartitioned')
+    op.execute('ALTER TABLE audit_logs_unpartitioned RENAME CONSTRAINT audit_logs_pkey TO audit_logs_unpartitioned_pkey')
+    op.execute('ALTER TABLE audit_logs_unpartitioned RENAME CONSTRAINT audit_logs_user_id_fkey TO audit_logs_unpartitioned_user_id_fkey')
+    op.drop_index('ix_audit_logs_action', table_name='audit_logs_unpartitioned')
+    op.drop_index('ix_audit_logs_target_type', table_name='audit_logs_unpartitioned')
+    op.drop_index('ix_audit_logs_timestamp', table_name='audit_logs_unpartitioned')
+    op.execute('ALTER SEQUENCE audit_logs_id_seq OWNED BY NONE')
+
+    # The partition key has to be part of the primary key
+    op.execute("""
+        CREATE TABLE audit_logs (
+            id INTEGER NOT NULL DEFAULT nextval('audit_logs_id_seq'),
+            user_id INTEGER REFERENCES users (id),
+            action VARCHAR(100) NOT NULL,
+            target_type VARCHAR(50) NOT NULL,
+            target_id INTEGER,
+            before_data JSON,
+            after_data JSON,
+            ip_address INET,
+            "timestamp" TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+            details TEXT,
+            PRIMARY KEY (id, "timestamp")
+        ) PARTITION BY RANGE ("timestamp")
+    """)
+    op.execute('ALTER SEQUENCE audit_logs_id_seq OWNED BY audit_logs.id')
+    op.execute('CREATE TABLE audit_logs_default PARTITION OF audit_logs DEFAULT')
+
+    # Creates the monthly partition holding ts if it is missing, moving any
+    # rows that already landed in the default partition for that month
+    op.execute("""
+        CREATE OR REPLACE FUNCTION audit_logs_ensure_partition(ts TIMESTAMP WITH TIME ZONE)
+        RETURNS TEXT AS $$
+        DECLARE
+            start_ts TIMESTAMP WITH TIME ZONE := date_trunc('month', ts AT TIME ZONE 'UTC') AT TIME ZONE 'UTC';
+            end_ts TIMESTAMP WITH TIME ZONE := (date_trunc('month', ts AT TIME ZONE 'UTC') + INTERVAL '1 month') AT TIME ZONE 'UTC';
+            partition_name TEXT := 'audit_logs_' || to_char(ts AT TIME ZONE 'UTC', 'YYYY_MM');
+        BEGIN
+            IF to_regclass(partition_name) IS NOT NULL THEN
+                RETURN partition_name;
+            END IF;
+            EXECUTE format('CREATE TABLE %I (LIKE audit_logs INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', partition_name);
+            EXECUTE format(
+                'WITH moved AS (DELETE FROM audit_logs_default WHERE "timestamp" >= %L AND "timestamp" < %L RETURNING *) '
+                'INSERT INTO %I SELECT * FROM moved',
+                start_ts, end_ts, partition_name
+            );
+            EXECUTE format(
+                'ALTER TABLE audit_logs ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                partition_name, start_ts, end_ts
+            );
+            RETURN partition_name;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+
+    # One partition per month of existing data, plus the next three months
+    op.execute("""
+        SELECT audit_logs_ensure_partition(month)
+        FROM generate_series(
+            date_trunc('month', COALESCE((SELECT min("timestamp") FROM audit_logs_unpartitioned), now())),
+            date_trunc('month', now()) + INTERVAL '3 months',
+            INTERVAL '1 month'
+        ) AS month
+    """)
+    op.execute(f'INSERT INTO audit_logs ({COLUMNS}) SELECT {COLUMNS} FROM audit_logs_unpartitioned')
+    op.drop_table('audit_logs_unpartitioned')
+
+    op.create_index(op.f('ix_audit_logs_action'), 'audit_logs', ['action'], unique=False)
+    op.create_index(op.f('ix_audit_logs_target_type'), 'audit_logs', ['target_type'], unique=False)
+    op.create_index(op.f('ix_audit_logs_timestamp'), 'audit_logs', ['timestamp'], unique=False)
+    op.create_index('ix_audit_logs_timestamp_id', 'audit_logs', ['timestamp', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.execute('ALTER TABLE audit_logs RENAME TO audit_logs_partitioned')
+    op.execute('ALTER SEQUENCE audit_logs_id_seq OWNED BY NONE')
+    op.drop_index('ix_audit_logs_timestamp_id', table_name='audit_logs_partitioned')
+    op.drop_index('ix_audit_logs_timestamp', table_name='audit_logs_partitioned')
+    op.drop_index('ix_audit_logs_target_type', table_name='audit_logs_partitioned')
+    op.drop_index('ix_audit_logs_action', table_name='audit_logs_partitioned')
+
+    op.execute("""
+        CREATE TABLE audit_logs (
+            id INTEGER NOT NULL DEFAULT nextval('audit_logs_id_seq'),
+            user_id INTEGER,
+            action VARCHAR(100) NOT NULL,
+            target_type VARCHAR(50) NOT NULL,
+            target_id INTEGER,
+            before_data JSON,
+            after_data JSON,
+            ip_address INET,
+            "timestamp" TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+            details TEXT,
+            CONSTRAINT audit_logs_pkey PRIMARY KEY (id),
+            CONSTRAINT audit_logs_user_id_fkey FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    """)
+    op.execute('ALTER SEQUENCE audit_logs_id_seq OWNED BY audit_logs.id')
+    op.execute(f'INSERT INTO audit_logs ({COLUMNS}) SELECT {COLUMNS} FROM audit_logs_partitioned')
+    op.execute('DROP TABLE audit_logs_partitioned CASCADE')
+    op.execute('DROP FUNCTION IF EXISTS audit_logs_ensure_partition(TIMESTAMP WITH TIME ZONE)')
+
+    op.create_index(op.f('ix_audit_logs_action'), 'audit_logs', ['action'], unique=False)
+    op.create_index(op.f('ix_audit_logs_target_type'), 'audit_logs', ['target_type'], unique=False)
+    op.create_index(op.f('ix_audit_logs_timestamp'), 'audit_logs', ['timestamp'], unique=False)
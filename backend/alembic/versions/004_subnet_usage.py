@@ -0,0 +1,43 @@
+"""per-subnet utilization counters
+
+Revision ID: 004
+Revises: 003
+Create Date: 2024-03-15 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '004'
+down_revision = '003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('subnet_usage',
+        sa.Column('subnet_id', sa.Integer(), nullable=False),
+        sa.Column('free_count', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('assigned_count', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('reserved_count', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('quarantined_count', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.ForeignKeyConstraint(['subnet_id'], ['subnets.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('subnet_id')
+    )
+    
+    # Backfill from the current rows; the application keeps the counters up to date from here on
+    op.execute("""
+        INSERT INTO subnet_usage (subnet_id, free_count, assigned_count, reserved_count, quarantined_count)
+        SELECT subnet_id,
+               count(*) FILTER (WHERE status = 'FREE'),
+               count(*) FILTER (WHERE status = 'ASSIGNED'),
+               count(*) FILTER (WHERE status = 'RESERVED'),
+               count(*) FILTER (WHERE status = 'QUARANTINED')
+        FROM ip_addresses
+        GROUP BY subnet_id
+    """)
+
+
+def downgrade() -> None:
+    op.drop_table('subnet_usage')
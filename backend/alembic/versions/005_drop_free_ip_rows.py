@@ -0,0 +1,27 @@
+"""stop storing free addresses
+
+Revision ID: 005
+Revises: 004
+Create Date: 2024-03-22 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '005'
+down_revision = '004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Free addresses are now derived from the subnet range minus the stored rows.
+    # Large tables can be drained beforehand with scripts/compact_free_ips.py so
+    # this delete has little left to do.
+    op.execute("DELETE FROM ip_addresses WHERE status = 'FREE'")
+    op.execute("UPDATE subnet_usage SET free_count = 0, updated_at = now() WHERE free_count <> 0")
+
+
+def downgrade() -> None:
+    # Deleted rows carried no data beyond their address; free space is still derivable
+    pass
@@ -0,0 +1,34 @@
+"""subnet leases for scanner agents
+
+Revision ID: 006
+Revises: 005
+Create Date: 2024-03-29 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '006'
+down_revision = '005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('scan_leases',
+        sa.Column('subnet_id', sa.Integer(), nullable=False),
+        sa.Column('holder', sa.String(length=255), nullable=True),
+        sa.Column('expires_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('claimed_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('requested_by', sa.String(length=255), nullable=True),
+        sa.ForeignKeyConstraint(['subnet_id'], ['subnets.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('subnet_id')
+    )
+    op.create_index(op.f('ix_scan_leases_holder'), 'scan_leases', ['holder'], unique=False)
+    op.create_index(op.f('ix_scan_leases_expires_at'), 'scan_leases', ['expires_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_scan_leases_expires_at'), table_name='scan_leases')
+    op.drop_index(op.f('ix_scan_leases_holder'), table_name='scan_leases')
+    op.drop_table('scan_leases')
@@ -1,5 +1,5 @@
 from fastapi import APIRouter
-from app.api.v1 import auth, subnets, ips, devices, vlans, users, audit_logs, bulk_ops
+from app.api.v1 import auth, subnets, ips, devices, vlans, users, audit_logs, bulk_ops, scan
 
 api_router = APIRouter()
 
@@ -11,3 +11,4 @@ api_router.include_router(vlans.router, prefix="/vlans", tags=["VLANs"])
 api_router.include_router(users.router, prefix="/users", tags=["Users"])
 api_router.include_router(audit_logs.router, prefix="/audit-logs", tags=["Audit Logs"])
 api_router.include_router(bulk_ops.router, prefix="", tags=["Bulk Operations"])
+api_router.include_router(scan.router, prefix="/scan", tags=["Scanning"])
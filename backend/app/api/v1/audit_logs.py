@@ -1,8 +1,10 @@
-from fastapi import APIRouter, Depends, Query
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, Query, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
 from datetime import datetime
 from app.core.database import get_db
+from app.core.pagination import NEXT_CURSOR_HEADER, apply_keyset, next_cursor
 from app.core.security import get_current_user, require_role
 from app.models.user import User, UserRole
 from app.models.audit_log import AuditLog
@@ -12,6 +14,7 @@ router = APIRouter()
 
 @router.get("", response_model=List[AuditLogResponse])
 async def list_audit_logs(
+    response: Response,
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
     user_id: Optional[int] = None,
@@ -19,10 +22,11 @@ async def list_audit_logs(
     target_type: Optional[str] = None,
     start_date: Optional[datetime] = None,
     end_date: Optional[datetime] = None,
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = Query(None, description="Opaque cursor from the X-Next-Cursor header of the previous page"),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(require_role([UserRole.ADMIN, UserRole.AUDITOR]))
 ):
-    query = db.query(AuditLog)
+    query = select(AuditLog)
     
     if user_id:
         query = query.filter(AuditLog.user_id == user_id)
@@ -35,5 +39,17 @@ async def list_audit_logs(
     if end_date:
         query = query.filter(AuditLog.timestamp <= end_date)
     
-    logs = query.order_by(AuditLog.timestamp.desc()).offset(skip).limit(limit).all()
+    # Newest first by (timestamp, id); a cursor seeks straight to the next page
+    query = apply_keyset(
+        query, AuditLog.timestamp, AuditLog.id, cursor,
+        descending=True, parse_sort_key=datetime.fromisoformat
+    )
+    if not cursor:
+        query = query.offset(skip)
+    
+    logs = (await db.scalars(query.limit(limit))).all()
+    
+    cursor_value = next_cursor(logs, limit, "timestamp")
+    if cursor_value:
+        response.headers[NEXT_CURSOR_HEADER] = cursor_value
     return logs
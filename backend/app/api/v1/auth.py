@@ -1,10 +1,12 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.core.database import get_db
 from app.core.security import (
-    verify_password, get_password_hash, create_access_token,
-    create_refresh_token, decode_token, get_current_user
+    create_access_token, create_refresh_token, decode_token,
+    get_current_user, password_hasher
 )
+from app.core.metrics import PASSWORD_REHASHED
 from app.models.user import User
 from app.schemas.user import LoginRequest, Token, TokenRefresh, UserResponse
 from app.services.audit_service import log_audit
@@ -14,11 +16,15 @@ router = APIRouter()
 @router.post("/login", response_model=Token)
 async def login(
     credentials: LoginRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    user = db.query(User).filter(User.email == credentials.email).first()
+    user = await db.scalar(select(User).where(User.email == credentials.email))
     
-    if not user or not verify_password(credentials.password, user.hashed_password):
+    valid, new_hash = False, None
+    if user:
+        valid, new_hash = await password_hasher.verify_and_update(credentials.password, user.hashed_password)
+    
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password"
@@ -30,10 +36,16 @@ async def login(
             detail="User account is inactive"
         )
     
+    # Transparently upgrade hashes made with older passlib parameters
+    if new_hash:
+        user.hashed_password = new_hash
+        await db.commit()
+        PASSWORD_REHASHED.inc()
+    
     access_token = create_access_token(data={"sub": user.id})
     refresh_token = create_refresh_token(data={"sub": user.id})
     
-    log_audit(db, user.id, "login", "user", user.id, details="User logged in")
+    await log_audit(db, user.id, "login", "user", user.id, details="User logged in")
     
     return {
         "access_token": access_token,
@@ -44,7 +56,7 @@ async def login(
 @router.post("/refresh", response_model=Token)
 async def refresh_token(
     token_data: TokenRefresh,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     payload = decode_token(token_data.refresh_token)
     
@@ -55,7 +67,7 @@ async def refresh_token(
         )
     
     user_id = payload.get("sub")
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.scalar(select(User).where(User.id == user_id))
     
     if not user or not user.active:
         raise HTTPException(
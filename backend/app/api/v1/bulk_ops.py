@@ -1,5 +1,6 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Response
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
 import csv
 import io
@@ -8,7 +9,7 @@ from app.core.security import get_current_user, require_role
 from app.models.user import User, UserRole
 from app.models.subnet import Subnet
 from app.models.ip_address import IPAddress
-from app.services.bulk_service import BulkService
+from app.services.bulk_service import BulkService, gzip_stream
 from app.services.audit_service import log_audit
 
 router = APIRouter()
@@ -17,47 +18,62 @@ router = APIRouter()
 async def import_csv(
     file: UploadFile = File(...),
     entity_type: str = "subnets",
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(require_role([UserRole.ADMIN, UserRole.NETWORK_ENGINEER]))
 ):
     if not file.filename.endswith('.csv'):
         raise HTTPException(status_code=400, detail="File must be CSV")
     
-    content = await file.read()
+    if entity_type not in ("subnets", "ips"):
+        raise HTTPException(status_code=400, detail="Invalid entity type")
+    
+    # Read the spooled upload incrementally instead of loading it into memory
+    stream = io.TextIOWrapper(file.file, encoding='utf-8', newline='')
     service = BulkService(db)
     
     try:
         if entity_type == "subnets":
-            result = service.import_subnets_csv(content.decode('utf-8'), current_user.id)
-        elif entity_type == "ips":
-            result = service.import_ips_csv(content.decode('utf-8'), current_user.id)
+            result = await service.import_subnets_csv(stream, current_user.id)
         else:
-            raise HTTPException(status_code=400, detail="Invalid entity type")
-        
-        log_audit(db, current_user.id, "import_csv", entity_type, None, details=f"Imported {result['created']} records")
-        return result
-    except Exception as e:
+            result = await service.import_ips_csv(stream, current_user.id)
+    except (UnicodeDecodeError, csv.Error) as e:
         raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        stream.detach()
+    
+    details = f"Imported {result['created']} records"
+    if "rows_per_second" in result:
+        details += f" ({result['rows_per_second']} rows/s)"
+    await log_audit(db, current_user.id, "import_csv", entity_type, None, details=details)
+    return result
 
 @router.get("/export/csv")
 async def export_csv(
     entity_type: str = "subnets",
-    db: Session = Depends(get_db),
+    gzip: bool = False,
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
     service = BulkService(db)
     
     if entity_type == "subnets":
-        data = service.export_subnets_csv()
+        chunks = service.iter_subnets_csv()
     elif entity_type == "ips":
-        data = service.export_ips_csv()
+        chunks = service.iter_ips_csv()
     else:
         raise HTTPException(status_code=400, detail="Invalid entity type")
     
-    log_audit(db, current_user.id, "export_csv", entity_type, None)
+    await log_audit(db, current_user.id, "export_csv", entity_type, None)
+    
+    filename = f"{entity_type}_export.csv"
+    media_type = "text/csv"
+    if gzip:
+        chunks = gzip_stream(chunks)
+        filename += ".gz"
+        media_type = "application/gzip"
     
-    return Response(
-        content=data,
-        media_type="text/csv",
-        headers={"Content-Disposition": f"attachment; filename={entity_type}_export.csv"}
+    return StreamingResponse(
+        chunks,
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
     )
@@ -1,7 +1,9 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
 from app.core.database import get_db
+from app.core.pagination import NEXT_CURSOR_HEADER, apply_keyset, next_cursor
 from app.core.security import get_current_user, require_role
 from app.models.user import User, UserRole
 from app.models.device import Device
@@ -12,21 +14,31 @@ router = APIRouter()
 
 @router.get("", response_model=List[DeviceResponse])
 async def list_devices(
+    response: Response,
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = Query(None, description="Opaque cursor from the X-Next-Cursor header of the previous page"),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    devices = db.query(Device).offset(skip).limit(limit).all()
+    query = apply_keyset(select(Device), Device.id, Device.id, cursor)
+    if not cursor:
+        query = query.offset(skip)
+    
+    devices = (await db.scalars(query.limit(limit))).all()
+    
+    cursor_value = next_cursor(devices, limit, "id")
+    if cursor_value:
+        response.headers[NEXT_CURSOR_HEADER] = cursor_value
     return devices
 
 @router.get("/{device_id}", response_model=DeviceResponse)
 async def get_device(
     device_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    device = db.query(Device).filter(Device.id == device_id).first()
+    device = await db.get(Device, device_id)
     if not device:
         raise HTTPException(status_code=404, detail="Device not found")
     return device
@@ -34,45 +46,45 @@ async def get_device(
 @router.post("", response_model=DeviceResponse, status_code=status.HTTP_201_CREATED)
 async def create_device(
     device_data: DeviceCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(require_role([UserRole.ADMIN, UserRole.NETWORK_ENGINEER]))
 ):
     device = Device(**device_data.dict())
     db.add(device)
-    db.commit()
-    db.refresh(device)
-    log_audit(db, current_user.id, "create", "device", device.id, after_data=device_data.dict())
+    await db.commit()
+    await db.refresh(device)
+    await log_audit(db, current_user.id, "create", "device", device.id, after_data=device_data.dict())
     return device
 
 @router.put("/{device_id}", response_model=DeviceResponse)
 async def update_device(
     device_id: int,
     device_data: DeviceUpdate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(require_role([UserRole.ADMIN, UserRole.NETWORK_ENGINEER]))
 ):
-    device = db.query(Device).filter(Device.id == device_id).first()
+    device = await db.get(Device, device_id)
     if not device:
         raise HTTPException(status_code=404, detail="Device not found")
     
     for key, value in device_data.dict(exclude_unset=True).items():
         setattr(device, key, value)
     
-    db.commit()
-    db.refresh(device)
-    log_audit(db, current_user.id, "update", "device", device.id)
+    await db.commit()
+    await db.refresh(device)
+    await log_audit(db, current_user.id, "update", "device", device.id)
     return device
 
 @router.delete("/{device_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_device(
     device_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(require_role([UserRole.ADMIN, UserRole.NETWORK_ENGINEER]))
 ):
-    device = db.query(Device).filter(Device.id == device_id).first()
+    device = await db.get(Device, device_id)
     if not device:
         raise HTTPException(status_code=404, detail="Device not found")
     
-    log_audit(db, current_user.id, "delete", "device", device.id)
-    db.delete(device)
-    db.commit()
+    await log_audit(db, current_user.id, "delete", "device", device.id, in_transaction=True)
+    await db.delete(device)
+    await db.commit()
@@ -1,30 +1,44 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Response
+from pydantic import ValidationError
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from collections import Counter
 from typing import List, Optional
+import json
+from app.core.config import settings
 from app.core.database import get_db
+from app.core.pagination import NEXT_CURSOR_HEADER, apply_keyset, next_cursor, encode_cursor, decode_cursor
 from app.core.security import get_current_user, require_role
 from app.models.user import User, UserRole
 from app.models.ip_address import IPAddress, IPStatus
 from app.schemas.ip_address import (
     IPAddressCreate, IPAddressUpdate, IPAddressResponse,
-    IPAddressAllocate, IPAddressAssign, IPConflictResolve
+    IPAddressAllocate, IPAddressAssign, IPConflictResolve, ScanResultItem
 )
-from app.services.ip_service import IPService
+from app.services.ip_service import IPService, AllocationConflictError
+from app.services.scan_service import ScanService
+from app.services.subnet_service import invalidate_subnet_cache
+from app.services.usage_service import apply_usage, status_change
 from app.services.audit_service import log_audit
 
 router = APIRouter()
 
 @router.get("", response_model=List[IPAddressResponse])
 async def list_ips(
+    response: Response,
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = Query(None, description="Opaque cursor from the X-Next-Cursor header of the previous page"),
     subnet_id: Optional[int] = None,
     status: Optional[IPStatus] = None,
     hostname: Optional[str] = None,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    query = db.query(IPAddress)
+    if status == IPStatus.FREE:
+        return await _list_free_ips(response, skip, limit, cursor, subnet_id, hostname, db)
+    
+    query = select(IPAddress)
     
     if subnet_id:
         query = query.filter(IPAddress.subnet_id == subnet_id)
@@ -33,16 +47,59 @@ async def list_ips(
     if hostname:
         query = query.filter(IPAddress.hostname.ilike(f"%{hostname}%"))
     
-    ips = query.offset(skip).limit(limit).all()
+    # Stable id ordering lets a cursor seek past the previous page
+    query = apply_keyset(query, IPAddress.id, IPAddress.id, cursor)
+    if not cursor:
+        query = query.offset(skip)
+    
+    ips = (await db.scalars(query.limit(limit))).all()
+    
+    cursor_value = next_cursor(ips, limit, "id")
+    if cursor_value:
+        response.headers[NEXT_CURSOR_HEADER] = cursor_value
+    return ips
+
+async def _list_free_ips(
+    response: Response,
+    skip: int,
+    limit: int,
+    cursor: Optional[str],
+    subnet_id: Optional[int],
+    hostname: Optional[str],
+    db: AsyncSession
+):
+    # Free addresses are not stored; they are generated from the subnet range
+    if not subnet_id:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Listing free addresses requires subnet_id"
+        )
+    if hostname:
+        return []
+    
+    after = None
+    if cursor:
+        after, cursor_subnet_id = decode_cursor(cursor)
+        if cursor_subnet_id != subnet_id:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    
+    service = IPService(db)
+    try:
+        ips = await service.list_free(subnet_id, skip=0 if cursor else skip, limit=limit, after=after)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    
+    if len(ips) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor([ips[-1]["address"], subnet_id])
     return ips
 
 @router.get("/{ip_id}", response_model=IPAddressResponse)
 async def get_ip(
     ip_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    ip = db.query(IPAddress).filter(IPAddress.id == ip_id).first()
+    ip = await db.get(IPAddress, ip_id)
     if not ip:
         raise HTTPException(status_code=404, detail="IP address not found")
     return ip
@@ -50,16 +107,29 @@ async def get_ip(
 @router.post("/allocate", response_model=List[IPAddressResponse])
 async def allocate_ips(
     allocation: IPAddressAllocate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(require_role([UserRole.ADMIN, UserRole.NETWORK_ENGINEER]))
 ):
+    # A retried allocation rolls back and expires the session, current_user included
+    user_id = current_user.id
     service = IPService(db)
-    ips = service.allocate_ips(
-        subnet_id=allocation.subnet_id,
-        count=allocation.count,
-        hostname=allocation.hostname,
-        user_id=current_user.id
-    )
+    try:
+        ips = await service.allocate_ips(
+            subnet_id=allocation.subnet_id,
+            count=allocation.count,
+            hostname=allocation.hostname,
+            user_id=user_id,
+            strategy=allocation.strategy,
+            mac_address=allocation.mac_address
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except AllocationConflictError as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=str(e),
+            headers={"Retry-After": "1"}
+        )
     
     if not ips:
         raise HTTPException(
@@ -68,18 +138,61 @@ async def allocate_ips(
         )
     
     for ip in ips:
-        log_audit(db, current_user.id, "allocate", "ip_address", ip.id, after_data={"address": str(ip.address)})
+        await log_audit(db, user_id, "allocate", "ip_address", ip.id, after_data={"address": str(ip.address)})
     
     return ips
 
+@router.post("/scan-results")
+async def ingest_scan_results(
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(require_role([UserRole.ADMIN, UserRole.NETWORK_ENGINEER]))
+):
+    """Apply a batch of scanner results, sent as a JSON array or as NDJSON"""
+    body = await request.body()
+    try:
+        if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+            raw_items = [json.loads(line) for line in body.splitlines() if line.strip()]
+        else:
+            raw_items = json.loads(body or b"[]")
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Body is not valid JSON or NDJSON")
+    if not isinstance(raw_items, list):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Expected a list of scan results")
+    if len(raw_items) > settings.SCANNER_RESULTS_MAX_BATCH:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {settings.SCANNER_RESULTS_MAX_BATCH} results per batch"
+        )
+    
+    try:
+        items = [ScanResultItem(**item) for item in raw_items]
+    except (TypeError, ValidationError) as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+    
+    user_id = current_user.id
+    result = await ScanService(db).apply_results(items)
+    
+    # One summary record per batch, committed with the updates it describes
+    await log_audit(
+        db, user_id, "scan_results", "ip_address",
+        after_data={"received": result["received"], "updated": result["updated"], "unmatched": len(result["unmatched"])},
+        details=f"Scan results for {result['updated']} addresses",
+        in_transaction=True
+    )
+    await db.commit()
+    
+    return result
+
 @router.put("/{ip_id}/assign", response_model=IPAddressResponse)
 async def assign_ip(
     ip_id: int,
     assignment: IPAddressAssign,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(require_role([UserRole.ADMIN, UserRole.NETWORK_ENGINEER]))
 ):
-    ip = db.query(IPAddress).filter(IPAddress.id == ip_id).first()
+    # Row lock so concurrent status changes cannot double-count in subnet_usage
+    ip = await db.get(IPAddress, ip_id, with_for_update=True)
     if not ip:
         raise HTTPException(status_code=404, detail="IP address not found")
     
@@ -94,10 +207,12 @@ async def assign_ip(
     if assignment.interface:
         ip.interface = assignment.interface
     
-    db.commit()
-    db.refresh(ip)
+    await apply_usage(db, status_change(Counter(), ip.subnet_id, before_data["status"], ip.status))
+    await db.commit()
+    await db.refresh(ip)
+    await invalidate_subnet_cache(ip.subnet_id)
     
-    log_audit(db, current_user.id, "assign", "ip_address", ip.id, before_data=before_data, after_data=assignment.dict())
+    await log_audit(db, current_user.id, "assign", "ip_address", ip.id, before_data=before_data, after_data=assignment.dict())
     
     return ip
 
@@ -105,10 +220,10 @@ async def assign_ip(
 async def update_ip(
     ip_id: int,
     ip_data: IPAddressUpdate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(require_role([UserRole.ADMIN, UserRole.NETWORK_ENGINEER]))
 ):
-    ip = db.query(IPAddress).filter(IPAddress.id == ip_id).first()
+    ip = await db.get(IPAddress, ip_id, with_for_update=True)
     if not ip:
         raise HTTPException(status_code=404, detail="IP address not found")
     
@@ -117,38 +232,39 @@ async def update_ip(
     for key, value in ip_data.dict(exclude_unset=True).items():
         setattr(ip, key, value)
     
-    db.commit()
-    db.refresh(ip)
+    await apply_usage(db, status_change(Counter(), ip.subnet_id, before_data["status"], ip.status))
+    await db.commit()
+    await db.refresh(ip)
+    await invalidate_subnet_cache(ip.subnet_id)
     
-    log_audit(db, current_user.id, "update", "ip_address", ip.id, before_data=before_data, after_data=ip_data.dict(exclude_unset=True))
+    await log_audit(db, current_user.id, "update", "ip_address", ip.id, before_data=before_data, after_data=ip_data.dict(exclude_unset=True))
     
     return ip
 
 @router.delete("/{ip_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_ip(
     ip_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(require_role([UserRole.ADMIN, UserRole.NETWORK_ENGINEER]))
 ):
-    ip = db.query(IPAddress).filter(IPAddress.id == ip_id).first()
+    ip = await db.get(IPAddress, ip_id, with_for_update=True)
     if not ip:
         raise HTTPException(status_code=404, detail="IP address not found")
     
-    log_audit(db, current_user.id, "delete", "ip_address", ip.id, before_data={"address": str(ip.address)})
+    await log_audit(db, current_user.id, "delete", "ip_address", ip.id, before_data={"address": str(ip.address)}, in_transaction=True)
     
-    db.delete(ip)
-    db.commit()
+    await IPService(db).release(ip)
 
 @router.post("/{ip_id}/scan")
 async def scan_ip(
     ip_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(require_role([UserRole.ADMIN, UserRole.NETWORK_ENGINEER]))
 ):
     service = IPService(db)
-    result = service.scan_ip(ip_id)
+    result = await service.scan_ip(ip_id)
     
-    log_audit(db, current_user.id, "scan", "ip_address", ip_id, details="IP scan initiated")
+    await log_audit(db, current_user.id, "scan", "ip_address", ip_id, details="IP scan initiated")
     
     return result
 
@@ -156,12 +272,12 @@ async def scan_ip(
 async def resolve_conflict(
     ip_id: int,
     resolution: IPConflictResolve,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(require_role([UserRole.ADMIN, UserRole.NETWORK_ENGINEER]))
 ):
     service = IPService(db)
-    result = service.resolve_conflict(ip_id, resolution.action, resolution.new_device_id)
+    result = await service.resolve_conflict(ip_id, resolution.action, resolution.new_device_id)
     
-    log_audit(db, current_user.id, "resolve_conflict", "ip_address", ip_id, after_data=resolution.dict())
+    await log_audit(db, current_user.id, "resolve_conflict", "ip_address", ip_id, after_data=resolution.dict())
     
     return result
@@ -0,0 +1,91 @@
+from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+from app.core.config import settings
+from app.core.database import get_db
+from app.core.security import get_current_user, require_role
+from app.models.user import User, UserRole
+from app.models.ip_address import IPStatus
+from app.schemas.scan import LeaseClaim, LeaseRenew, LeaseRelease, LeaseSet, ScanLeaseResponse
+from app.services.lease_service import LeaseService
+from app.services.scan_service import ScanService
+
+router = APIRouter()
+
+@router.get("/targets")
+async def get_scan_targets(
+    status_filter: List[IPStatus] = Query([IPStatus.ASSIGNED], alias="status"),
+    subnet_ids: List[int] = Query([], alias="subnet_id", description="Repeat to scan several subnets"),
+    holder: Optional[str] = Query(None, min_length=1, max_length=255, description="Only subnets leased to this agent"),
+    stale_seconds: Optional[int] = Query(None, ge=0, description="Only addresses not seen for this many seconds (or never)"),
+    shard: int = Query(0, ge=0),
+    shards: int = Query(1, ge=1, le=1024),
+    after_id: Optional[int] = Query(None, description="Resume after this id"),
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Stream every scan target as NDJSON, one {id, address, subnet_id, last_seen} per line"""
+    if shard >= shards:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="shard must be lower than shards")
+    if IPStatus.FREE in status_filter:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Free addresses are not stored and cannot be scan targets")
+    
+    service = ScanService(db)
+    chunks = service.iter_targets(
+        statuses=status_filter,
+        subnet_ids=subnet_ids or None,
+        holder=holder,
+        stale_seconds=stale_seconds,
+        shard=shard,
+        shards=shards,
+        after_id=after_id
+    )
+    return StreamingResponse(chunks, media_type="application/x-ndjson")
+
+@router.get("/leases", response_model=List[ScanLeaseResponse])
+async def list_scan_leases(
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Subnets currently leased to scanner agents"""
+    return await LeaseService(db).list_leases()
+
+@router.post("/leases/claim", response_model=LeaseSet)
+async def claim_scan_leases(
+    claim: LeaseClaim,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(require_role([UserRole.ADMIN, UserRole.NETWORK_ENGINEER]))
+):
+    """Renew the agent's subnet leases and claim more, up to its fair share.
+    
+    Agents call this on a timer well within the TTL; the response is the
+    full set of subnets the agent should scan until the next call.
+    """
+    ttl = claim.ttl_seconds or settings.SCANNER_LEASE_TTL_SECONDS
+    subnet_ids = await LeaseService(db).claim(claim.holder, ttl, claim.limit)
+    await db.commit()
+    return LeaseSet(holder=claim.holder, subnet_ids=subnet_ids, ttl_seconds=ttl)
+
+@router.post("/leases/renew", response_model=LeaseSet)
+async def renew_scan_leases(
+    renewal: LeaseRenew,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(require_role([UserRole.ADMIN, UserRole.NETWORK_ENGINEER]))
+):
+    """Extend the agent's leases without claiming new ones; subnets missing from the response were lost"""
+    ttl = renewal.ttl_seconds or settings.SCANNER_LEASE_TTL_SECONDS
+    subnet_ids = await LeaseService(db).renew(renewal.holder, ttl)
+    await db.commit()
+    return LeaseSet(holder=renewal.holder, subnet_ids=subnet_ids, ttl_seconds=ttl)
+
+@router.post("/leases/release", response_model=LeaseSet)
+async def release_scan_leases(
+    release: LeaseRelease,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(require_role([UserRole.ADMIN, UserRole.NETWORK_ENGINEER]))
+):
+    """Give subnets back so other agents can claim them at once, e.g. on shutdown"""
+    subnet_ids = await LeaseService(db).release(release.holder, release.subnet_ids)
+    await db.commit()
+    return LeaseSet(holder=release.holder, subnet_ids=subnet_ids, ttl_seconds=settings.SCANNER_LEASE_TTL_SECONDS)
@@ -1,60 +1,112 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, exists
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
+import ipaddress
+from app.core.config import settings
 from app.core.database import get_db
+from app.core.pagination import NEXT_CURSOR_HEADER, apply_keyset, next_cursor
 from app.core.security import get_current_user, require_role
 from app.models.user import User, UserRole
 from app.models.subnet import Subnet
-from app.schemas.subnet import SubnetCreate, SubnetUpdate, SubnetResponse, SubnetWithStats
-from app.services.subnet_service import SubnetService
+from app.models.ip_address import IPAddress
+from app.schemas.subnet import SubnetCreate, SubnetUpdate, SubnetResponse, SubnetWithStats, SubnetPrefixAllocate
+from app.services.subnet_service import SubnetService, invalidate_subnet_cache, iter_tree_json
+from app.services.ip_allocator import invalidate_allocator
+from app.services.prefix_trie import subnet_index
+from app.services.reserved_ranges import normalize_reserved_ranges
+from app.services.usage_service import remove_usage
 from app.services.audit_service import log_audit
 
 router = APIRouter()
 
 @router.get("", response_model=List[SubnetResponse])
 async def list_subnets(
+    response: Response,
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = Query(None, description="Opaque cursor from the X-Next-Cursor header of the previous page"),
     parent_id: Optional[int] = None,
     vlan_id: Optional[int] = None,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    query = db.query(Subnet)
+    query = select(Subnet)
     
     if parent_id is not None:
         query = query.filter(Subnet.parent_subnet_id == parent_id)
     if vlan_id is not None:
         query = query.filter(Subnet.vlan_id == vlan_id)
     
-    subnets = query.offset(skip).limit(limit).all()
+    # Stable id ordering lets a cursor seek past the previous page
+    query = apply_keyset(query, Subnet.id, Subnet.id, cursor)
+    if not cursor:
+        query = query.offset(skip)
+    
+    subnets = (await db.scalars(query.limit(limit))).all()
+    
+    cursor_value = next_cursor(subnets, limit, "id")
+    if cursor_value:
+        response.headers[NEXT_CURSOR_HEADER] = cursor_value
     return subnets
 
+@router.get("/tree")
+async def get_subnet_tree(
+    root_id: Optional[int] = Query(None, description="Subnet to start from; defaults to every top-level subnet"),
+    max_depth: Optional[int] = Query(None, ge=0, le=settings.SUBNET_TREE_MAX_DEPTH, description="Deepest level to include (0 = roots only)"),
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    if root_id is not None and not await db.get(Subnet, root_id):
+        raise HTTPException(status_code=404, detail="Subnet not found")
+    
+    service = SubnetService(db)
+    nodes = await service.get_tree(root_id)
+    return StreamingResponse(iter_tree_json(nodes, max_depth), media_type="application/json")
+
+@router.get("/lookup", response_model=SubnetResponse)
+async def lookup_subnet(
+    address: str,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    try:
+        ipaddress.ip_address(address)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid IP address")
+    
+    service = SubnetService(db)
+    subnet = await service.find_containing_subnet(address)
+    if not subnet:
+        raise HTTPException(status_code=404, detail="No subnet contains this address")
+    return subnet
+
 @router.get("/{subnet_id}", response_model=SubnetWithStats)
 async def get_subnet(
     subnet_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    subnet = db.query(Subnet).filter(Subnet.id == subnet_id).first()
+    subnet = await db.get(Subnet, subnet_id)
     if not subnet:
         raise HTTPException(status_code=404, detail="Subnet not found")
     
     service = SubnetService(db)
-    stats = service.get_subnet_stats(subnet_id)
+    stats = await service.get_subnet_stats(subnet_id)
     
     return {**subnet.__dict__, **stats}
 
 @router.post("", response_model=SubnetResponse, status_code=status.HTTP_201_CREATED)
 async def create_subnet(
     subnet_data: SubnetCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(require_role([UserRole.ADMIN, UserRole.NETWORK_ENGINEER]))
 ):
     service = SubnetService(db)
     
     # Check for overlaps
-    if service.check_overlap(subnet_data.cidr):
+    if await service.check_overlap(subnet_data.cidr):
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
             detail="Subnet overlaps with existing subnet"
@@ -65,66 +117,125 @@ async def create_subnet(
         created_by_id=current_user.id
     )
     db.add(subnet)
-    db.commit()
-    db.refresh(subnet)
+    await db.commit()
+    await db.refresh(subnet)
+    subnet_index.add(subnet.id, subnet.cidr)
+    if subnet.parent_subnet_id is not None:
+        invalidate_allocator(subnet.parent_subnet_id)
+    await invalidate_subnet_cache(subnet.parent_subnet_id)
     
-    log_audit(db, current_user.id, "create", "subnet", subnet.id, after_data=subnet_data.dict())
+    await log_audit(db, current_user.id, "create", "subnet", subnet.id, after_data=subnet_data.dict())
     
     return subnet
 
+@router.post("/{subnet_id}/allocate-prefix", response_model=SubnetResponse, status_code=status.HTTP_201_CREATED)
+async def allocate_prefix(
+    subnet_id: int,
+    allocation: SubnetPrefixAllocate,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(require_role([UserRole.ADMIN, UserRole.NETWORK_ENGINEER]))
+):
+    parent = await db.get(Subnet, subnet_id)
+    if not parent:
+        raise HTTPException(status_code=404, detail="Subnet not found")
+    
+    network = ipaddress.ip_network(str(parent.cidr), strict=False)
+    if not network.prefixlen < allocation.prefix_length <= network.max_prefixlen:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"prefix_length must be between {network.prefixlen + 1} and {network.max_prefixlen} for {network}"
+        )
+    
+    user_id = current_user.id
+    service = SubnetService(db)
+    child = await service.allocate_prefix(
+        parent,
+        allocation.prefix_length,
+        created_by_id=user_id,
+        **allocation.dict(exclude={"prefix_length"})
+    )
+    if not child:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"No free /{allocation.prefix_length} left in {network}"
+        )
+    
+    await log_audit(db, user_id, "allocate_prefix", "subnet", child.id, after_data={"cidr": str(child.cidr), "parent_subnet_id": subnet_id})
+    
+    return child
+
 @router.put("/{subnet_id}", response_model=SubnetResponse)
 async def update_subnet(
     subnet_id: int,
     subnet_data: SubnetUpdate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(require_role([UserRole.ADMIN, UserRole.NETWORK_ENGINEER]))
 ):
-    subnet = db.query(Subnet).filter(Subnet.id == subnet_id).first()
+    subnet = await db.get(Subnet, subnet_id)
     if not subnet:
         raise HTTPException(status_code=404, detail="Subnet not found")
     
     before_data = {k: v for k, v in subnet.__dict__.items() if not k.startswith('_')}
+    previous_parent_id = subnet.parent_subnet_id
+    
+    update_dict = subnet_data.dict(exclude_unset=True)
+    if update_dict.get("reserved_ranges") is not None:
+        try:
+            update_dict["reserved_ranges"] = normalize_reserved_ranges(str(subnet.cidr), update_dict["reserved_ranges"])
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
     
-    for key, value in subnet_data.dict(exclude_unset=True).items():
+    for key, value in update_dict.items():
         setattr(subnet, key, value)
     
-    db.commit()
-    db.refresh(subnet)
+    await db.commit()
+    await db.refresh(subnet)
+    for allocator_id in {subnet.id, previous_parent_id, subnet.parent_subnet_id} - {None}:
+        invalidate_allocator(allocator_id)
+    await invalidate_subnet_cache(subnet.id, previous_parent_id, subnet.parent_subnet_id)
     
-    log_audit(db, current_user.id, "update", "subnet", subnet.id, before_data=before_data, after_data=subnet_data.dict(exclude_unset=True))
+    await log_audit(db, current_user.id, "update", "subnet", subnet.id, before_data=before_data, after_data=update_dict)
     
     return subnet
 
 @router.delete("/{subnet_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_subnet(
     subnet_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(require_role([UserRole.ADMIN, UserRole.NETWORK_ENGINEER]))
 ):
-    subnet = db.query(Subnet).filter(Subnet.id == subnet_id).first()
+    subnet = await db.get(Subnet, subnet_id)
     if not subnet:
         raise HTTPException(status_code=404, detail="Subnet not found")
     
     # Check if subnet has IPs
-    if subnet.ip_addresses:
+    if await db.scalar(select(exists().where(IPAddress.subnet_id == subnet_id))):
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
             detail="Cannot delete subnet with assigned IPs"
         )
     
-    log_audit(db, current_user.id, "delete", "subnet", subnet.id, before_data={"cidr": str(subnet.cidr)})
+    await log_audit(db, current_user.id, "delete", "subnet", subnet.id, before_data={"cidr": str(subnet.cidr)}, in_transaction=True)
     
-    db.delete(subnet)
-    db.commit()
+    parent_id = subnet.parent_subnet_id
+    await remove_usage(db, subnet_id)
+    await db.delete(subnet)
+    await db.commit()
+    invalidate_allocator(subnet_id)
+    if parent_id is not None:
+        invalidate_allocator(parent_id)
+    subnet_index.discard(subnet_id)
+    await invalidate_subnet_cache(subnet_id, parent_id)
 
 @router.get("/{subnet_id}/children", response_model=List[SubnetResponse])
 async def get_subnet_children(
     subnet_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    subnet = db.query(Subnet).filter(Subnet.id == subnet_id).first()
+    subnet = await db.get(Subnet, subnet_id)
     if not subnet:
         raise HTTPException(status_code=404, detail="Subnet not found")
     
-    return subnet.children
+    service = SubnetService(db)
+    return await service.get_children(subnet_id)
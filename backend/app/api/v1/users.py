@@ -1,8 +1,10 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
 from app.core.database import get_db
-from app.core.security import get_current_user, require_role, get_password_hash
+from app.core.pagination import NEXT_CURSOR_HEADER, apply_keyset, next_cursor
+from app.core.security import get_current_user, require_role, password_hasher, principal_cache
 from app.models.user import User, UserRole
 from app.schemas.user import UserCreate, UserUpdate, UserResponse
 from app.services.audit_service import log_audit
@@ -11,23 +13,33 @@ router = APIRouter()
 
 @router.get("", response_model=List[UserResponse])
 async def list_users(
+    response: Response,
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = Query(None, description="Opaque cursor from the X-Next-Cursor header of the previous page"),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(require_role([UserRole.ADMIN, UserRole.AUDITOR]))
 ):
-    users = db.query(User).offset(skip).limit(limit).all()
+    query = apply_keyset(select(User), User.id, User.id, cursor)
+    if not cursor:
+        query = query.offset(skip)
+    
+    users = (await db.scalars(query.limit(limit))).all()
+    
+    cursor_value = next_cursor(users, limit, "id")
+    if cursor_value:
+        response.headers[NEXT_CURSOR_HEADER] = cursor_value
     return users
 
 @router.post("", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
 async def create_user(
     user_data: UserCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(require_role([UserRole.ADMIN]))
 ):
-    existing = db.query(User).filter(
+    existing = await db.scalar(select(User).where(
         (User.email == user_data.email) | (User.username == user_data.username)
-    ).first()
+    ).limit(1))
     
     if existing:
         raise HTTPException(
@@ -38,51 +50,53 @@ async def create_user(
     user = User(
         username=user_data.username,
         email=user_data.email,
-        hashed_password=get_password_hash(user_data.password),
+        hashed_password=await password_hasher.hash(user_data.password),
         role=user_data.role
     )
     db.add(user)
-    db.commit()
-    db.refresh(user)
-    log_audit(db, current_user.id, "create", "user", user.id, after_data={"username": user.username, "role": user.role})
+    await db.commit()
+    await db.refresh(user)
+    await log_audit(db, current_user.id, "create", "user", user.id, after_data={"username": user.username, "role": user.role})
     return user
 
 @router.put("/{user_id}", response_model=UserResponse)
 async def update_user(
     user_id: int,
     user_data: UserUpdate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(require_role([UserRole.ADMIN]))
 ):
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.get(User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
     update_dict = user_data.dict(exclude_unset=True)
     if "password" in update_dict:
-        update_dict["hashed_password"] = get_password_hash(update_dict.pop("password"))
+        update_dict["hashed_password"] = await password_hasher.hash(update_dict.pop("password"))
     
     for key, value in update_dict.items():
         setattr(user, key, value)
     
-    db.commit()
-    db.refresh(user)
-    log_audit(db, current_user.id, "update", "user", user.id)
+    await db.commit()
+    await db.refresh(user)
+    principal_cache.invalidate(user.id)
+    await log_audit(db, current_user.id, "update", "user", user.id)
     return user
 
 @router.delete("/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_user(
     user_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(require_role([UserRole.ADMIN]))
 ):
     if user_id == current_user.id:
         raise HTTPException(status_code=400, detail="Cannot delete yourself")
     
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.get(User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    log_audit(db, current_user.id, "delete", "user", user.id)
-    db.delete(user)
-    db.commit()
+    await log_audit(db, current_user.id, "delete", "user", user.id, in_transaction=True)
+    await db.delete(user)
+    await db.commit()
+    principal_cache.invalidate(user_id)
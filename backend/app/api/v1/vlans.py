@@ -1,7 +1,9 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
 from app.core.database import get_db
+from app.core.pagination import NEXT_CURSOR_HEADER, apply_keyset, next_cursor
 from app.core.security import get_current_user, require_role
 from app.models.user import User, UserRole
 from app.models.vlan import VLAN
@@ -12,56 +14,66 @@ router = APIRouter()
 
 @router.get("", response_model=List[VLANResponse])
 async def list_vlans(
+    response: Response,
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = Query(None, description="Opaque cursor from the X-Next-Cursor header of the previous page"),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    vlans = db.query(VLAN).offset(skip).limit(limit).all()
+    query = apply_keyset(select(VLAN), VLAN.id, VLAN.id, cursor)
+    if not cursor:
+        query = query.offset(skip)
+    
+    vlans = (await db.scalars(query.limit(limit))).all()
+    
+    cursor_value = next_cursor(vlans, limit, "id")
+    if cursor_value:
+        response.headers[NEXT_CURSOR_HEADER] = cursor_value
     return vlans
 
 @router.post("", response_model=VLANResponse, status_code=status.HTTP_201_CREATED)
 async def create_vlan(
     vlan_data: VLANCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(require_role([UserRole.ADMIN, UserRole.NETWORK_ENGINEER]))
 ):
     vlan = VLAN(**vlan_data.dict())
     db.add(vlan)
-    db.commit()
-    db.refresh(vlan)
-    log_audit(db, current_user.id, "create", "vlan", vlan.id, after_data=vlan_data.dict())
+    await db.commit()
+    await db.refresh(vlan)
+    await log_audit(db, current_user.id, "create", "vlan", vlan.id, after_data=vlan_data.dict())
     return vlan
 
 @router.put("/{vlan_id}", response_model=VLANResponse)
 async def update_vlan(
     vlan_id: int,
     vlan_data: VLANUpdate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(require_role([UserRole.ADMIN, UserRole.NETWORK_ENGINEER]))
 ):
-    vlan = db.query(VLAN).filter(VLAN.id == vlan_id).first()
+    vlan = await db.get(VLAN, vlan_id)
     if not vlan:
         raise HTTPException(status_code=404, detail="VLAN not found")
     
     for key, value in vlan_data.dict(exclude_unset=True).items():
         setattr(vlan, key, value)
     
-    db.commit()
-    db.refresh(vlan)
-    log_audit(db, current_user.id, "update", "vlan", vlan.id)
+    await db.commit()
+    await db.refresh(vlan)
+    await log_audit(db, current_user.id, "update", "vlan", vlan.id)
     return vlan
 
 @router.delete("/{vlan_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_vlan(
     vlan_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(require_role([UserRole.ADMIN, UserRole.NETWORK_ENGINEER]))
 ):
-    vlan = db.query(VLAN).filter(VLAN.id == vlan_id).first()
+    vlan = await db.get(VLAN, vlan_id)
     if not vlan:
         raise HTTPException(status_code=404, detail="VLAN not found")
     
-    log_audit(db, current_user.id, "delete", "vlan", vlan.id)
-    db.delete(vlan)
-    db.commit()
+    await log_audit(db, current_user.id, "delete", "vlan", vlan.id, in_transaction=True)
+    await db.delete(vlan)
+    await db.commit()
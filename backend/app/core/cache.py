@@ -0,0 +1,138 @@
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Optional
+import json
+import logging
+import time
+from app.core.config import settings
+from app.core.metrics import CACHE_HITS, CACHE_MISSES, CACHE_ERRORS, CACHE_LATENCY_SECONDS
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "ipam:"
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+class LocalCache:
+    """In-process stand-in for the handful of Redis commands the read cache uses"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def _live(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def get(self, key: str):
+        return self._live(key)
+
+    async def set(self, key: str, value, ex: Optional[float] = None):
+        expires_at = time.monotonic() + ex if ex else None
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return True
+
+    async def delete(self, *keys: str) -> int:
+        return sum(1 for key in keys if self._entries.pop(key, None) is not None)
+
+    async def incr(self, key: str) -> int:
+        value = int(self._live(key) or 0) + 1
+        self._entries[key] = (value, None)
+        return value
+
+class ReadCache:
+    """JSON read-through cache on Redis, or on LocalCache when REDIS_URL is empty.
+
+    Redis errors are logged and treated as misses, so an unavailable cache
+    only costs the database queries it would have saved.
+    """
+
+    def __init__(self, client, default_ttl: float):
+        self.client = client
+        self.default_ttl = default_ttl
+
+    async def get(self, name: str, key: str) -> Optional[Any]:
+        started = time.perf_counter()
+        try:
+            raw = await self.client.get(KEY_PREFIX + key)
+        except Exception as e:
+            CACHE_ERRORS.labels(name).inc()
+            logger.warning(f"Cache read of {key} failed: {e}")
+            return None
+        finally:
+            CACHE_LATENCY_SECONDS.labels("get").observe(time.perf_counter() - started)
+
+        if raw is None:
+            CACHE_MISSES.labels(name).inc()
+            return None
+        CACHE_HITS.labels(name).inc()
+        return json.loads(raw)
+
+    async def set(self, name: str, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        started = time.perf_counter()
+        try:
+            await self.client.set(
+                KEY_PREFIX + key,
+                json.dumps(value, default=_json_default, separators=(",", ":")),
+                ex=ttl or self.default_ttl
+            )
+        except Exception as e:
+            CACHE_ERRORS.labels(name).inc()
+            logger.warning(f"Cache write of {key} failed: {e}")
+        finally:
+            CACHE_LATENCY_SECONDS.labels("set").observe(time.perf_counter() - started)
+
+    async def delete(self, *keys: str) -> None:
+        started = time.perf_counter()
+        try:
+            await self.client.delete(*(KEY_PREFIX + key for key in keys))
+        except Exception as e:
+            CACHE_ERRORS.labels("invalidate").inc()
+            logger.warning(f"Cache delete of {', '.join(keys)} failed: {e}")
+        finally:
+            CACHE_LATENCY_SECONDS.labels("delete").observe(time.perf_counter() - started)
+
+    async def generation(self, name: str) -> Optional[int]:
+        """Current generation of a namespace, or None if the cache is unavailable.
+
+        Keys that embed the generation go stale as soon as it is bumped.
+        """
+        try:
+            return int(await self.client.get(f"{KEY_PREFIX}{name}:generation") or 0)
+        except Exception as e:
+            CACHE_ERRORS.labels(name).inc()
+            logger.warning(f"Cache generation read of {name} failed: {e}")
+            return None
+
+    async def bump(self, name: str) -> None:
+        """Invalidate every key of a namespace at once"""
+        try:
+            await self.client.incr(f"{KEY_PREFIX}{name}:generation")
+        except Exception as e:
+            CACHE_ERRORS.labels("invalidate").inc()
+            logger.warning(f"Cache generation bump of {name} failed: {e}")
+
+def _create_client():
+    if not settings.REDIS_URL:
+        return LocalCache(max_entries=settings.CACHE_LOCAL_MAX_ENTRIES)
+    import redis.asyncio as redis
+    return redis.Redis.from_url(
+        settings.REDIS_URL,
+        socket_timeout=settings.CACHE_SOCKET_TIMEOUT_SECONDS,
+        socket_connect_timeout=settings.CACHE_SOCKET_TIMEOUT_SECONDS
+    )
+
+read_cache = ReadCache(_create_client(), default_ttl=settings.CACHE_DEFAULT_TTL_SECONDS)
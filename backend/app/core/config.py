@@ -12,9 +12,20 @@ class Settings(BaseSettings):
     JWT_ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 15
     REFRESH_TOKEN_EXPIRE_DAYS: int = 7
+    PRINCIPAL_CACHE_TTL_SECONDS: float = 30.0
+    PRINCIPAL_CACHE_MAX_SIZE: int = 10000
     
-    # Redis
+    # Password hashing (bcrypt runs on a bounded thread pool, off the event loop)
+    PASSWORD_BCRYPT_ROUNDS: int = 12
+    PASSWORD_HASH_WORKERS: int = 4
+    PASSWORD_HASH_MAX_PENDING: int = 64
+    PASSWORD_HASH_RETRY_AFTER_SECONDS: int = 1
+    
+    # Redis (read cache for subnet stats and trees; empty REDIS_URL uses an in-process cache)
     REDIS_URL: str = "redis://localhost:6379/0"
+    CACHE_DEFAULT_TTL_SECONDS: float = 60.0
+    CACHE_LOCAL_MAX_ENTRIES: int = 10000
+    CACHE_SOCKET_TIMEOUT_SECONDS: float = 0.25
     
     # CORS
     CORS_ORIGINS: List[str] = ["http://localhost:3000", "http://localhost:8000"]
@@ -24,6 +35,24 @@ class Settings(BaseSettings):
     SCANNER_INTERVAL_SECONDS: int = 300
     SCANNER_TIMEOUT_SECONDS: int = 2
     SCANNER_CONCURRENT_SCANS: int = 50
+    SCANNER_RESULTS_MAX_BATCH: int = 10000
+    SCANNER_LEASE_TTL_SECONDS: int = 120
+    
+    # Subnet hierarchy
+    SUBNET_TREE_MAX_DEPTH: int = 64
+    SUBNET_TREE_CACHE_MAX_NODES: int = 5000
+    
+    # IP allocation
+    IP_ALLOCATION_MAX_RETRIES: int = 5
+    IP_ALLOCATION_RETRY_BACKOFF_SECONDS: float = 0.05
+    IP_ALLOCATION_RETRY_BACKOFF_MAX_SECONDS: float = 1.0
+    
+    # Audit logging
+    AUDIT_WRITE_BEHIND: bool = True
+    AUDIT_BATCH_SIZE: int = 500
+    AUDIT_FLUSH_INTERVAL_SECONDS: float = 1.0
+    AUDIT_QUEUE_MAX_SIZE: int = 50000
+    AUDIT_PARTITION_MONTHS_AHEAD: int = 3
     
     # Rate Limiting
     RATE_LIMIT_PER_MINUTE: int = 100
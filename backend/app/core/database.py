@@ -1,8 +1,22 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from app.core.config import settings
 
+def async_database_url(url: str) -> str:
+    """Map a database URL onto the asyncio driver of the same database"""
+    for prefix, async_prefix in (
+        ("postgresql+psycopg2://", "postgresql+asyncpg://"),
+        ("postgresql://", "postgresql+asyncpg://"),
+        ("sqlite://", "sqlite+aiosqlite://"),
+    ):
+        if url.startswith(prefix):
+            return async_prefix + url[len(prefix):]
+    return url
+
+# Synchronous engine for scripts (seed_data.py), migrations and other blocking callers
 engine = create_engine(
     settings.DATABASE_URL,
     pool_pre_ping=True,
@@ -12,11 +26,37 @@ engine = create_engine(
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Asyncio engine used by the API so database round-trips never block the event loop
+async_engine = create_async_engine(
+    async_database_url(settings.DATABASE_URL),
+    pool_pre_ping=True,
+    pool_size=10,
+    max_overflow=20
+)
+
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
-    try:
+# INSERT constructs with ON CONFLICT support, for the dialects the services run on
+_CONFLICT_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+def check_dialect(bind) -> None:
+    """Fail fast on a database the services cannot write to"""
+    if bind.dialect.name not in _CONFLICT_INSERTS:
+        raise RuntimeError(
+            f"Unsupported database '{bind.dialect.name}': DATABASE_URL must point at PostgreSQL or SQLite"
+        )
+
+def conflict_insert(db: AsyncSession, model):
+    """INSERT for model that supports on_conflict_do_update/on_conflict_do_nothing"""
+    return _CONFLICT_INSERTS[db.get_bind().dialect.name](model)
+
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
+
+async def advisory_xact_lock(db: AsyncSession, namespace: int, key: int) -> None:
+    """Take a Postgres advisory lock held until the current transaction ends (no-op elsewhere)"""
+    if db.get_bind().dialect.name == "postgresql":
+        await db.execute(text("SELECT pg_advisory_xact_lock(:namespace, :key)"), {"namespace": namespace, "key": key})
@@ -0,0 +1,77 @@
+from prometheus_client import Counter, Gauge, Histogram
+
+# Audit pipeline
+AUDIT_QUEUE_DEPTH = Gauge(
+    "ipam_audit_queue_depth",
+    "Audit records waiting to be written"
+)
+AUDIT_FLUSH_SECONDS = Histogram(
+    "ipam_audit_flush_seconds",
+    "Time spent writing one batch of audit records"
+)
+AUDIT_RECORDS_WRITTEN = Counter(
+    "ipam_audit_records_written_total",
+    "Audit records written by the write-behind queue"
+)
+AUDIT_RECORDS_DROPPED = Counter(
+    "ipam_audit_records_dropped_total",
+    "Audit records dropped because the queue was full or a flush failed"
+)
+
+# Authentication
+PRINCIPAL_CACHE_HITS = Counter(
+    "ipam_principal_cache_hits_total",
+    "Authenticated requests served from the principal cache"
+)
+PRINCIPAL_CACHE_MISSES = Counter(
+    "ipam_principal_cache_misses_total",
+    "Authenticated requests that had to load the user from the database"
+)
+PRINCIPAL_CACHE_HIT_RATIO = Gauge(
+    "ipam_principal_cache_hit_ratio",
+    "Share of principal lookups served from the cache since startup"
+)
+PASSWORD_HASH_PENDING = Gauge(
+    "ipam_password_hash_pending",
+    "Password hash and verify operations queued or running"
+)
+PASSWORD_HASH_WAIT_SECONDS = Histogram(
+    "ipam_password_hash_wait_seconds",
+    "Time a password operation waited for a free hashing worker"
+)
+PASSWORD_HASH_SECONDS = Histogram(
+    "ipam_password_hash_seconds",
+    "Time spent hashing or verifying one password",
+    ["operation"]
+)
+PASSWORD_HASH_REJECTED = Counter(
+    "ipam_password_hash_rejected_total",
+    "Password operations shed with 503 because the hashing pool was saturated"
+)
+PASSWORD_REHASHED = Counter(
+    "ipam_password_rehashed_total",
+    "Password hashes upgraded on login after the hashing parameters changed"
+)
+
+# Read cache
+CACHE_HITS = Counter(
+    "ipam_cache_hits_total",
+    "Read cache hits",
+    ["cache"]
+)
+CACHE_MISSES = Counter(
+    "ipam_cache_misses_total",
+    "Read cache misses",
+    ["cache"]
+)
+CACHE_ERRORS = Counter(
+    "ipam_cache_errors_total",
+    "Read cache operations that failed and fell back to the database",
+    ["cache"]
+)
+CACHE_LATENCY_SECONDS = Histogram(
+    "ipam_cache_latency_seconds",
+    "Latency of read cache operations",
+    ["operation"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5)
+)
@@ -0,0 +1,62 @@
+from typing import Any, Callable, List, Optional
+from datetime import datetime
+import base64
+import json
+from fastapi import HTTPException, status
+from sqlalchemy import tuple_
+
+# Response header carrying the cursor of the next page
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+def encode_cursor(values: List[Any]) -> str:
+    """Encode the (sort_key, id) of the last row of a page as an opaque cursor"""
+    raw = json.dumps(values, default=_json_default, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, expected_length: int = 2) -> List[Any]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        values = None
+    if not isinstance(values, list) or len(values) != expected_length:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    return values
+
+def apply_keyset(
+    query,
+    sort_column,
+    id_column,
+    cursor: Optional[str],
+    descending: bool = False,
+    parse_sort_key: Callable[[Any], Any] = lambda value: value
+):
+    """Order query by (sort_column, id_column) and start it after the cursor position.
+
+    Pass the id column as sort_column to page by id alone.
+    """
+    columns = [sort_column] if sort_column is id_column else [sort_column, id_column]
+    query = query.order_by(*(column.desc() if descending else column.asc() for column in columns))
+    
+    if cursor:
+        sort_key, last_id = decode_cursor(cursor)
+        try:
+            values = [parse_sort_key(sort_key), int(last_id)]
+        except (ValueError, TypeError):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+        key = tuple_(*columns)
+        position = tuple_(*values[-len(columns):])
+        query = query.filter(key < position if descending else key > position)
+    return query
+
+def next_cursor(items: List[Any], limit: int, sort_attr: str, id_attr: str = "id") -> Optional[str]:
+    """Cursor for the page after items, or None when this was the last page"""
+    if len(items) < limit:
+        return None
+    last = items[-1]
+    return encode_cursor([getattr(last, sort_attr), getattr(last, id_attr)])
@@ -1,16 +1,33 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple
+import asyncio
+import threading
+import time
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.config import settings
 from app.core.database import get_db
+from app.core.metrics import (
+    PRINCIPAL_CACHE_HITS, PRINCIPAL_CACHE_MISSES, PRINCIPAL_CACHE_HIT_RATIO,
+    PASSWORD_HASH_PENDING, PASSWORD_HASH_WAIT_SECONDS, PASSWORD_HASH_SECONDS,
+    PASSWORD_HASH_REJECTED
+)
 from app.models.user import User
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Hashes below the configured rounds are flagged for upgrade by verify_and_update()
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=settings.PASSWORD_BCRYPT_ROUNDS,
+    bcrypt__min_rounds=settings.PASSWORD_BCRYPT_ROUNDS
+)
 security = HTTPBearer()
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
@@ -19,13 +36,77 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
+class PasswordHasher:
+    """Runs bcrypt on a bounded thread pool so it never blocks the event loop.
+
+    At most max_pending operations may be queued or running; beyond that,
+    requests are shed with 503 and Retry-After instead of piling up.
+    """
+
+    def __init__(self, workers: int, max_pending: int, retry_after: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.retry_after = retry_after
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pending = 0
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hash")
+        return self._executor
+
+    async def _run(self, operation: str, func, *args):
+        if self._pending >= self.max_pending:
+            PASSWORD_HASH_REJECTED.inc()
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Authentication is busy, try again shortly",
+                headers={"Retry-After": str(self.retry_after)}
+            )
+        
+        submitted = time.perf_counter()
+        
+        def timed():
+            started = time.perf_counter()
+            PASSWORD_HASH_WAIT_SECONDS.observe(started - submitted)
+            try:
+                return func(*args)
+            finally:
+                PASSWORD_HASH_SECONDS.labels(operation).observe(time.perf_counter() - started)
+        
+        self._pending += 1
+        PASSWORD_HASH_PENDING.set(self._pending)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._get_executor(), timed)
+        finally:
+            self._pending -= 1
+            PASSWORD_HASH_PENDING.set(self._pending)
+
+    async def hash(self, password: str) -> str:
+        return await self._run("hash", pwd_context.hash, password)
+
+    async def verify_and_update(self, plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """Verify a password; the second item is a replacement hash when the stored one is outdated"""
+        return await self._run("verify", pwd_context.verify_and_update, plain_password, hashed_password)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+password_hasher = PasswordHasher(
+    workers=settings.PASSWORD_HASH_WORKERS,
+    max_pending=settings.PASSWORD_HASH_MAX_PENDING,
+    retry_after=settings.PASSWORD_HASH_RETRY_AFTER_SECONDS
+)
+
 def create_access_token(data: Dict[str, Any], expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire, "type": "access"})
+    to_encode.update({"exp": expire, "iat": datetime.utcnow(), "type": "access"})
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.JWT_ALGORITHM)
     return encoded_jwt
 
@@ -47,9 +128,79 @@ def decode_token(token: str) -> Dict[str, Any]:
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+class PrincipalCache:
+    """Per-process LRU cache of active users, keyed by (user id, token issue time).
+
+    Entries expire after ttl seconds, so changes made by other workers are
+    picked up within that window; changes made here call invalidate().
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: "OrderedDict[Tuple[Any, Any], Tuple[float, User]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, user_id, issued_at) -> Optional[User]:
+        key = (user_id, issued_at)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self._record(hit=True)
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self._record(hit=False)
+        return None
+
+    def put(self, user_id, issued_at, user: User) -> None:
+        principal = self._detach(user)
+        with self._lock:
+            self._entries[(user_id, issued_at)] = (time.monotonic() + self.ttl, principal)
+            self._entries.move_to_end((user_id, issued_at))
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id) -> None:
+        """Forget every cached principal of a user"""
+        with self._lock:
+            for key in [key for key in self._entries if str(key[0]) == str(user_id)]:
+                del self._entries[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def _record(self, hit: bool) -> None:
+        if hit:
+            self._hits += 1
+            PRINCIPAL_CACHE_HITS.inc()
+        else:
+            self._misses += 1
+            PRINCIPAL_CACHE_MISSES.inc()
+        PRINCIPAL_CACHE_HIT_RATIO.set(self._hits / (self._hits + self._misses))
+
+    @staticmethod
+    def _detach(user: User) -> User:
+        """Copy the column values into a transient User that no session can expire"""
+        return User(**{
+            attr.key: getattr(user, attr.key)
+            for attr in User.__mapper__.column_attrs
+            if attr.key != "hashed_password"
+        })
+
+principal_cache = PrincipalCache(
+    ttl=settings.PRINCIPAL_CACHE_TTL_SECONDS,
+    max_size=settings.PRINCIPAL_CACHE_MAX_SIZE
+)
+
 async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ) -> User:
     token = credentials.credentials
     payload = decode_token(token)
@@ -67,7 +218,12 @@ async def get_current_user(
             detail="Could not validate credentials"
         )
     
-    user = db.query(User).filter(User.id == user_id).first()
+    issued_at = payload.get("iat")
+    user = principal_cache.get(user_id, issued_at)
+    if user is not None:
+        return user
+    
+    user = await db.scalar(select(User).where(User.id == user_id))
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -80,6 +236,7 @@ async def get_current_user(
             detail="Inactive user"
         )
     
+    principal_cache.put(user_id, issued_at, user)
     return user
 
 def require_role(allowed_roles: list):
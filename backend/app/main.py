@@ -7,9 +7,12 @@ import time
 import logging
 
 from app.core.config import settings
-from app.core.database import engine
+from app.core.database import async_engine, check_dialect
 from app.models import base
 from app.api.v1 import api_router
+from app.core.pagination import NEXT_CURSOR_HEADER
+from app.core.security import password_hasher
+from app.services.audit_service import audit_writer, ensure_audit_partitions
 
 # Configure logging
 logging.basicConfig(
@@ -35,6 +38,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
 
 # Security headers middleware
@@ -84,10 +88,20 @@ async def startup_event():
     logger.info("Starting IPAM API...")
     logger.info(f"Environment: {settings.ENVIRONMENT}")
     logger.info(f"Debug mode: {settings.DEBUG}")
+    check_dialect(async_engine)
+    try:
+        await ensure_audit_partitions(async_engine)
+    except Exception as e:
+        logger.warning(f"Could not create audit log partitions: {e}")
+    if settings.AUDIT_WRITE_BEHIND:
+        audit_writer.start()
 
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info("Shutting down IPAM API...")
+    await audit_writer.stop()
+    password_hasher.shutdown()
+    await async_engine.dispose()
 
 if __name__ == "__main__":
     import uvicorn
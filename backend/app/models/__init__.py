@@ -5,5 +5,7 @@ from app.models.ip_address import IPAddress
 from app.models.device import Device
 from app.models.vlan import VLAN
 from app.models.audit_log import AuditLog
+from app.models.subnet_usage import SubnetUsage
+from app.models.scan_lease import ScanLease
 
-__all__ = ["Base", "User", "Subnet", "IPAddress", "Device", "VLAN", "AuditLog"]
+__all__ = ["Base", "User", "Subnet", "IPAddress", "Device", "VLAN", "AuditLog", "SubnetUsage", "ScanLease"]
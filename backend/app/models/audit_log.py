@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, JSON, Text
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, JSON, Text, Index
 from sqlalchemy.dialects.postgresql import INET
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
@@ -6,6 +6,11 @@ from app.core.database import Base
 
 class AuditLog(Base):
     __tablename__ = "audit_logs"
+    # On Postgres the table is range-partitioned by month on timestamp, so its
+    # primary key there is (id, timestamp); see migration 003.
+    __table_args__ = (
+        Index("ix_audit_logs_timestamp_id", "timestamp", "id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
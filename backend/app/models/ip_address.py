@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, JSON, Enum as SQLEnum
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, JSON, Index, Enum as SQLEnum
 from sqlalchemy.dialects.postgresql import INET
 from sqlalchemy.orm import relationship
 import enum
@@ -13,6 +13,9 @@ class IPStatus(str, enum.Enum):
 
 class IPAddress(Base, TimestampMixin):
     __tablename__ = "ip_addresses"
+    __table_args__ = (
+        Index("ix_ip_addresses_address_gist", "address", postgresql_using="gist", postgresql_ops={"address": "inet_ops"}),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     address = Column(INET, unique=True, index=True, nullable=False)
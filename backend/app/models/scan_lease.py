@@ -0,0 +1,18 @@
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime
+from app.core.database import Base
+
+class ScanLease(Base):
+    """Which scanner agent scans a subnet, for how long.
+
+    One row per subnet, created on the first claim. A lease is free when it
+    has no holder or has expired. requested_by names an agent waiting for the
+    subnet; the holder hands it over at its next renewal. See
+    app/services/lease_service.py.
+    """
+    __tablename__ = "scan_leases"
+    
+    subnet_id = Column(Integer, ForeignKey("subnets.id", ondelete="CASCADE"), primary_key=True)
+    holder = Column(String(255), nullable=True, index=True)
+    expires_at = Column(DateTime(timezone=True), nullable=True, index=True)
+    claimed_at = Column(DateTime(timezone=True), nullable=True)
+    requested_by = Column(String(255), nullable=True)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, JSON
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, JSON, Index
 from sqlalchemy.dialects.postgresql import INET
 from sqlalchemy.orm import relationship
 from app.core.database import Base
@@ -6,6 +6,9 @@ from app.models.base import TimestampMixin
 
 class Subnet(Base, TimestampMixin):
     __tablename__ = "subnets"
+    __table_args__ = (
+        Index("ix_subnets_cidr_gist", "cidr", postgresql_using="gist", postgresql_ops={"cidr": "inet_ops"}),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     cidr = Column(INET, unique=True, index=True, nullable=False)
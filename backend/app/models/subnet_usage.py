@@ -0,0 +1,17 @@
+from sqlalchemy import Column, Integer, ForeignKey, DateTime
+from sqlalchemy.sql import func
+from app.core.database import Base
+
+class SubnetUsage(Base):
+    """Per-subnet IP counters by status, maintained alongside every IP write.
+
+    A subnet without a row has no addresses yet. See app/services/usage_service.py.
+    """
+    __tablename__ = "subnet_usage"
+    
+    subnet_id = Column(Integer, ForeignKey("subnets.id", ondelete="CASCADE"), primary_key=True)
+    free_count = Column(Integer, default=0, server_default="0", nullable=False)
+    assigned_count = Column(Integer, default=0, server_default="0", nullable=False)
+    reserved_count = Column(Integer, default=0, server_default="0", nullable=False)
+    quarantined_count = Column(Integer, default=0, server_default="0", nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
@@ -1,7 +1,9 @@
 from pydantic import BaseModel, Field, validator
-from typing import Optional, Dict
-from datetime import datetime
+from typing import Optional, Dict, List
+from datetime import datetime, timezone
+from enum import Enum
 from app.models.ip_address import IPStatus
+from app.services.ip_allocator import AllocationStrategy
 import ipaddress
 
 class IPAddressBase(BaseModel):
@@ -28,6 +30,17 @@ class IPAddressAllocate(BaseModel):
     subnet_id: int
     count: int = Field(1, ge=1, le=100)
     hostname: Optional[str] = None
+    strategy: AllocationStrategy = AllocationStrategy.SEQUENTIAL
+    mac_address: Optional[str] = Field(None, description="Required for the eui64 strategy")
+    
+    @validator('mac_address', always=True)
+    def validate_eui64(cls, v, values):
+        if values.get('strategy') == AllocationStrategy.EUI64:
+            if not v:
+                raise ValueError('mac_address is required for the eui64 strategy')
+            if values.get('count', 1) != 1:
+                raise ValueError('eui64 allocates exactly one address per MAC')
+        return v
 
 class IPAddressAssign(BaseModel):
     device_id: int
@@ -42,15 +55,22 @@ class IPAddressUpdate(BaseModel):
     mac_address: Optional[str] = None
     interface: Optional[str] = None
     metadata: Optional[Dict] = None
+    
+    @validator('status')
+    def validate_status(cls, v):
+        if v == IPStatus.FREE:
+            raise ValueError('Free addresses are not stored; delete the address to release it')
+        return v
 
 class IPAddressResponse(IPAddressBase):
-    id: int
+    # Free addresses are synthesized from the subnet range and have no row
+    id: Optional[int]
     assigned_to_id: Optional[int]
     lease_expires: Optional[datetime]
     last_seen: Optional[datetime]
     created_by_id: Optional[int]
-    created_at: datetime
-    updated_at: datetime
+    created_at: Optional[datetime]
+    updated_at: Optional[datetime]
     
     class Config:
         from_attributes = True
@@ -59,3 +79,41 @@ class IPConflictResolve(BaseModel):
     action: str = Field(..., description="release, reassign, or quarantine")
     target_ip_id: Optional[int] = None
     new_device_id: Optional[int] = None
+
+class ScanReachability(str, Enum):
+    REACHABLE = "reachable"
+    UNREACHABLE = "unreachable"
+
+class ScanResultItem(BaseModel):
+    id: Optional[int] = None
+    address: Optional[str] = None
+    last_seen: Optional[datetime] = None
+    reachability: ScanReachability
+    open_ports: List[int] = []
+    
+    @validator('address')
+    def validate_ip(cls, v):
+        if v is None:
+            return v
+        try:
+            return str(ipaddress.ip_address(v))
+        except ValueError:
+            raise ValueError('Invalid IP address')
+    
+    @validator('last_seen')
+    def assume_utc(cls, v):
+        if v is not None and v.tzinfo is None:
+            return v.replace(tzinfo=timezone.utc)
+        return v
+    
+    @validator('open_ports', each_item=True)
+    def validate_port(cls, v):
+        if not 0 < v < 65536:
+            raise ValueError('Invalid port')
+        return v
+    
+    @validator('reachability')
+    def require_key(cls, v, values):
+        if values.get('id') is None and values.get('address') is None:
+            raise ValueError('Either id or address is required')
+        return v
@@ -0,0 +1,31 @@
+from pydantic import BaseModel, Field
+from typing import Optional, List
+from datetime import datetime
+
+class LeaseClaim(BaseModel):
+    holder: str = Field(..., min_length=1, max_length=255, description="Stable id of the scanner agent")
+    ttl_seconds: Optional[int] = Field(None, ge=5, le=3600, description="Lease lifetime; renew well before it runs out")
+    limit: Optional[int] = Field(None, ge=1, description="Never hold more than this many subnets")
+
+class LeaseRenew(BaseModel):
+    holder: str = Field(..., min_length=1, max_length=255)
+    ttl_seconds: Optional[int] = Field(None, ge=5, le=3600)
+
+class LeaseRelease(BaseModel):
+    holder: str = Field(..., min_length=1, max_length=255)
+    subnet_ids: Optional[List[int]] = Field(None, description="Leases to give back; all of them when omitted")
+
+class LeaseSet(BaseModel):
+    holder: str
+    subnet_ids: List[int]
+    ttl_seconds: int
+
+class ScanLeaseResponse(BaseModel):
+    subnet_id: int
+    holder: Optional[str]
+    expires_at: Optional[datetime]
+    claimed_at: Optional[datetime]
+    requested_by: Optional[str]
+    
+    class Config:
+        from_attributes = True
@@ -2,6 +2,7 @@ from pydantic import BaseModel, Field, validator
 from typing import Optional, List, Dict
 from datetime import datetime
 import ipaddress
+from app.services.reserved_ranges import normalize_reserved_ranges
 
 class SubnetBase(BaseModel):
     cidr: str = Field(..., description="CIDR notation (e.g., 10.0.0.0/24)")
@@ -21,7 +22,11 @@ class SubnetBase(BaseModel):
         return v
 
 class SubnetCreate(SubnetBase):
-    pass
+    @validator('reserved_ranges')
+    def normalize_reserved(cls, v, values):
+        if v is None or 'cidr' not in values:
+            return v
+        return normalize_reserved_ranges(values['cidr'], v)
 
 class SubnetUpdate(BaseModel):
     description: Optional[str] = None
@@ -30,6 +35,13 @@ class SubnetUpdate(BaseModel):
     reserved_ranges: Optional[List[Dict[str, str]]] = None
     tags: Optional[List[str]] = None
 
+class SubnetPrefixAllocate(BaseModel):
+    prefix_length: int = Field(..., ge=0, le=128, description="Prefix length of the child to carve out")
+    description: Optional[str] = None
+    vlan_id: Optional[int] = None
+    location: Optional[str] = None
+    tags: Optional[List[str]] = []
+
 class SubnetResponse(SubnetBase):
     id: int
     created_by_id: Optional[int]
@@ -43,5 +55,7 @@ class SubnetWithStats(SubnetResponse):
     total_ips: int
     used_ips: int
     free_ips: int
+    total_ips_exact: Optional[str] = None
+    free_ips_exact: Optional[str] = None
     utilization_percent: float
     children_count: int
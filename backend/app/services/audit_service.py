@@ -1,9 +1,133 @@
-from sqlalchemy.orm import Session
-from typing import Optional, Dict, Any
+from sqlalchemy import insert, text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from typing import Optional, Dict, Any, List, Tuple
+from collections import deque
+from datetime import datetime, timezone
+from itertools import groupby
+import asyncio
+import logging
+import time
+from app.core.config import settings
+from app.core.metrics import (
+    AUDIT_QUEUE_DEPTH, AUDIT_FLUSH_SECONDS, AUDIT_RECORDS_WRITTEN, AUDIT_RECORDS_DROPPED
+)
 from app.models.audit_log import AuditLog
 
-def log_audit(
-    db: Session,
+logger = logging.getLogger(__name__)
+
+class AuditWriter:
+    """Write-behind queue for audit records.
+
+    Records are buffered in memory and written with multi-row inserts when
+    the batch size is reached, every flush interval, and on shutdown. The
+    flusher is an asyncio task on the application's event loop.
+    """
+
+    def __init__(self, batch_size: int, flush_interval: float, max_queue_size: int):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue_size = max_queue_size
+        self._queue: deque = deque()
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if self.running:
+            return
+        self._wake = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run(), name="audit-writer")
+
+    async def stop(self):
+        """Stop the background flusher and write whatever is still queued"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def enqueue(self, bind, record: Dict[str, Any]) -> bool:
+        """Queue a record for the given engine; returns False if it was dropped"""
+        if len(self._queue) >= self.max_queue_size:
+            AUDIT_RECORDS_DROPPED.inc()
+            logger.warning("Audit queue full, dropping %s record", record.get("action"))
+            return False
+        self._queue.append((bind, record))
+        depth = len(self._queue)
+        AUDIT_QUEUE_DEPTH.set(depth)
+        if depth >= self.batch_size and self._wake is not None:
+            self._wake.set()
+        return True
+
+    async def flush(self) -> int:
+        """Write all queued records; returns how many were written"""
+        written = 0
+        while self._queue:
+            batch: List[Tuple[Any, Dict[str, Any]]] = [
+                self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))
+            ]
+            AUDIT_QUEUE_DEPTH.set(len(self._queue))
+            written += await self._write(batch)
+        return written
+
+    async def _write(self, batch: List[Tuple[Any, Dict[str, Any]]]) -> int:
+        written = 0
+        start = time.perf_counter()
+        for bind, items in groupby(batch, key=lambda item: item[0]):
+            rows = [record for _, record in items]
+            try:
+                async with AsyncSession(bind=bind) as session:
+                    await session.execute(insert(AuditLog), rows)
+                    await session.commit()
+                written += len(rows)
+            except Exception:
+                logger.exception("Batch insert of %d audit records failed, retrying one by one", len(rows))
+                written += await self._write_rows(bind, rows)
+        AUDIT_FLUSH_SECONDS.observe(time.perf_counter() - start)
+        AUDIT_RECORDS_WRITTEN.inc(written)
+        return written
+
+    async def _write_rows(self, bind, rows: List[Dict[str, Any]]) -> int:
+        """Insert rows individually so one bad record does not cost the whole batch"""
+        written = 0
+        async with AsyncSession(bind=bind) as session:
+            for row in rows:
+                try:
+                    await session.execute(insert(AuditLog), [row])
+                    await session.commit()
+                    written += 1
+                except Exception:
+                    await session.rollback()
+                    AUDIT_RECORDS_DROPPED.inc()
+                    logger.exception("Dropping audit record %s", row.get("action"))
+        return written
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Audit flush failed")
+
+audit_writer = AuditWriter(
+    batch_size=settings.AUDIT_BATCH_SIZE,
+    flush_interval=settings.AUDIT_FLUSH_INTERVAL_SECONDS,
+    max_queue_size=settings.AUDIT_QUEUE_MAX_SIZE
+)
+
+async def log_audit(
+    db: AsyncSession,
     user_id: Optional[int],
     action: str,
     target_type: str,
@@ -11,18 +135,71 @@ def log_audit(
     before_data: Optional[Dict[str, Any]] = None,
     after_data: Optional[Dict[str, Any]] = None,
     ip_address: Optional[str] = None,
-    details: Optional[str] = None
+    details: Optional[str] = None,
+    in_transaction: bool = False
 ):
-    audit_log = AuditLog(
-        user_id=user_id,
-        action=action,
-        target_type=target_type,
-        target_id=target_id,
-        before_data=before_data,
-        after_data=after_data,
-        ip_address=ip_address,
-        details=details
-    )
+    """Record an audit event.
+
+    By default the record goes to the write-behind queue. With
+    in_transaction=True it is added to the caller's session and commits or
+    rolls back together with the caller's own changes. When the writer is
+    not running (scripts, tests) the record is committed immediately.
+    """
+    values = {
+        "user_id": user_id,
+        "action": action,
+        "target_type": target_type,
+        "target_id": target_id,
+        "before_data": before_data,
+        "after_data": after_data,
+        "ip_address": ip_address,
+        "details": details,
+        "timestamp": datetime.now(timezone.utc),
+    }
+
+    if not in_transaction and audit_writer.running:
+        audit_writer.enqueue(db.bind, values)
+        return None
+
+    audit_log = AuditLog(**values)
     db.add(audit_log)
-    db.commit()
+    if not in_transaction:
+        await db.commit()
     return audit_log
+
+async def ensure_audit_partitions(bind: AsyncEngine, months_ahead: Optional[int] = None) -> List[str]:
+    """Create monthly audit_logs partitions from this month up to months_ahead (Postgres only)"""
+    if bind.dialect.name != "postgresql":
+        return []
+    months_ahead = settings.AUDIT_PARTITION_MONTHS_AHEAD if months_ahead is None else months_ahead
+    async with bind.begin() as conn:
+        rows = await conn.execute(text("""
+            SELECT audit_logs_ensure_partition(date_trunc('month', now()) + make_interval(months => n))
+            FROM generate_series(0, :months_ahead) AS n
+        """), {"months_ahead": months_ahead})
+        return [row[0] for row in rows]
+
+async def detach_audit_partitions(bind: AsyncEngine, before: datetime) -> List[str]:
+    """Detach monthly audit_logs partitions that end on or before the given time.
+
+    Detached tables keep their data and can be archived or dropped separately.
+    """
+    if bind.dialect.name != "postgresql":
+        return []
+    detached = []
+    async with bind.begin() as conn:
+        partitions = (await conn.execute(text("""
+            SELECT child.relname
+            FROM pg_inherits
+            JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE parent.relname = 'audit_logs' AND child.relname ~ '^audit_logs_[0-9]{4}_[0-9]{2}$'
+            ORDER BY child.relname
+        """))).scalars().all()
+        for name in partitions:
+            year, month = int(name[-7:-3]), int(name[-2:])
+            end = datetime(year + month // 12, month % 12 + 1, 1, tzinfo=timezone.utc)
+            if end <= before:
+                await conn.execute(text(f'ALTER TABLE audit_logs DETACH PARTITION "{name}"'))
+                detached.append(name)
+    return detached
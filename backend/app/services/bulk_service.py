@@ -1,96 +1,265 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import select, insert, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from collections import Counter
 import csv
 import io
-from typing import Dict
+import ipaddress
+import time
+import zlib
+from typing import AsyncIterable, AsyncIterator, Callable, Dict, List, TextIO, Tuple, Union
 from app.models.subnet import Subnet
 from app.models.ip_address import IPAddress, IPStatus
+from app.services.ip_allocator import invalidate_allocator
+from app.services.subnet_service import invalidate_subnet_cache
+from app.services.usage_service import apply_usage
+
+# Rows fetched per round-trip when streaming exports
+EXPORT_BATCH_SIZE = 1000
+# Valid rows loaded and committed together during imports
+IMPORT_CHUNK_SIZE = 5000
+# Per-row errors returned to the caller; the rest are only counted
+MAX_REPORTED_ERRORS = 1000
+
+def _text_stream(source: Union[str, TextIO]) -> TextIO:
+    return io.StringIO(source) if isinstance(source, str) else source
 
 class BulkService:
-    def __init__(self, db: Session):
+    def __init__(self, db: AsyncSession):
         self.db = db
     
-    def import_subnets_csv(self, csv_content: str, user_id: int) -> Dict:
+    async def import_subnets_csv(self, source: Union[str, TextIO], user_id: int) -> Dict:
         """Import subnets from CSV"""
-        reader = csv.DictReader(io.StringIO(csv_content))
+        reader = csv.DictReader(_text_stream(source))
         created = 0
         errors = []
         
         for row in reader:
+            line_no = reader.line_num
             try:
-                subnet = Subnet(
-                    cidr=row['cidr'],
-                    description=row.get('description'),
-                    location=row.get('location'),
-                    created_by_id=user_id
-                )
-                self.db.add(subnet)
+                ipaddress.ip_network(row['cidr'], strict=False)
+                # A savepoint per row keeps one bad subnet from poisoning the rest
+                async with self.db.begin_nested():
+                    self.db.add(Subnet(
+                        cidr=row['cidr'],
+                        description=row.get('description'),
+                        location=row.get('location'),
+                        created_by_id=user_id
+                    ))
                 created += 1
-            except Exception as e:
-                errors.append(f"Row {created + 1}: {str(e)}")
+            except (KeyError, ValueError) as e:
+                errors.append(f"Row {line_no}: {str(e)}")
+            except IntegrityError:
+                errors.append(f"Row {line_no}: subnet {row['cidr']} already exists")
         
-        self.db.commit()
+        await self.db.commit()
+        await invalidate_subnet_cache()
         return {"created": created, "errors": errors}
     
-    def import_ips_csv(self, csv_content: str, user_id: int) -> Dict:
-        """Import IPs from CSV"""
-        reader = csv.DictReader(io.StringIO(csv_content))
-        created = 0
-        errors = []
+    async def import_ips_csv(self, source: Union[str, TextIO], user_id: int) -> Dict:
+        """Import IPs from CSV in validated chunks.
+        
+        The CSV is read incrementally and each chunk of IMPORT_CHUNK_SIZE valid
+        rows is loaded and committed on its own, so memory stays constant and a
+        bad row only costs itself. On Postgres chunks go through COPY into a
+        staging table and are merged with INSERT ... ON CONFLICT.
+        """
+        started = time.perf_counter()
+        reader = csv.DictReader(_text_stream(source))
+        result = {"created": 0, "skipped": 0, "failed": 0, "errors": []}
+        networks: Dict = {}
+        subnet_ids = set()
+        chunk: List[Tuple[int, Dict]] = []
+        rows_read = 0
         
         for row in reader:
+            rows_read += 1
+            line_no = reader.line_num
             try:
-                ip = IPAddress(
-                    address=row['address'],
-                    subnet_id=int(row['subnet_id']),
-                    status=IPStatus(row.get('status', 'free')),
-                    hostname=row.get('hostname'),
-                    created_by_id=user_id
-                )
-                self.db.add(ip)
-                created += 1
-            except Exception as e:
-                errors.append(f"Row {created + 1}: {str(e)}")
+                values = await self._validate_ip_row(row, user_id, networks)
+            except (KeyError, ValueError) as e:
+                self._record_error(result, line_no, str(e))
+                continue
+            if values["status"] == IPStatus.FREE:
+                # Free addresses are implied by the subnet range and never stored
+                result["skipped"] += 1
+                continue
+            chunk.append((line_no, values))
+            subnet_ids.add(values["subnet_id"])
+            if len(chunk) >= IMPORT_CHUNK_SIZE:
+                await self._load_ip_chunk(chunk, result)
+                chunk = []
+        if chunk:
+            await self._load_ip_chunk(chunk, result)
         
-        self.db.commit()
-        return {"created": created, "errors": errors}
+        for subnet_id in subnet_ids:
+            invalidate_allocator(subnet_id)
+        await invalidate_subnet_cache(*subnet_ids)
+        
+        elapsed = time.perf_counter() - started
+        result["rows"] = rows_read
+        result["elapsed_seconds"] = round(elapsed, 3)
+        result["rows_per_second"] = round(rows_read / elapsed, 1) if elapsed > 0 else rows_read
+        return result
     
-    def export_subnets_csv(self) -> str:
-        """Export subnets to CSV"""
-        subnets = self.db.query(Subnet).all()
+    async def _validate_ip_row(self, row: Dict, user_id: int, networks: Dict) -> Dict:
+        address = ipaddress.ip_address((row.get('address') or '').strip())
+        subnet_id = int(row['subnet_id'])
+        if subnet_id not in networks:
+            cidr = await self.db.scalar(select(Subnet.cidr).where(Subnet.id == subnet_id))
+            networks[subnet_id] = ipaddress.ip_network(str(cidr), strict=False) if cidr else None
+        network = networks[subnet_id]
+        if network is None:
+            raise ValueError(f"subnet {subnet_id} does not exist")
+        if address not in network:
+            raise ValueError(f"{address} is not inside {network}")
+        return {
+            "address": str(address),
+            "subnet_id": subnet_id,
+            "status": IPStatus(row.get('status') or 'reserved'),
+            "hostname": row.get('hostname') or None,
+            "created_by_id": user_id,
+        }
+    
+    @staticmethod
+    def _record_error(result: Dict, line_no: int, message: str):
+        result["failed"] += 1
+        if len(result["errors"]) < MAX_REPORTED_ERRORS:
+            result["errors"].append(f"Row {line_no}: {message}")
+    
+    async def _load_ip_chunk(self, chunk: List[Tuple[int, Dict]], result: Dict):
+        if self.db.get_bind().dialect.name == "postgresql":
+            inserted = await self._copy_ip_chunk(chunk)
+        else:
+            inserted = await self._insert_ip_chunk(chunk)
         
-        output = io.StringIO()
-        writer = csv.writer(output)
-        writer.writerow(['id', 'cidr', 'description', 'location', 'vlan_id', 'created_at'])
-        
-        for subnet in subnets:
-            writer.writerow([
-                subnet.id,
-                str(subnet.cidr),
-                subnet.description or '',
-                subnet.location or '',
-                subnet.vlan_id or '',
-                subnet.created_at
-            ])
-        
-        return output.getvalue()
+        seen = set()
+        usage = Counter()
+        for line_no, values in chunk:
+            address = values["address"]
+            if address in inserted and address not in seen:
+                result["created"] += 1
+                usage[(values["subnet_id"], values["status"])] += 1
+            else:
+                self._record_error(result, line_no, f"address {address} already exists")
+            seen.add(address)
+        
+        # Counters commit together with the chunk they describe
+        await apply_usage(self.db, usage)
+        await self.db.commit()
+    
+    async def _copy_ip_chunk(self, chunk: List[Tuple[int, Dict]]) -> set:
+        """COPY a chunk into a staging table and merge it; returns the inserted addresses (uncommitted)"""
+        await self.db.execute(text("""
+            CREATE TEMP TABLE IF NOT EXISTS ip_import_staging (
+                address TEXT,
+                subnet_id INTEGER,
+                status TEXT,
+                hostname VARCHAR(255),
+                created_by_id INTEGER
+            ) ON COMMIT DELETE ROWS
+        """))
+        
+        # Binary COPY on the session's own asyncpg connection, inside its transaction
+        connection = await self.db.connection()
+        raw_connection = await connection.get_raw_connection()
+        await raw_connection.driver_connection.copy_records_to_table(
+            "ip_import_staging",
+            records=[
+                (values["address"], values["subnet_id"], values["status"].name, values["hostname"], values["created_by_id"])
+                for _, values in chunk
+            ],
+            columns=["address", "subnet_id", "status", "hostname", "created_by_id"]
+        )
+        rows = (await self.db.execute(text("""
+            INSERT INTO ip_addresses (address, subnet_id, status, hostname, created_by_id)
+            SELECT address::inet, subnet_id, status::ipstatus, hostname, created_by_id
+            FROM ip_import_staging
+            ON CONFLICT (address) DO NOTHING
+            RETURNING host(address)
+        """))).scalars().all()
+        return set(rows)
+    
+    async def _insert_ip_chunk(self, chunk: List[Tuple[int, Dict]]) -> set:
+        """Multi-row insert of a chunk, falling back to per-row savepoints on conflicts (uncommitted)"""
+        rows = [values for _, values in chunk]
+        try:
+            async with self.db.begin_nested():
+                await self.db.execute(insert(IPAddress), rows)
+            return {values["address"] for values in rows}
+        except IntegrityError:
+            pass
+        
+        inserted = set()
+        for values in rows:
+            try:
+                async with self.db.begin_nested():
+                    await self.db.execute(insert(IPAddress), [values])
+                inserted.add(values["address"])
+            except IntegrityError:
+                continue
+        return inserted
     
-    def export_ips_csv(self) -> str:
+    async def export_subnets_csv(self) -> str:
+        """Export subnets to CSV"""
+        return "".join([chunk async for chunk in self.iter_subnets_csv()])
+    
+    async def export_ips_csv(self) -> str:
         """Export IPs to CSV"""
-        ips = self.db.query(IPAddress).all()
+        return "".join([chunk async for chunk in self.iter_ips_csv()])
+    
+    def iter_subnets_csv(self) -> AsyncIterator[str]:
+        """Stream subnets as CSV chunks"""
+        header = ['id', 'cidr', 'description', 'location', 'vlan_id', 'created_at']
+        query = select(
+            Subnet.id, Subnet.cidr, Subnet.description, Subnet.location, Subnet.vlan_id, Subnet.created_at
+        ).order_by(Subnet.id)
+        
+        def to_row(row):
+            return [row.id, str(row.cidr), row.description or '', row.location or '', row.vlan_id or '', row.created_at]
         
+        return self._iter_csv(header, query, to_row)
+    
+    def iter_ips_csv(self) -> AsyncIterator[str]:
+        """Stream IPs as CSV chunks"""
+        header = ['id', 'address', 'subnet_id', 'status', 'hostname', 'device_id', 'created_at']
+        query = select(
+            IPAddress.id, IPAddress.address, IPAddress.subnet_id, IPAddress.status,
+            IPAddress.hostname, IPAddress.assigned_to_id, IPAddress.created_at
+        ).order_by(IPAddress.id)
+        
+        def to_row(row):
+            return [
+                row.id, str(row.address), row.subnet_id, row.status.value,
+                row.hostname or '', row.assigned_to_id or '', row.created_at
+            ]
+        
+        return self._iter_csv(header, query, to_row)
+    
+    async def _iter_csv(self, header: List[str], query, to_row: Callable) -> AsyncIterator[str]:
+        """Render query results as CSV, one chunk per fetched batch.
+        
+        Rows come from a server-side cursor in batches of EXPORT_BATCH_SIZE,
+        on a session of its own so the stream can outlive the request session.
+        """
         output = io.StringIO()
         writer = csv.writer(output)
-        writer.writerow(['id', 'address', 'subnet_id', 'status', 'hostname', 'device_id', 'created_at'])
-        
-        for ip in ips:
-            writer.writerow([
-                ip.id,
-                str(ip.address),
-                ip.subnet_id,
-                ip.status.value,
-                ip.hostname or '',
-                ip.assigned_to_id or '',
-                ip.created_at
-            ])
-        
-        return output.getvalue()
+        writer.writerow(header)
+        yield output.getvalue()
+        
+        async with AsyncSession(bind=self.db.bind) as session:
+            result = await session.stream(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+            async for batch in result.partitions():
+                output.seek(0)
+                output.truncate()
+                writer.writerows(to_row(row) for row in batch)
+                yield output.getvalue()
+
+async def gzip_stream(chunks: AsyncIterable[str]) -> AsyncIterator[bytes]:
+    """Gzip-compress text chunks on the fly"""
+    compressor = zlib.compressobj(wbits=31)
+    async for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
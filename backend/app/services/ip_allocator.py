@@ -0,0 +1,325 @@
+from collections import OrderedDict
+from typing import Any, Iterable, Iterator, List, Optional, Tuple
+import bisect
+import enum
+import ipaddress
+import re
+import secrets
+import threading
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models.subnet import Subnet
+from app.models.ip_address import IPAddress
+from app.models.subnet_usage import SubnetUsage
+from app.services.prefix_allocator import network_span
+from app.services.reserved_ranges import ReservedSpans
+
+# Upper bound on the number of subnets whose occupancy map is kept in memory
+MAX_CACHED_SUBNETS = 1024
+# Random draws per address before random allocation falls back to a scan
+RANDOM_ATTEMPTS = 16
+
+_MAC_SEPARATORS = re.compile(r"[:\-.]")
+
+
+class AllocationStrategy(str, enum.Enum):
+    SEQUENTIAL = "sequential"
+    RANDOM = "random"
+    EUI64 = "eui64"
+
+
+def address_to_int(address) -> int:
+    """Convert an INET value (with or without a prefix length) to its integer form"""
+    return int(ipaddress.ip_interface(str(address)).ip)
+
+
+def eui64_interface_id(mac_address: str) -> int:
+    """Modified EUI-64 interface identifier of a MAC address (RFC 4291, appendix A)"""
+    digits = _MAC_SEPARATORS.sub("", mac_address or "")
+    if len(digits) != 12:
+        raise ValueError(f"Invalid MAC address: {mac_address}")
+    try:
+        mac = int(digits, 16)
+    except ValueError:
+        raise ValueError(f"Invalid MAC address: {mac_address}")
+    # Insert FFFE between the OUI and the NIC half and flip the universal/local bit
+    interface_id = ((mac >> 24) << 40) | (0xFFFE << 24) | (mac & 0xFFFFFF)
+    return interface_id ^ (1 << 57)
+
+
+def host_bounds(network) -> Tuple[int, int]:
+    """First and last usable host of a network, matching network.hosts()"""
+    first = int(network.network_address)
+    last = int(network.broadcast_address)
+    if network.version == 4 and network.prefixlen < 31:
+        return first + 1, last - 1
+    if network.version == 6 and network.prefixlen < 127:
+        # The Subnet-Router anycast address is never handed out
+        return first + 1, last
+    return first, last
+
+
+class AddressAllocator:
+    """Occupancy map of a single subnet.
+
+    Used addresses are kept as sorted, non-overlapping runs of integers
+    (run-length encoded), so finding the next free address is a bisect over
+    the runs rather than a walk over every host in the subnet. Addresses
+    are plain Python integers, which covers 128-bit IPv6 arithmetic.
+
+    The stamp records the database state the map was built from, see
+    allocator_stamp.
+    """
+
+    def __init__(self, cidr: str, reserved_ranges: Optional[List[dict]] = None):
+        network = ipaddress.ip_network(str(cidr), strict=False)
+        self.network = network
+        self.version = network.version
+        self.first, self.last = host_bounds(network)
+        # Inclusive runs of used addresses
+        self._starts: List[int] = []
+        self._ends: List[int] = []
+        self.reserved = ReservedSpans.from_ranges(reserved_ranges)
+        self.stamp: Optional[Tuple[Any, ...]] = None
+
+    def load(self, addresses: Iterable[int], spans: Iterable[Tuple[int, int]] = ()) -> None:
+        """Replace the occupancy map with the given used addresses and used (start, end) spans"""
+        self._starts, self._ends = [], []
+        for start, end in sorted([(value, value) for value in addresses] + list(spans)):
+            if self._ends and start <= self._ends[-1] + 1:
+                self._ends[-1] = max(self._ends[-1], end)
+            else:
+                self._starts.append(start)
+                self._ends.append(end)
+
+    @property
+    def used_count(self) -> int:
+        return sum(end - start + 1 for start, end in zip(self._starts, self._ends))
+
+    def is_used(self, value: int) -> bool:
+        i = bisect.bisect_right(self._starts, value) - 1
+        return i >= 0 and value <= self._ends[i]
+
+    def mark_used(self, value: int) -> None:
+        i = bisect.bisect_right(self._starts, value) - 1
+        if i >= 0 and value <= self._ends[i]:
+            return
+        joins_left = i >= 0 and self._ends[i] == value - 1
+        joins_right = i + 1 < len(self._starts) and self._starts[i + 1] == value + 1
+        if joins_left and joins_right:
+            self._ends[i] = self._ends[i + 1]
+            del self._starts[i + 1]
+            del self._ends[i + 1]
+        elif joins_left:
+            self._ends[i] = value
+        elif joins_right:
+            self._starts[i + 1] = value
+        else:
+            self._starts.insert(i + 1, value)
+            self._ends.insert(i + 1, value)
+
+    def mark_free(self, value: int) -> None:
+        i = bisect.bisect_right(self._starts, value) - 1
+        if i < 0 or value > self._ends[i]:
+            return
+        start, end = self._starts[i], self._ends[i]
+        if start == end:
+            del self._starts[i]
+            del self._ends[i]
+        elif value == start:
+            self._starts[i] = value + 1
+        elif value == end:
+            self._ends[i] = value - 1
+        else:
+            self._ends[i] = value - 1
+            self._starts.insert(i + 1, value + 1)
+            self._ends.insert(i + 1, end)
+
+    @staticmethod
+    def _covering_end(starts: List[int], ends: List[int], value: int) -> Optional[int]:
+        i = bisect.bisect_right(starts, value) - 1
+        if i >= 0 and value <= ends[i]:
+            return ends[i]
+        return None
+
+    @staticmethod
+    def _next_start(starts: List[int], value: int) -> Optional[int]:
+        i = bisect.bisect_right(starts, value)
+        return starts[i] if i < len(starts) else None
+
+    def reserved_spans(self) -> Iterator[Tuple[int, int]]:
+        """Reserved (start, end) integer spans that fall inside the host range"""
+        return self.reserved.spans_within(self.first, self.last)
+
+    def iter_free(self, start: Optional[int] = None) -> Iterator[int]:
+        """Yield free addresses in ascending order, skipping used and reserved runs"""
+        value = self.first if start is None else max(start, self.first)
+        while value <= self.last:
+            end = self._covering_end(self._starts, self._ends, value)
+            if end is None:
+                end = self.reserved.covering_end(value)
+            if end is not None:
+                value = end + 1
+                continue
+
+            limit = self.last
+            for boundary in (self._next_start(self._starts, value), self.reserved.next_start(value)):
+                if boundary is not None:
+                    limit = min(limit, boundary - 1)
+            for candidate in range(value, limit + 1):
+                yield candidate
+            value = limit + 1
+
+    def next_free(self, count: int = 1) -> List[int]:
+        """Return up to count lowest free addresses"""
+        result = []
+        for value in self.iter_free():
+            result.append(value)
+            if len(result) >= count:
+                break
+        return result
+
+    def is_free(self, value: int) -> bool:
+        return (
+            self.first <= value <= self.last
+            and not self.is_used(value)
+            and self.reserved.covering_end(value) is None
+        )
+    
+    def random_free(self, count: int = 1, attempts: int = RANDOM_ATTEMPTS) -> List[int]:
+        """Return up to count free addresses drawn uniformly from the host range.
+        
+        Each address costs a few bisects while the subnet is sparse, whatever
+        its size. When the draws keep hitting used addresses the search falls
+        back to the next free address after the last draw, wrapping around.
+        """
+        result: List[int] = []
+        span = self.last - self.first + 1
+        while len(result) < count:
+            for _ in range(attempts):
+                value = self.first + secrets.randbelow(span)
+                if self.is_free(value) and value not in result:
+                    break
+            else:
+                value = next(
+                    (candidate for candidate in self.iter_free(value) if candidate not in result),
+                    None
+                )
+                if value is None:
+                    value = next((candidate for candidate in self.iter_free() if candidate not in result), None)
+                if value is None:
+                    break
+            result.append(value)
+        return result
+    
+    def eui64(self, mac_address: str) -> List[int]:
+        """The SLAAC address of a MAC in this subnet, or [] if it is taken or reserved"""
+        if self.version != 6 or self.network.prefixlen > 64:
+            raise ValueError("EUI-64 allocation needs an IPv6 subnet of /64 or larger")
+        value = int(self.network.network_address) | eui64_interface_id(mac_address)
+        return [value] if self.is_free(value) else []
+    
+    def choose(
+        self,
+        count: int,
+        strategy: AllocationStrategy = AllocationStrategy.SEQUENTIAL,
+        mac_address: Optional[str] = None
+    ) -> List[int]:
+        """Pick up to count free addresses with the given strategy"""
+        if strategy == AllocationStrategy.RANDOM:
+            return self.random_free(count)
+        if strategy == AllocationStrategy.EUI64:
+            return self.eui64(mac_address)
+        return self.next_free(count)
+    
+    def to_address(self, value: int) -> str:
+        return str(ipaddress.ip_address(value))
+
+    def advance(self, stamp: Tuple[Any, ...], added: int) -> None:
+        """Adopt the stamp read after this process's own write of added rows (negative for deletes).
+
+        If the row count moved by anything else since the map was stamped,
+        the stamp is dropped instead so the next use rebuilds the map.
+        """
+        if self.stamp is not None and stamp[0] == self.stamp[0] + added and stamp[2:] == self.stamp[2:]:
+            self.stamp = stamp
+        else:
+            self.stamp = None
+
+
+_allocators: "OrderedDict[int, AddressAllocator]" = OrderedDict()
+_lock = threading.Lock()
+
+
+async def allocator_stamp(db: AsyncSession, subnet_id: int) -> Tuple[Any, ...]:
+    """Cheap fingerprint of what an allocator is built from, read in one round trip.
+
+    (address rows, subnet_usage.updated_at, child subnets, highest child id):
+    every IP write moves the subnet_usage row in the same transaction, and
+    both lookups go through indexes, unlike counting ip_addresses.
+    """
+    usage = select(SubnetUsage).where(SubnetUsage.subnet_id == subnet_id)
+    children = select(Subnet.id).where(Subnet.parent_subnet_id == subnet_id)
+    row = (await db.execute(select(
+        func.coalesce(usage.with_only_columns(
+            SubnetUsage.free_count + SubnetUsage.assigned_count
+            + SubnetUsage.reserved_count + SubnetUsage.quarantined_count
+        ).scalar_subquery(), 0),
+        usage.with_only_columns(SubnetUsage.updated_at).scalar_subquery(),
+        children.with_only_columns(func.count(Subnet.id)).scalar_subquery(),
+        children.with_only_columns(func.max(Subnet.id)).scalar_subquery(),
+    ))).one()
+    return tuple(row)
+
+
+async def get_allocator(db: AsyncSession, subnet: Subnet) -> AddressAllocator:
+    """Return the cached allocator of a subnet, rebuilding it from the database if needed.
+
+    The cache is per process, so its stamp is checked against the database
+    on every call; a write by another worker moves the stamp and forces a
+    rebuild. Call it under the allocation lock to allocate from the result.
+    """
+    stamp = await allocator_stamp(db, subnet.id)
+    with _lock:
+        allocator = _allocators.get(subnet.id)
+        if (
+            allocator is not None
+            and allocator.stamp == stamp
+            and allocator.network == ipaddress.ip_network(str(subnet.cidr), strict=False)
+        ):
+            _allocators.move_to_end(subnet.id)
+            return allocator
+
+    allocator = AddressAllocator(str(subnet.cidr), subnet.reserved_ranges)
+    allocator.stamp = stamp
+    rows = await db.execute(select(IPAddress.address).where(IPAddress.subnet_id == subnet.id))
+    # Child subnets own their whole range, so it is used space of the parent
+    children = await db.execute(select(Subnet.cidr).where(Subnet.parent_subnet_id == subnet.id))
+    allocator.load(
+        (address_to_int(address) for address in rows.scalars()),
+        [network_span(cidr) for cidr in children.scalars()]
+    )
+
+    with _lock:
+        _allocators[subnet.id] = allocator
+        while len(_allocators) > MAX_CACHED_SUBNETS:
+            _allocators.popitem(last=False)
+    return allocator
+
+
+def mark_released(subnet_id: int, address, stamp: Tuple[Any, ...]) -> None:
+    """Return an address to the free pool of a cached allocator, given the stamp read before commit"""
+    with _lock:
+        allocator = _allocators.get(subnet_id)
+        if allocator is not None:
+            allocator.mark_free(address_to_int(address))
+            allocator.advance(stamp, -1)
+
+
+def invalidate_allocator(subnet_id: Optional[int] = None) -> None:
+    """Drop the cached allocator of a subnet (or of all subnets) so it is rebuilt lazily"""
+    with _lock:
+        if subnet_id is None:
+            _allocators.clear()
+        else:
+            _allocators.pop(subnet_id, None)
@@ -1,81 +1,232 @@
-from sqlalchemy.orm import Session
-from typing import List, Optional
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.exc import IntegrityError
+from collections import Counter
+from typing import Dict, List, Optional
 from datetime import datetime
-import ipaddress
+from itertools import islice
+import asyncio
+import random
+from sqlalchemy import select, delete
+from app.core.config import settings
+from app.core.database import advisory_xact_lock
 from app.models.subnet import Subnet
 from app.models.ip_address import IPAddress, IPStatus
+from app.services.ip_allocator import (
+    AllocationStrategy, allocator_stamp, get_allocator, invalidate_allocator, address_to_int, mark_released
+)
+from app.services.subnet_service import invalidate_subnet_cache
+from app.services.usage_service import apply_usage, status_change
+
+# Advisory lock namespace that serializes allocation within one subnet
+ALLOCATION_LOCK_NAMESPACE = 1
+# Legacy FREE rows deleted per transaction by compact_free_rows
+COMPACTION_BATCH_SIZE = 5000
+
+class AllocationConflictError(Exception):
+    """Allocation kept colliding with concurrent allocators and gave up"""
+
+def _is_address_conflict(error: IntegrityError) -> bool:
+    """True for a unique violation on ip_addresses.address, the only error a retry can fix"""
+    message = str(error.orig)
+    # Postgres names the unique index, SQLite the column
+    return "ix_ip_addresses_address" in message or "ip_addresses.address" in message
 
 class IPService:
-    def __init__(self, db: Session):
+    def __init__(self, db: AsyncSession):
         self.db = db
     
-    def allocate_ips(
+    async def allocate_ips(
         self,
         subnet_id: int,
         count: int = 1,
         hostname: Optional[str] = None,
-        user_id: Optional[int] = None
+        user_id: Optional[int] = None,
+        strategy: AllocationStrategy = AllocationStrategy.SEQUENTIAL,
+        mac_address: Optional[str] = None
+    ) -> List[IPAddress]:
+        """Allocate available IPs in subnet, retrying on concurrent conflicts.
+        
+        Only address collisions are retried; any other IntegrityError is a
+        real fault and propagates. Raises ValueError when the strategy does
+        not apply to the subnet.
+        """
+        max_retries = settings.IP_ALLOCATION_MAX_RETRIES
+        for attempt in range(max_retries + 1):
+            try:
+                return await self._allocate_once(subnet_id, count, hostname, user_id, strategy, mac_address)
+            except IntegrityError as e:
+                await self.db.rollback()
+                if not _is_address_conflict(e):
+                    raise
+                # Another worker took some of these addresses; rebuild the map and retry
+                invalidate_allocator(subnet_id)
+                if attempt < max_retries:
+                    await asyncio.sleep(self._retry_delay(attempt))
+        
+        raise AllocationConflictError(
+            f"Could not allocate {count} IPs in subnet {subnet_id} after {max_retries + 1} attempts"
+        )
+    
+    @staticmethod
+    def _retry_delay(attempt: int) -> float:
+        """Exponential backoff with full jitter"""
+        ceiling = min(
+            settings.IP_ALLOCATION_RETRY_BACKOFF_SECONDS * (2 ** attempt),
+            settings.IP_ALLOCATION_RETRY_BACKOFF_MAX_SECONDS
+        )
+        return random.uniform(0, ceiling)
+    
+    async def _allocate_once(
+        self,
+        subnet_id: int,
+        count: int,
+        hostname: Optional[str],
+        user_id: Optional[int],
+        strategy: AllocationStrategy,
+        mac_address: Optional[str]
     ) -> List[IPAddress]:
-        """Allocate first available IPs in subnet"""
-        subnet = self.db.query(Subnet).filter(Subnet.id == subnet_id).first()
+        # Serialize allocators of this subnet until the transaction ends
+        await advisory_xact_lock(self.db, ALLOCATION_LOCK_NAMESPACE, subnet_id)
+        
+        subnet = await self.db.get(Subnet, subnet_id)
         if not subnet:
+            await self.db.rollback()
             return []
         
-        network = ipaddress.ip_network(str(subnet.cidr), strict=False)
+        allocator = await get_allocator(self.db, subnet)
+        try:
+            values = allocator.choose(count, strategy, mac_address)
+        except ValueError:
+            await self.db.rollback()
+            raise
         allocated = []
         
-        # Get existing IPs
-        existing_ips = {
-            str(ip.address) for ip in 
-            self.db.query(IPAddress).filter(IPAddress.subnet_id == subnet_id).all()
-        }
+        # Free addresses come from the occupancy map instead of a host walk.
+        # Only taken addresses get a row, so allocations start out reserved.
+        for value in values:
+            new_ip = IPAddress(
+                address=allocator.to_address(value),
+                subnet_id=subnet_id,
+                status=IPStatus.RESERVED,
+                hostname=hostname,
+                mac_address=mac_address,
+                created_by_id=user_id
+            )
+            self.db.add(new_ip)
+            allocated.append(new_ip)
+        
+        if allocated:
+            await apply_usage(self.db, Counter({(subnet_id, IPStatus.RESERVED): len(allocated)}))
+            # The counter row stays locked until commit, so this is the stamp our write leaves behind
+            stamp = await allocator_stamp(self.db, subnet_id)
+        await self.db.commit()
         
-        # Find available IPs
-        for ip in network.hosts():
-            ip_str = str(ip)
-            if ip_str not in existing_ips:
-                # Check reserved ranges
-                if self._is_reserved(ip_str, subnet.reserved_ranges or []):
-                    continue
-                
-                new_ip = IPAddress(
-                    address=ip_str,
-                    subnet_id=subnet_id,
-                    status=IPStatus.FREE,
-                    hostname=hostname,
-                    created_by_id=user_id
-                )
-                self.db.add(new_ip)
-                allocated.append(new_ip)
-                
-                if len(allocated) >= count:
-                    break
-        
-        self.db.commit()
         for ip in allocated:
-            self.db.refresh(ip)
+            allocator.mark_used(address_to_int(ip.address))
+            await self.db.refresh(ip)
+        if allocated:
+            allocator.advance(stamp, len(allocated))
+        await invalidate_subnet_cache(subnet_id)
         
         return allocated
     
-    def _is_reserved(self, ip: str, reserved_ranges: List[dict]) -> bool:
-        """Check if IP is in reserved range"""
-        ip_obj = ipaddress.ip_address(ip)
-        for range_def in reserved_ranges:
-            start = ipaddress.ip_address(range_def.get('start', '0.0.0.0'))
-            end = ipaddress.ip_address(range_def.get('end', '0.0.0.0'))
-            if start <= ip_obj <= end:
-                return True
-        return False
+    async def list_free(
+        self,
+        subnet_id: int,
+        skip: int = 0,
+        limit: int = 100,
+        after: Optional[str] = None
+    ) -> List[Dict]:
+        """Free addresses of a subnet, synthesized from its range minus the stored rows.
+        
+        Free addresses have no rows, so the entries carry no id or timestamps.
+        Paging with after (the last address of the previous page) seeks
+        directly in the occupancy map; skip walks past that many addresses.
+        """
+        subnet = await self.db.get(Subnet, subnet_id)
+        if not subnet:
+            return []
+        
+        allocator = await get_allocator(self.db, subnet)
+        start = address_to_int(after) + 1 if after is not None else None
+        values = islice(allocator.iter_free(start), skip, skip + limit)
+        return [
+            {
+                "id": None,
+                "address": allocator.to_address(value),
+                "subnet_id": subnet_id,
+                "status": IPStatus.FREE,
+                "hostname": None,
+                "mac_address": None,
+                "interface": None,
+                "metadata": {},
+                "assigned_to_id": None,
+                "lease_expires": None,
+                "last_seen": None,
+                "created_by_id": None,
+                "created_at": None,
+                "updated_at": None,
+            }
+            for value in values
+        ]
+    
+    async def release(self, ip: IPAddress) -> None:
+        """Return an address to the free pool by deleting its row"""
+        subnet_id, address = ip.subnet_id, ip.address
+        await apply_usage(self.db, status_change(Counter(), subnet_id, ip.status, None))
+        await self.db.delete(ip)
+        await self.db.flush()
+        stamp = await allocator_stamp(self.db, subnet_id)
+        await self.db.commit()
+        mark_released(subnet_id, address, stamp)
+        await invalidate_subnet_cache(subnet_id)
+    
+    async def compact_free_rows(self, batch_size: int = COMPACTION_BATCH_SIZE) -> int:
+        """Delete FREE rows left over from before free addresses stopped being stored.
+        
+        Rows go in batches of batch_size, each committed with its counter
+        update, so the job can run on a live database. Returns the number
+        of rows deleted.
+        """
+        deleted = 0
+        subnet_ids = set()
+        while True:
+            ids = (await self.db.scalars(
+                select(IPAddress.id)
+                .where(IPAddress.status == IPStatus.FREE)
+                .order_by(IPAddress.id)
+                .limit(batch_size)
+                .with_for_update(skip_locked=True)
+            )).all()
+            if not ids:
+                break
+            
+            rows = (await self.db.execute(
+                delete(IPAddress).where(IPAddress.id.in_(ids)).returning(IPAddress.subnet_id)
+            )).scalars().all()
+            usage = Counter()
+            for subnet_id in rows:
+                usage[(subnet_id, IPStatus.FREE)] -= 1
+                subnet_ids.add(subnet_id)
+            await apply_usage(self.db, usage)
+            await self.db.commit()
+            deleted += len(rows)
+        
+        # The allocators counted the deleted rows as taken
+        for subnet_id in subnet_ids:
+            invalidate_allocator(subnet_id)
+        await invalidate_subnet_cache(*subnet_ids)
+        return deleted
     
-    def scan_ip(self, ip_id: int) -> dict:
+    async def scan_ip(self, ip_id: int) -> dict:
         """Scan IP address (mock implementation)"""
-        ip = self.db.query(IPAddress).filter(IPAddress.id == ip_id).first()
+        ip = await self.db.get(IPAddress, ip_id)
         if not ip:
             return {"error": "IP not found"}
         
         # Mock scan result
         ip.last_seen = datetime.utcnow()
-        self.db.commit()
+        await self.db.commit()
         
         return {
             "ip": str(ip.address),
@@ -84,20 +235,25 @@ class IPService:
             "scan_type": "mock"
         }
     
-    def resolve_conflict(self, ip_id: int, action: str, new_device_id: Optional[int] = None) -> dict:
+    async def resolve_conflict(self, ip_id: int, action: str, new_device_id: Optional[int] = None) -> dict:
         """Resolve IP conflict"""
-        ip = self.db.query(IPAddress).filter(IPAddress.id == ip_id).first()
+        # Row lock so concurrent status changes cannot double-count in subnet_usage
+        ip = await self.db.get(IPAddress, ip_id, with_for_update=True)
         if not ip:
             return {"error": "IP not found"}
         
         if action == "release":
-            ip.status = IPStatus.FREE
-            ip.assigned_to_id = None
-        elif action == "reassign" and new_device_id:
+            await self.release(ip)
+            return {"status": "resolved", "action": action}
+        
+        old_status = ip.status
+        if action == "reassign" and new_device_id:
             ip.assigned_to_id = new_device_id
             ip.status = IPStatus.ASSIGNED
         elif action == "quarantine":
             ip.status = IPStatus.QUARANTINED
         
-        self.db.commit()
+        await apply_usage(self.db, status_change(Counter(), ip.subnet_id, old_status, ip.status))
+        await self.db.commit()
+        await invalidate_subnet_cache(ip.subnet_id)
         return {"status": "resolved", "action": action}
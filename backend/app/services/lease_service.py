@@ -0,0 +1,134 @@
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+import math
+from sqlalchemy import select, update, func, exists, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.database import conflict_insert
+from app.models.scan_lease import ScanLease
+from app.models.subnet import Subnet
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+class LeaseService:
+    """Hands subnets out to scanner agents so no two agents probe the same hosts.
+    
+    A claim renews what the agent holds and tops it up to its fair share
+    (subnets divided by live agents): first from free or expired leases,
+    locked with SKIP LOCKED so concurrent claims never get the same rows,
+    then by asking agents above their share to hand subnets over at their
+    next renewal. Nothing here commits.
+    """
+    
+    def __init__(self, db: AsyncSession):
+        self.db = db
+    
+    async def _ensure_rows(self) -> None:
+        """Create a free lease for every subnet that has none yet"""
+        missing = select(Subnet.id).where(~exists().where(ScanLease.subnet_id == Subnet.id))
+        statement = conflict_insert(self.db, ScanLease).from_select(["subnet_id"], missing)
+        await self.db.execute(statement.on_conflict_do_nothing(index_elements=[ScanLease.subnet_id]))
+    
+    async def held(self, holder: str) -> List[int]:
+        result = await self.db.execute(
+            select(ScanLease.subnet_id).where(ScanLease.holder == holder).order_by(ScanLease.subnet_id)
+        )
+        return list(result.scalars().all())
+    
+    async def renew(self, holder: str, ttl: int) -> List[int]:
+        """Extend every lease the agent still holds; returns the subnets it keeps.
+        
+        Leases other agents asked for are handed over here, and a lease that
+        expired is kept as long as nobody took it over in the meantime.
+        """
+        now = utcnow()
+        expires_at = now + timedelta(seconds=ttl)
+        await self.db.execute(
+            update(ScanLease)
+            .where(ScanLease.holder == holder, ScanLease.requested_by.isnot(None))
+            .values(holder=ScanLease.requested_by, requested_by=None, claimed_at=now, expires_at=expires_at)
+        )
+        await self.db.execute(
+            update(ScanLease).where(ScanLease.holder == holder).values(expires_at=expires_at)
+        )
+        return await self.held(holder)
+    
+    async def claim(self, holder: str, ttl: int, limit: Optional[int] = None) -> List[int]:
+        """Renew the agent's leases and claim more up to its fair share; returns its subnets"""
+        await self._ensure_rows()
+        held = await self.renew(holder, ttl)
+        now = utcnow()
+        live = ScanLease.expires_at > now
+        
+        total = (await self.db.execute(select(func.count()).select_from(ScanLease))).scalar()
+        others: Dict[str, int] = dict((await self.db.execute(
+            select(ScanLease.holder, func.count())
+            .where(ScanLease.holder.isnot(None), ScanLease.holder != holder, live)
+            .group_by(ScanLease.holder)
+        )).all())
+        share = math.ceil(total / (len(others) + 1)) if total else 0
+        if limit is not None:
+            share = min(share, limit)
+        pending = (await self.db.execute(
+            select(func.count()).select_from(ScanLease).where(ScanLease.requested_by == holder, live)
+        )).scalar()
+        wanted = share - len(held) - pending
+        if wanted <= 0:
+            return held
+        
+        free = (await self.db.execute(
+            select(ScanLease.subnet_id)
+            .where(or_(ScanLease.holder.is_(None), ScanLease.expires_at.is_(None), ScanLease.expires_at <= now))
+            .order_by(ScanLease.subnet_id)
+            .limit(wanted)
+            .with_for_update(skip_locked=True)
+        )).scalars().all()
+        if free:
+            await self.db.execute(
+                update(ScanLease)
+                .where(ScanLease.subnet_id.in_(free))
+                .values(holder=holder, requested_by=None, claimed_at=now, expires_at=now + timedelta(seconds=ttl))
+            )
+            held = sorted(held + list(free))
+            wanted -= len(free)
+        
+        # Nothing free left: queue handovers from agents holding more than their share
+        if wanted > 0 and others:
+            requested = dict((await self.db.execute(
+                select(ScanLease.holder, func.count())
+                .where(ScanLease.holder.in_(list(others)), ScanLease.requested_by.isnot(None), live)
+                .group_by(ScanLease.holder)
+            )).all())
+            for other, count in sorted(others.items(), key=lambda item: -item[1]):
+                excess = min(count - requested.get(other, 0) - share, wanted)
+                if excess <= 0:
+                    continue
+                taken = (await self.db.execute(
+                    select(ScanLease.subnet_id)
+                    .where(ScanLease.holder == other, ScanLease.requested_by.is_(None), live)
+                    .order_by(ScanLease.subnet_id.desc())
+                    .limit(excess)
+                    .with_for_update(skip_locked=True)
+                )).scalars().all()
+                if taken:
+                    await self.db.execute(
+                        update(ScanLease).where(ScanLease.subnet_id.in_(taken)).values(requested_by=holder)
+                    )
+                    wanted -= len(taken)
+                if wanted <= 0:
+                    break
+        return held
+    
+    async def release(self, holder: str, subnet_ids: Optional[List[int]] = None) -> List[int]:
+        """Give leases back (all of them by default); returns the subnets the agent still holds"""
+        statement = update(ScanLease).where(ScanLease.holder == holder)
+        if subnet_ids is not None:
+            statement = statement.where(ScanLease.subnet_id.in_(subnet_ids))
+        await self.db.execute(statement.values(holder=None, requested_by=None, claimed_at=None, expires_at=None))
+        return await self.held(holder)
+    
+    async def list_leases(self) -> List[ScanLease]:
+        result = await self.db.execute(
+            select(ScanLease).where(ScanLease.holder.isnot(None)).order_by(ScanLease.subnet_id)
+        )
+        return list(result.scalars().all())
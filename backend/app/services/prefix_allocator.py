@@ -0,0 +1,69 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+import bisect
+import ipaddress
+
+
+def network_span(cidr) -> Tuple[int, int]:
+    """First and last address of a network as integers"""
+    network = ipaddress.ip_network(str(cidr), strict=False)
+    return int(network.network_address), int(network.broadcast_address)
+
+
+class FreeBlockIndex:
+    """Buddy-style index of the free aligned blocks inside a parent network.
+
+    The space not covered by occupied spans is split into maximal aligned
+    CIDR blocks, kept per prefix length as sorted start addresses. The
+    lowest free /n is the lowest start among the lists for prefix lengths up
+    to n, so a lookup costs one probe per prefix length no matter how many
+    siblings exist; handing out part of a larger block splits it into
+    buddies like a buddy allocator.
+    """
+
+    def __init__(self, cidr, occupied: Iterable[Tuple[int, int]] = ()):
+        self.network = ipaddress.ip_network(str(cidr), strict=False)
+        self.width = self.network.max_prefixlen
+        self._free: Dict[int, List[int]] = {}
+        first, last = network_span(self.network)
+
+        position = first
+        for start, end in sorted(occupied):
+            start, end = max(start, first), min(end, last)
+            if start > end or end < position:
+                continue
+            if start > position:
+                self._add_range(position, start - 1)
+            position = end + 1
+        if position <= last:
+            self._add_range(position, last)
+
+    def _add_range(self, start: int, end: int) -> None:
+        """Split [start, end] into maximal aligned blocks, lowest first"""
+        while start <= end:
+            size = start & -start if start else 1 << self.width
+            while size > end - start + 1:
+                size >>= 1
+            self._free.setdefault(self.width - size.bit_length() + 1, []).append(start)
+            start += size
+
+    def allocate(self, prefixlen: int) -> Optional[int]:
+        """Take the lowest free aligned block of prefixlen; returns its start or None"""
+        if not self.network.prefixlen <= prefixlen <= self.width:
+            return None
+        best: Optional[Tuple[int, int]] = None
+        for length in range(self.network.prefixlen, prefixlen + 1):
+            starts = self._free.get(length)
+            if starts and (best is None or starts[0] < best[1]):
+                best = (length, starts[0])
+        if best is None:
+            return None
+
+        length, start = best
+        self._free[length].pop(0)
+        # The upper halves left over from splitting become free buddies
+        for split in range(length + 1, prefixlen + 1):
+            bisect.insort(self._free.setdefault(split, []), start + (1 << (self.width - split)))
+        return start
+
+    def to_network(self, start: int, prefixlen: int):
+        return type(self.network)((start, prefixlen))
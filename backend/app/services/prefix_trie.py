@@ -0,0 +1,184 @@
+from typing import Dict, List, Optional, Tuple, Union
+import ipaddress
+import threading
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models.subnet import Subnet
+
+
+class _Node:
+    __slots__ = ("children", "subnet_id", "count")
+
+    def __init__(self):
+        self.children: List[Optional["_Node"]] = [None, None]
+        self.subnet_id: Optional[int] = None
+        # Number of subnets stored at or below this node
+        self.count = 0
+
+
+def _bits(network):
+    value = int(network.network_address)
+    width = network.max_prefixlen
+    for i in range(network.prefixlen):
+        yield (value >> (width - 1 - i)) & 1
+
+
+class PrefixTrie:
+    """Binary prefix trie over subnet CIDRs, one root per address family.
+
+    Overlap, covering-supernet and contained-subnet queries walk at most
+    prefixlen nodes (plus the size of the result for contained subnets).
+    """
+
+    def __init__(self):
+        self._roots: Dict[int, _Node] = {4: _Node(), 6: _Node()}
+        self._networks: Dict[int, Union[ipaddress.IPv4Network, ipaddress.IPv6Network]] = {}
+        self.version = 0
+
+    def __len__(self) -> int:
+        return len(self._networks)
+
+    def __contains__(self, subnet_id: int) -> bool:
+        return subnet_id in self._networks
+
+    def insert(self, subnet_id: int, cidr) -> None:
+        network = ipaddress.ip_network(str(cidr), strict=False)
+        if subnet_id in self._networks:
+            if self._networks[subnet_id] == network:
+                return
+            self.remove(subnet_id)
+
+        path = [self._roots[network.version]]
+        for bit in _bits(network):
+            node = path[-1]
+            if node.children[bit] is None:
+                node.children[bit] = _Node()
+            path.append(node.children[bit])
+        if path[-1].subnet_id is not None:
+            # CIDRs are unique; drop whatever entry held this prefix before
+            self._networks.pop(path[-1].subnet_id, None)
+            for node in path:
+                node.count -= 1
+        path[-1].subnet_id = subnet_id
+        for node in path:
+            node.count += 1
+        self._networks[subnet_id] = network
+        self.version += 1
+
+    def remove(self, subnet_id: int) -> None:
+        network = self._networks.pop(subnet_id, None)
+        if network is None:
+            return
+        node = self._roots[network.version]
+        node.count -= 1
+        for bit in _bits(network):
+            node = node.children[bit]
+            node.count -= 1
+        node.subnet_id = None
+        self.version += 1
+
+    def _walk(self, network) -> Tuple[List[int], Optional[_Node]]:
+        """Return subnets on the path to network and the node at network (if any)"""
+        covering = []
+        node = self._roots[network.version]
+        for bit in _bits(network):
+            if node.subnet_id is not None:
+                covering.append(node.subnet_id)
+            node = node.children[bit]
+            if node is None:
+                return covering, None
+        return covering, node
+
+    def overlaps(self, cidr) -> bool:
+        network = ipaddress.ip_network(str(cidr), strict=False)
+        covering, node = self._walk(network)
+        return bool(covering) or (node is not None and node.count > 0)
+
+    def covering(self, cidr) -> List[int]:
+        """Subnets that contain cidr (including an exact match), shortest prefix first"""
+        network = ipaddress.ip_network(str(cidr), strict=False)
+        covering, node = self._walk(network)
+        if node is not None and node.subnet_id is not None:
+            covering.append(node.subnet_id)
+        return covering
+
+    def contained(self, cidr) -> List[int]:
+        """Subnets inside cidr (including an exact match)"""
+        network = ipaddress.ip_network(str(cidr), strict=False)
+        _, node = self._walk(network)
+        result = []
+        stack = [node] if node is not None and node.count > 0 else []
+        while stack:
+            node = stack.pop()
+            if node.subnet_id is not None:
+                result.append(node.subnet_id)
+            stack.extend(child for child in node.children if child is not None and child.count > 0)
+        return result
+
+    def overlapping(self, cidr) -> List[int]:
+        """Subnets that overlap cidr in either direction"""
+        covering = self.covering(cidr)
+        return covering + [subnet_id for subnet_id in self.contained(cidr) if subnet_id not in covering]
+
+    def network_of(self, subnet_id: int):
+        return self._networks.get(subnet_id)
+
+
+class SubnetIndex:
+    """Process-local PrefixTrie over the subnets table.
+
+    The database stamp is (row count, highest id). When it moves, new rows
+    are loaded incrementally; a count that still disagrees afterwards means
+    rows were deleted elsewhere, and the trie is rebuilt.
+    """
+
+    def __init__(self):
+        self.trie = PrefixTrie()
+        self.stamp: Optional[Tuple[int, int]] = None
+        self._lock = threading.Lock()
+
+    async def _db_stamp(self, db: AsyncSession) -> Tuple[int, int]:
+        count, max_id = (await db.execute(select(func.count(Subnet.id), func.max(Subnet.id)))).one()
+        return count or 0, max_id or 0
+
+    async def sync(self, db: AsyncSession) -> PrefixTrie:
+        """Bring the trie up to date with the database and return it"""
+        stamp = await self._db_stamp(db)
+        with self._lock:
+            if stamp == self.stamp and len(self.trie) == stamp[0]:
+                return self.trie
+            since = self.stamp[1] if self.stamp is not None else None
+
+        # Queries run outside the lock; the trie is only touched while holding it
+        rows = []
+        if since is not None:
+            rows = (await db.execute(select(Subnet.id, Subnet.cidr).where(Subnet.id > since))).all()
+
+        with self._lock:
+            for row in rows:
+                self.trie.insert(row.id, row.cidr)
+            needs_rebuild = len(self.trie) != stamp[0]
+
+        if needs_rebuild:
+            rows = (await db.execute(select(Subnet.id, Subnet.cidr))).all()
+            trie = PrefixTrie()
+            for row in rows:
+                trie.insert(row.id, row.cidr)
+            with self._lock:
+                trie.version = self.trie.version + 1
+                self.trie = trie
+
+        with self._lock:
+            self.stamp = stamp
+            return self.trie
+
+    def add(self, subnet_id: int, cidr) -> None:
+        with self._lock:
+            self.trie.insert(subnet_id, cidr)
+
+    def discard(self, subnet_id: int) -> None:
+        with self._lock:
+            self.trie.remove(subnet_id)
+
+
+subnet_index = SubnetIndex()
@@ -0,0 +1,84 @@
+from typing import Dict, Iterator, List, Optional, Tuple
+import bisect
+import ipaddress
+
+
+def normalize_reserved_ranges(cidr: str, reserved_ranges: Optional[List[Dict[str, str]]]) -> List[Dict[str, str]]:
+    """Validate reserved ranges against a subnet, then merge and sort them.
+
+    Raises ValueError when a range is malformed, reversed, of the wrong
+    address family or outside the subnet.
+    """
+    network = ipaddress.ip_network(str(cidr), strict=False)
+    intervals = []
+    for range_def in reserved_ranges or []:
+        if not isinstance(range_def, dict) or 'start' not in range_def or 'end' not in range_def:
+            raise ValueError('Reserved ranges need "start" and "end" addresses')
+        try:
+            start = ipaddress.ip_address(range_def['start'])
+            end = ipaddress.ip_address(range_def['end'])
+        except ValueError:
+            raise ValueError(f"Invalid reserved range {range_def['start']} - {range_def['end']}")
+        if start.version != network.version or end.version != network.version:
+            raise ValueError(f"Reserved range {start} - {end} is not IPv{network.version}")
+        if start > end:
+            raise ValueError(f"Reserved range {start} - {end} ends before it starts")
+        if start not in network or end not in network:
+            raise ValueError(f"Reserved range {start} - {end} is outside {network}")
+        intervals.append((int(start), int(end)))
+
+    return [
+        {'start': str(ipaddress.ip_address(start)), 'end': str(ipaddress.ip_address(end))}
+        for start, end in ReservedSpans(intervals)
+    ]
+
+
+class ReservedSpans:
+    """Sorted, merged reserved intervals of a subnet as integer addresses"""
+
+    def __init__(self, intervals=()):
+        self._starts: List[int] = []
+        self._ends: List[int] = []
+        for start, end in sorted(intervals):
+            if self._ends and start <= self._ends[-1] + 1:
+                self._ends[-1] = max(self._ends[-1], end)
+            else:
+                self._starts.append(start)
+                self._ends.append(end)
+
+    @classmethod
+    def from_ranges(cls, reserved_ranges: Optional[List[Dict[str, str]]]) -> "ReservedSpans":
+        """Compile stored {"start", "end"} dicts, parsing each address once"""
+        intervals = []
+        for range_def in reserved_ranges or []:
+            start = int(ipaddress.ip_address(range_def.get('start', '0.0.0.0')))
+            end = int(ipaddress.ip_address(range_def.get('end', '0.0.0.0')))
+            if start <= end:
+                intervals.append((start, end))
+        return cls(intervals)
+
+    def __iter__(self) -> Iterator[Tuple[int, int]]:
+        return iter(zip(self._starts, self._ends))
+
+    def __len__(self) -> int:
+        return len(self._starts)
+
+    def covering_end(self, value: int) -> Optional[int]:
+        """End of the span holding value, if value is reserved"""
+        i = bisect.bisect_right(self._starts, value) - 1
+        if i >= 0 and value <= self._ends[i]:
+            return self._ends[i]
+        return None
+
+    def next_start(self, value: int) -> Optional[int]:
+        """Start of the first span beginning after value"""
+        i = bisect.bisect_right(self._starts, value)
+        return self._starts[i] if i < len(self._starts) else None
+
+    def spans_within(self, first: int, last: int) -> Iterator[Tuple[int, int]]:
+        """Spans clipped to [first, last]"""
+        i = max(bisect.bisect_right(self._starts, first) - 1, 0)
+        while i < len(self._starts) and self._starts[i] <= last:
+            if self._ends[i] >= first:
+                yield max(self._starts[i], first), min(self._ends[i], last)
+            i += 1
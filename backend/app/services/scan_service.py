@@ -0,0 +1,192 @@
+from sqlalchemy import Integer, Text, DateTime, bindparam, cast, func, literal, or_, select, update, values, column
+from sqlalchemy.dialects.postgresql import INET, JSONB
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Dict, List, Optional, Sequence
+import ipaddress
+import json
+from app.models.ip_address import IPAddress, IPStatus
+from app.models.scan_lease import ScanLease
+from app.schemas.ip_address import ScanResultItem
+from app.services import lease_service
+
+# Targets fetched per round-trip (and per streamed chunk) by the target feed
+TARGET_BATCH_SIZE = 1000
+
+class ScanService:
+    def __init__(self, db: AsyncSession):
+        self.db = db
+    
+    @staticmethod
+    def _scan_metadata(item: ScanResultItem, scanned_at: datetime) -> Dict:
+        return {
+            "reachability": item.reachability.value,
+            "open_ports": sorted(set(item.open_ports)),
+            "scanned_at": scanned_at.isoformat(),
+        }
+    
+    async def iter_targets(
+        self,
+        statuses: Sequence[IPStatus] = (IPStatus.ASSIGNED,),
+        subnet_ids: Optional[Sequence[int]] = None,
+        holder: Optional[str] = None,
+        stale_seconds: Optional[int] = None,
+        shard: int = 0,
+        shards: int = 1,
+        after_id: Optional[int] = None
+    ) -> AsyncIterator[str]:
+        """Stream scan targets as NDJSON, one chunk per fetched batch.
+        
+        Rows come from a server-side cursor in id order on a session of its
+        own, so the feed can outlive the request session. subnet_ids keeps
+        the given subnets; holder keeps the subnets whose unexpired lease
+        that agent holds; stale_seconds keeps addresses never seen or not
+        seen for that long; shard/shards splits the targets by id across
+        agents; after_id resumes a feed.
+        """
+        query = select(
+            IPAddress.id, IPAddress.address, IPAddress.subnet_id, IPAddress.last_seen
+        ).where(IPAddress.status.in_(list(statuses))).order_by(IPAddress.id)
+        if subnet_ids is not None:
+            query = query.where(IPAddress.subnet_id.in_(list(subnet_ids)))
+        if holder is not None:
+            query = query.join(ScanLease, ScanLease.subnet_id == IPAddress.subnet_id).where(
+                ScanLease.holder == holder, ScanLease.expires_at > lease_service.utcnow()
+            )
+        if stale_seconds is not None:
+            cutoff = datetime.now(timezone.utc) - timedelta(seconds=stale_seconds)
+            query = query.where(or_(IPAddress.last_seen.is_(None), IPAddress.last_seen < cutoff))
+        if shards > 1:
+            query = query.where(IPAddress.id % shards == shard)
+        if after_id is not None:
+            query = query.where(IPAddress.id > after_id)
+        
+        async with AsyncSession(bind=self.db.bind) as session:
+            result = await session.stream(query.execution_options(yield_per=TARGET_BATCH_SIZE))
+            async for batch in result.partitions():
+                yield "".join(
+                    json.dumps({
+                        "id": row.id,
+                        "address": str(ipaddress.ip_interface(str(row.address)).ip),
+                        "subnet_id": row.subnet_id,
+                        "last_seen": row.last_seen.isoformat() if row.last_seen else None,
+                    }, separators=(",", ":")) + "\n"
+                    for row in batch
+                )
+    
+    async def apply_results(self, items: List[ScanResultItem]) -> Dict:
+        """Store a batch of scan results in one transaction.
+        
+        Each result refreshes last_seen (never moving it backwards) and
+        replaces the "scan" key of the address metadata. Results are
+        matched by id when given, otherwise by address. On Postgres each
+        kind of key is one UPDATE ... FROM (VALUES ...). Not committed.
+        """
+        scanned_at = datetime.now(timezone.utc)
+        by_id: Dict[int, Dict] = {}
+        by_address: Dict[str, Dict] = {}
+        for item in items:
+            row = {"last_seen": item.last_seen, "scan": self._scan_metadata(item, scanned_at)}
+            if item.id is not None:
+                by_id[item.id] = row
+            else:
+                by_address[item.address] = row
+        
+        if self.db.get_bind().dialect.name == "postgresql":
+            matched_ids = await self._update_from_values("id", by_id)
+            matched_addresses = await self._update_from_values("address", by_address)
+        else:
+            matched_ids, matched_addresses = await self._update_rows(by_id, by_address)
+        
+        unmatched = [str(key) for key in by_id if key not in matched_ids]
+        unmatched += [key for key in by_address if key not in matched_addresses]
+        return {
+            "received": len(items),
+            "updated": len(matched_ids) + len(matched_addresses),
+            "unmatched": unmatched,
+        }
+    
+    async def _update_from_values(self, key: str, rows: Dict) -> set:
+        """One set-based UPDATE joined to the batch on id or address; returns the matched keys"""
+        if not rows:
+            return set()
+        table = IPAddress.__table__
+        metadata = table.c["metadata"]
+        batch = values(
+            column("key", Integer if key == "id" else Text),
+            column("last_seen", DateTime(timezone=True)),
+            column("scan", Text),
+            name="batch"
+        ).data([(k, row["last_seen"], json.dumps(row["scan"])) for k, row in rows.items()])
+        
+        if key == "id":
+            join = table.c.id == batch.c.key
+            returned = table.c.id
+        else:
+            join = table.c.address == cast(batch.c.key, INET)
+            returned = func.host(table.c.address)
+        
+        statement = (
+            update(table)
+            .where(join)
+            .values({
+                # greatest() ignores NULLs, so unreachable hosts keep their last sighting.
+                # The cast types an all-NULL VALUES column, which Postgres would read as text.
+                table.c.last_seen: func.greatest(table.c.last_seen, cast(batch.c.last_seen, table.c.last_seen.type)),
+                metadata: cast(
+                    func.coalesce(cast(metadata, JSONB), cast(literal("{}"), JSONB)).op("||")(
+                        func.jsonb_build_object("scan", cast(batch.c.scan, JSONB))
+                    ),
+                    metadata.type
+                ),
+                table.c.updated_at: func.now(),
+            })
+            .returning(returned)
+        )
+        return set((await self.db.execute(statement)).scalars().all())
+    
+    async def _update_rows(self, by_id: Dict[int, Dict], by_address: Dict[str, Dict]):
+        """Portable fallback: one SELECT for the matched rows and one executemany UPDATE"""
+        table = IPAddress.__table__
+        metadata = table.c["metadata"]
+        current = []
+        if by_id:
+            current += (await self.db.execute(
+                select(table.c.id, table.c.address, table.c.last_seen, metadata).where(table.c.id.in_(list(by_id)))
+            )).all()
+        if by_address:
+            current += (await self.db.execute(
+                select(table.c.id, table.c.address, table.c.last_seen, metadata).where(table.c.address.in_(list(by_address)))
+            )).all()
+        
+        matched_ids, matched_addresses, params = set(), set(), {}
+        for ip_id, address, last_seen, existing in current:
+            address = str(ipaddress.ip_interface(str(address)).ip)
+            if ip_id in by_id:
+                matched_ids.add(ip_id)
+                row = by_id[ip_id]
+            else:
+                matched_addresses.add(address)
+                row = by_address[address]
+            seen = [value for value in (last_seen, row["last_seen"]) if value is not None]
+            params[ip_id] = {
+                "b_id": ip_id,
+                "b_last_seen": max(seen, key=_as_utc) if seen else None,
+                "b_metadata": {**(existing or {}), "scan": row["scan"]},
+            }
+        
+        if params:
+            await self.db.execute(
+                update(table)
+                .where(table.c.id == bindparam("b_id"))
+                .values({
+                    table.c.last_seen: bindparam("b_last_seen"),
+                    metadata: bindparam("b_metadata", type_=metadata.type),
+                    table.c.updated_at: func.now(),
+                }),
+                list(params.values())
+            )
+        return matched_ids, matched_addresses
+
+def _as_utc(value: datetime) -> datetime:
+    return value if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)
@@ -1,52 +1,328 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, cast, literal, select, exists
+from sqlalchemy.dialects.postgresql import INET
+from sqlalchemy.orm import aliased
 import ipaddress
-from typing import Dict
+import json
+from typing import Dict, Iterator, List, Optional
+from app.core.cache import read_cache
+from app.core.config import settings
+from app.core.database import advisory_xact_lock
 from app.models.subnet import Subnet
-from app.models.ip_address import IPAddress, IPStatus
+from app.models.subnet_usage import SubnetUsage
+from app.models.ip_address import IPAddress
+from app.schemas.subnet import SubnetResponse
+from app.services.prefix_allocator import FreeBlockIndex, network_span
+from app.services.prefix_trie import subnet_index
+from app.services.ip_allocator import address_to_int, invalidate_allocator
+from app.services.usage_service import get_usage, USED_STATUSES
+
+STATS_CACHE = "subnet_stats"
+TREE_CACHE = "subnet_tree"
+
+# Bytes buffered before the tree encoder yields a chunk
+TREE_STREAM_CHUNK_SIZE = 64 * 1024
+# Advisory lock namespace that serializes prefix allocation within one parent
+PREFIX_ALLOCATION_LOCK_NAMESPACE = 2
+
+async def invalidate_subnet_cache(*subnet_ids: Optional[int]) -> None:
+    """Drop cached stats of the given subnets and every cached tree.
+
+    Call after committing a write that changes a subnet or its addresses;
+    pass the parent as well when a subnet is created, moved or deleted.
+    """
+    keys = [f"{STATS_CACHE}:{subnet_id}" for subnet_id in subnet_ids if subnet_id is not None]
+    if keys:
+        await read_cache.delete(*keys)
+    await read_cache.bump(TREE_CACHE)
 
 class SubnetService:
-    def __init__(self, db: Session):
+    def __init__(self, db: AsyncSession):
         self.db = db
     
-    def check_overlap(self, cidr: str) -> bool:
+    def _is_postgres(self) -> bool:
+        return self.db.get_bind().dialect.name == "postgresql"
+    
+    @staticmethod
+    def _inet(value: str):
+        return cast(literal(str(value)), INET)
+    
+    async def check_overlap(self, cidr: str) -> bool:
         """Check if subnet overlaps with existing subnets"""
-        new_network = ipaddress.ip_network(cidr, strict=False)
-        subnets = self.db.query(Subnet).all()
+        if self._is_postgres():
+            query = select(exists().where(Subnet.cidr.op("&&")(self._inet(cidr))))
+            return await self.db.scalar(query)
+        return (await subnet_index.sync(self.db)).overlaps(cidr)
+    
+    async def find_overlapping(self, cidr: str) -> List[Subnet]:
+        """Subnets that overlap cidr (supernets, subnets or an exact match)"""
+        if self._is_postgres():
+            result = await self.db.scalars(select(Subnet).where(Subnet.cidr.op("&&")(self._inet(cidr))))
+            return result.all()
+        subnet_ids = (await subnet_index.sync(self.db)).overlapping(cidr)
+        if not subnet_ids:
+            return []
+        return (await self.db.scalars(select(Subnet).where(Subnet.id.in_(subnet_ids)))).all()
+    
+    async def find_containing_subnet(self, address: str) -> Optional[Subnet]:
+        """Most specific subnet holding address"""
+        if self._is_postgres():
+            return await self.db.scalar(
+                select(Subnet).where(
+                    Subnet.cidr.op(">>=")(self._inet(address))
+                ).order_by(func.masklen(Subnet.cidr).desc()).limit(1)
+            )
+        covering = (await subnet_index.sync(self.db)).covering(ipaddress.ip_network(address))
+        if not covering:
+            return None
+        return await self.db.get(Subnet, covering[-1])
+    
+    async def ips_in_cidr(self, cidr: str) -> List[IPAddress]:
+        """IP addresses inside cidr, whichever subnet they belong to"""
+        if self._is_postgres():
+            result = await self.db.scalars(
+                select(IPAddress).where(
+                    IPAddress.address.op("<<=")(self._inet(cidr))
+                ).order_by(IPAddress.address)
+            )
+            return result.all()
+        network = ipaddress.ip_network(cidr, strict=False)
+        subnet_ids = (await subnet_index.sync(self.db)).overlapping(network)
+        if not subnet_ids:
+            return []
+        ips = (await self.db.scalars(select(IPAddress).where(IPAddress.subnet_id.in_(subnet_ids)))).all()
+        ips = [ip for ip in ips if ipaddress.ip_interface(str(ip.address)).ip in network]
+        return sorted(ips, key=lambda ip: ipaddress.ip_interface(str(ip.address)).ip)
+    
+    async def _occupied_spans(self, parent: Subnet) -> List:
+        """Integer spans inside parent taken by its children, other nested subnets and its own addresses"""
+        children = (await self.db.scalars(
+            select(Subnet.cidr).where(Subnet.parent_subnet_id == parent.id)
+        )).all()
+        if self._is_postgres():
+            nested = (await self.db.scalars(
+                select(Subnet.cidr).where(Subnet.cidr.op("<<")(self._inet(parent.cidr)))
+            )).all()
+        else:
+            trie = await subnet_index.sync(self.db)
+            nested = [trie.network_of(subnet_id) for subnet_id in trie.contained(parent.cidr) if subnet_id != parent.id]
+        addresses = (await self.db.scalars(
+            select(IPAddress.address).where(IPAddress.subnet_id == parent.id)
+        )).all()
+        
+        spans = [network_span(cidr) for cidr in set(map(str, children)) | set(map(str, nested))]
+        spans.extend((value, value) for value in map(address_to_int, addresses))
+        return spans
+    
+    async def allocate_prefix(self, parent: Subnet, prefix_length: int, **fields) -> Optional[Subnet]:
+        """Carve the lowest free aligned /prefix_length out of parent as a new child subnet.
+        
+        Free space is parent minus its children, any other subnets nested
+        in it and its own stored addresses. Allocations under the same
+        parent are serialized until the child is committed. Returns None
+        when no block of that size is left.
+        """
+        await advisory_xact_lock(self.db, PREFIX_ALLOCATION_LOCK_NAMESPACE, parent.id)
         
-        for subnet in subnets:
-            existing_network = ipaddress.ip_network(str(subnet.cidr), strict=False)
-            if new_network.overlaps(existing_network):
-                return True
-        return False
+        index = FreeBlockIndex(parent.cidr, await self._occupied_spans(parent))
+        start = index.allocate(prefix_length)
+        if start is None:
+            await self.db.rollback()
+            return None
+        
+        child = Subnet(cidr=str(index.to_network(start, prefix_length)), parent_subnet_id=parent.id, **fields)
+        self.db.add(child)
+        await self.db.commit()
+        await self.db.refresh(child)
+        subnet_index.add(child.id, child.cidr)
+        # The parent's occupancy map must now skip the child's range
+        invalidate_allocator(parent.id)
+        await invalidate_subnet_cache(child.id, parent.id)
+        return child
+    
+    async def get_children(self, subnet_id: int) -> List[Dict]:
+        """Direct children of a subnet, served from the tree cache when possible"""
+        generation = await read_cache.generation(TREE_CACHE)
+        key = f"{TREE_CACHE}:{generation}:children:{subnet_id}"
+        if generation is not None:
+            cached = await read_cache.get(TREE_CACHE, key)
+            if cached is not None:
+                return cached
+        
+        result = await self.db.scalars(
+            select(Subnet).where(Subnet.parent_subnet_id == subnet_id).order_by(Subnet.id)
+        )
+        children = [SubnetResponse.model_validate(child).model_dump(mode="json") for child in result]
+        if generation is not None:
+            await read_cache.set(TREE_CACHE, key, children)
+        return children
     
-    def get_subnet_stats(self, subnet_id: int) -> Dict:
+    async def get_tree(self, root_id: Optional[int] = None) -> List[Dict]:
+        """Subnet hierarchy under root_id (or under every top-level subnet) with rolled-up usage.
+        
+        One recursive CTE walks parent_subnet_id and joins the subnet_usage
+        counters. Nodes come back flat in depth-first pre-order, each with
+        its depth and subtree_* figures: the node's own size, with the used
+        and stored addresses of itself and its descendants.
+        Small trees are cached until the next subnet or IP write.
+        """
+        generation = await read_cache.generation(TREE_CACHE)
+        key = f"{TREE_CACHE}:{generation}:tree:{root_id if root_id is not None else 'all'}"
+        if generation is not None:
+            cached = await read_cache.get(TREE_CACHE, key)
+            if cached is not None:
+                return cached
+        
+        anchor = select(
+            Subnet.id, Subnet.parent_subnet_id, Subnet.cidr, Subnet.description,
+            literal(0).label("depth")
+        ).where(Subnet.id == root_id if root_id is not None else Subnet.parent_subnet_id.is_(None))
+        tree = anchor.cte("subnet_tree", recursive=True)
+        child = aliased(Subnet)
+        tree = tree.union_all(
+            select(
+                child.id, child.parent_subnet_id, child.cidr, child.description,
+                (tree.c.depth + 1).label("depth")
+            ).where(
+                child.parent_subnet_id == tree.c.id,
+                # Bounds the walk even if parent links form a cycle
+                tree.c.depth < settings.SUBNET_TREE_MAX_DEPTH
+            )
+        )
+        rows = await self.db.execute(
+            select(
+                tree, SubnetUsage.free_count, SubnetUsage.assigned_count,
+                SubnetUsage.reserved_count, SubnetUsage.quarantined_count
+            )
+            .outerjoin(SubnetUsage, SubnetUsage.subnet_id == tree.c.id)
+            .order_by(tree.c.depth, tree.c.id)
+        )
+        
+        nodes: Dict[int, Dict] = {}
+        # Stored rows per subtree; they are what takes addresses out of the free pool
+        stored_rows: Dict[int, int] = {}
+        children: Dict[Optional[int], List[int]] = {}
+        roots: List[int] = []
+        for row in rows:
+            if row.id in nodes:
+                continue
+            total = ipaddress.ip_network(str(row.cidr), strict=False).num_addresses
+            used = (row.assigned_count or 0) + (row.reserved_count or 0)
+            # Every stored row takes its address out of the free pool
+            stored = used + (row.free_count or 0) + (row.quarantined_count or 0)
+            nodes[row.id] = {
+                "id": row.id,
+                "parent_subnet_id": row.parent_subnet_id,
+                "cidr": str(row.cidr),
+                "description": row.description,
+                "depth": row.depth,
+                "total_ips": total,
+                "used_ips": used,
+                "free_ips": total - stored,
+                "children_count": 0,
+                "subtree_total_ips": total,
+                "subtree_used_ips": used,
+                "subtree_free_ips": total - stored,
+            }
+            stored_rows[row.id] = stored
+            if row.depth == 0:
+                roots.append(row.id)
+            else:
+                children.setdefault(row.parent_subnet_id, []).append(row.id)
+        
+        ordered: List[Dict] = []
+        stack = list(reversed(roots))
+        while stack:
+            node = nodes[stack.pop()]
+            ordered.append(node)
+            child_ids = children.get(node["id"], [])
+            node["children_count"] = len(child_ids)
+            stack.extend(reversed(child_ids))
+        
+        # Children follow their parent in pre-order, so a reverse pass rolls counts up.
+        # A child's range lies inside its parent, so the subtree size stays the
+        # parent's own size and only the stored rows are added up.
+        for node in reversed(ordered):
+            node["subtree_free_ips"] = node["subtree_total_ips"] - stored_rows[node["id"]]
+            parent = nodes.get(node["parent_subnet_id"]) if node["depth"] > 0 else None
+            if parent is not None:
+                parent["subtree_used_ips"] += node["subtree_used_ips"]
+                stored_rows[parent["id"]] += stored_rows[node["id"]]
+        for node in ordered:
+            node["subtree_utilization_percent"] = round(node["subtree_used_ips"] / node["subtree_total_ips"] * 100, 2)
+        
+        if generation is not None and len(ordered) <= settings.SUBNET_TREE_CACHE_MAX_NODES:
+            await read_cache.set(TREE_CACHE, key, ordered)
+        return ordered
+    
+    async def get_subnet_stats(self, subnet_id: int) -> Dict:
         """Calculate subnet utilization statistics"""
-        subnet = self.db.query(Subnet).filter(Subnet.id == subnet_id).first()
+        key = f"{STATS_CACHE}:{subnet_id}"
+        cached = await read_cache.get(STATS_CACHE, key)
+        if cached is not None:
+            return cached
+        
+        subnet = await self.db.get(Subnet, subnet_id)
         if not subnet:
             return {}
         
         network = ipaddress.ip_network(str(subnet.cidr), strict=False)
         total_ips = network.num_addresses
         
-        # Count used IPs
-        used_ips = self.db.query(func.count(IPAddress.id)).filter(
-            IPAddress.subnet_id == subnet_id,
-            IPAddress.status.in_([IPStatus.ASSIGNED, IPStatus.RESERVED])
-        ).scalar() or 0
+        # Used IPs come from the subnet_usage counters rather than a count over ip_addresses
+        usage = await get_usage(self.db, subnet_id)
+        used_ips = sum(usage[status] for status in USED_STATUSES)
         
-        free_ips = total_ips - used_ips
+        # Free space is the range minus every stored row, whatever its status
+        free_ips = total_ips - sum(usage.values())
         utilization = (used_ips / total_ips * 100) if total_ips > 0 else 0
         
         # Count children
-        children_count = self.db.query(func.count(Subnet.id)).filter(
-            Subnet.parent_subnet_id == subnet_id
-        ).scalar() or 0
+        children_count = await self.db.scalar(
+            select(func.count(Subnet.id)).where(Subnet.parent_subnet_id == subnet_id)
+        ) or 0
         
-        return {
+        stats = {
             "total_ips": total_ips,
             "used_ips": used_ips,
             "free_ips": free_ips,
+            # IPv6 counts exceed 2**53; decimal strings survive JSON parsers that use doubles
+            "total_ips_exact": str(total_ips),
+            "free_ips_exact": str(free_ips),
             "utilization_percent": round(utilization, 2),
             "children_count": children_count
         }
+        await read_cache.set(STATS_CACHE, key, stats)
+        return stats
+
+def iter_tree_json(nodes: List[Dict], max_depth: Optional[int] = None) -> Iterator[str]:
+    """Encode pre-order tree nodes as nested JSON, yielding it in chunks.
+
+    Each node becomes an object with a "children" array; nodes deeper than
+    max_depth are left out (their usage still counts in the subtree totals).
+    """
+    parts: List[str] = ["["]
+    size = 1
+    open_depths: List[int] = []
+    need_comma = False
+    for node in nodes:
+        depth = node["depth"]
+        if max_depth is not None and depth > max_depth:
+            continue
+        # Close the previous node and any deeper subtrees before opening this one
+        while open_depths and open_depths[-1] >= depth:
+            parts.append("]}")
+            open_depths.pop()
+            need_comma = True
+        encoded = json.dumps({key: value for key, value in node.items() if key != "depth"}, separators=(",", ":"))
+        part = ("," if need_comma else "") + encoded[:-1] + ',"children":['
+        parts.append(part)
+        size += len(part)
+        open_depths.append(depth)
+        need_comma = False
+        if size >= TREE_STREAM_CHUNK_SIZE:
+            yield "".join(parts)
+            parts, size = [], 0
+    parts.extend("]}" for _ in open_depths)
+    parts.append("]")
+    yield "".join(parts)
@@ -0,0 +1,118 @@
+from collections import Counter
+from typing import Dict, List, Optional
+from sqlalchemy import select, delete, func, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.database import conflict_insert
+from app.models.ip_address import IPAddress, IPStatus
+from app.models.subnet_usage import SubnetUsage
+
+# Counter column of each IP status
+STATUS_COLUMNS = {
+    IPStatus.FREE: "free_count",
+    IPStatus.ASSIGNED: "assigned_count",
+    IPStatus.RESERVED: "reserved_count",
+    IPStatus.QUARANTINED: "quarantined_count",
+}
+
+# Statuses that count towards a subnet's used addresses
+USED_STATUSES = (IPStatus.ASSIGNED, IPStatus.RESERVED)
+
+def status_change(
+    deltas: Counter,
+    subnet_id: int,
+    old_status: Optional[IPStatus],
+    new_status: Optional[IPStatus]
+) -> Counter:
+    """Record one address moving between statuses (None for inserted or deleted rows)"""
+    if old_status == new_status:
+        return deltas
+    if old_status is not None:
+        deltas[(subnet_id, IPStatus(old_status))] -= 1
+    if new_status is not None:
+        deltas[(subnet_id, IPStatus(new_status))] += 1
+    return deltas
+
+async def apply_usage(db: AsyncSession, deltas: Counter) -> None:
+    """Add status deltas to the subnet_usage counters inside the caller's transaction.
+
+    Each subnet is one atomic INSERT ... ON CONFLICT DO UPDATE, so
+    concurrent writers never lose increments. Commit together with the IP
+    rows the deltas describe.
+    """
+    per_subnet: Dict[int, Dict[str, int]] = {}
+    for (subnet_id, status), delta in deltas.items():
+        if delta:
+            columns = per_subnet.setdefault(subnet_id, {})
+            column = STATUS_COLUMNS[IPStatus(status)]
+            columns[column] = columns.get(column, 0) + delta
+
+    for subnet_id, columns in sorted(per_subnet.items()):
+        statement = conflict_insert(db, SubnetUsage).values(subnet_id=subnet_id, **columns)
+        statement = statement.on_conflict_do_update(
+            index_elements=[SubnetUsage.subnet_id],
+            set_={
+                **{column: getattr(SubnetUsage, column) + delta for column, delta in columns.items()},
+                "updated_at": func.now(),
+            }
+        )
+        await db.execute(statement)
+
+async def remove_usage(db: AsyncSession, subnet_id: int) -> None:
+    """Drop the counters of a subnet being deleted (the FK cascades on Postgres only)"""
+    await db.execute(delete(SubnetUsage).where(SubnetUsage.subnet_id == subnet_id))
+
+async def get_usage(db: AsyncSession, subnet_id: int) -> Dict[IPStatus, int]:
+    usage = await db.get(SubnetUsage, subnet_id, populate_existing=True)
+    return {
+        status: getattr(usage, column) if usage is not None else 0
+        for status, column in STATUS_COLUMNS.items()
+    }
+
+async def _actual_counts(db: AsyncSession) -> Dict[int, Dict[str, int]]:
+    rows = await db.execute(
+        select(IPAddress.subnet_id, IPAddress.status, func.count(IPAddress.id))
+        .group_by(IPAddress.subnet_id, IPAddress.status)
+    )
+    actual: Dict[int, Dict[str, int]] = {}
+    for subnet_id, status, count in rows:
+        actual.setdefault(subnet_id, {column: 0 for column in STATUS_COLUMNS.values()})
+        actual[subnet_id][STATUS_COLUMNS[IPStatus(status)]] = count
+    return actual
+
+async def reconcile_usage(db: AsyncSession, repair: bool = False) -> List[Dict]:
+    """Compare the counters with a full recount and return every subnet that drifted.
+
+    With repair=True the counters are overwritten with the recount and
+    rows of subnets without addresses are zeroed. The recount scans
+    ip_addresses once, so run it off-peak. On PostgreSQL a repair holds
+    subnet_usage in SHARE mode until it commits, so allocations that
+    would move a counter in the meantime wait for the overwrite instead
+    of being lost to it.
+    """
+    if repair and db.get_bind().dialect.name == "postgresql":
+        await db.execute(text("LOCK TABLE subnet_usage IN SHARE MODE"))
+    actual = await _actual_counts(db)
+    stored = {
+        usage.subnet_id: {column: getattr(usage, column) for column in STATUS_COLUMNS.values()}
+        for usage in (await db.scalars(select(SubnetUsage).execution_options(populate_existing=True))).all()
+    }
+    zeros = {column: 0 for column in STATUS_COLUMNS.values()}
+
+    drift = []
+    for subnet_id in sorted(set(actual) | set(stored)):
+        expected = actual.get(subnet_id, zeros)
+        current = stored.get(subnet_id, zeros)
+        if expected != current:
+            drift.append({"subnet_id": subnet_id, "stored": current, "actual": expected})
+
+    if repair and drift:
+        for item in drift:
+            statement = conflict_insert(db, SubnetUsage).values(subnet_id=item["subnet_id"], **item["actual"])
+            statement = statement.on_conflict_do_update(
+                index_elements=[SubnetUsage.subnet_id],
+                set_={**item["actual"], "updated_at": func.now()}
+            )
+            await db.execute(statement)
+    if repair:
+        await db.commit()
+    return drift
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""Maintain monthly audit_logs partitions (run from cron)"""
+import sys
+import os
+import argparse
+import asyncio
+from datetime import datetime, timezone
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from app.core.database import async_engine
+from app.services.audit_service import ensure_audit_partitions, detach_audit_partitions
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--months-ahead", type=int, default=None, help="Partitions to create beyond this month")
+    parser.add_argument("--retain-months", type=int, default=None, help="Detach partitions older than this many months")
+    args = parser.parse_args()
+    
+    for name in await ensure_audit_partitions(async_engine, args.months_ahead):
+        print(f"✓ Partition {name}")
+    
+    if args.retain_months is not None:
+        now = datetime.now(timezone.utc)
+        months = now.year * 12 + now.month - 1 - args.retain_months
+        cutoff = datetime(months // 12, months % 12 + 1, 1, tzinfo=timezone.utc)
+        for name in await detach_audit_partitions(async_engine, cutoff):
+            print(f"✓ Detached {name}")
+    
+    await async_engine.dispose()
+
+if __name__ == "__main__":
+    asyncio.run(main())
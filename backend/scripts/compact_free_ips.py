@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+"""Delete stored FREE address rows; free addresses are derived from subnet ranges"""
+import sys
+import os
+import argparse
+import asyncio
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from app.core.database import AsyncSessionLocal, async_engine
+from app.services.ip_service import IPService, COMPACTION_BATCH_SIZE
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--batch-size", type=int, default=COMPACTION_BATCH_SIZE, help="Rows deleted per transaction")
+    args = parser.parse_args()
+    
+    async with AsyncSessionLocal() as db:
+        deleted = await IPService(db).compact_free_rows(batch_size=args.batch_size)
+    print(f"✓ Deleted {deleted} free address rows")
+    
+    await async_engine.dispose()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+"""Detect (and optionally repair) drift between subnet_usage and ip_addresses"""
+import sys
+import os
+import argparse
+import asyncio
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from app.core.database import AsyncSessionLocal, async_engine
+from app.services.usage_service import reconcile_usage
+from app.services.subnet_service import invalidate_subnet_cache
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repair", action="store_true", help="Overwrite drifted counters with the recount")
+    args = parser.parse_args()
+    
+    async with AsyncSessionLocal() as db:
+        drift = await reconcile_usage(db, repair=args.repair)
+    
+    for item in drift:
+        print(f"✗ Subnet {item['subnet_id']}: stored {item['stored']}, actual {item['actual']}")
+    if not drift:
+        print("✓ subnet_usage matches ip_addresses")
+    elif args.repair:
+        await invalidate_subnet_cache(*(item["subnet_id"] for item in drift))
+        print(f"✓ Repaired {len(drift)} subnets")
+    
+    await async_engine.dispose()
+    return 1 if drift and not args.repair else 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
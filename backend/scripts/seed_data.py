@@ -12,6 +12,8 @@ from app.models.vlan import VLAN
 from app.models.device import Device
 from app.models.subnet import Subnet
 from app.models.ip_address import IPAddress, IPStatus
+from app.models.subnet_usage import SubnetUsage
+from app.services.usage_service import STATUS_COLUMNS
 
 def seed_database():
     db = SessionLocal()
@@ -127,7 +129,6 @@ def seed_database():
             IPAddress(address="10.0.1.20", subnet_id=subnet2.id, status=IPStatus.ASSIGNED, hostname="server-01", assigned_to_id=devices[2].id, created_by_id=admin.id),
             IPAddress(address="10.0.1.21", subnet_id=subnet2.id, status=IPStatus.ASSIGNED, hostname="server-02", assigned_to_id=devices[3].id, created_by_id=admin.id),
             IPAddress(address="10.0.2.100", subnet_id=subnet3.id, status=IPStatus.ASSIGNED, hostname="workstation-01", assigned_to_id=devices[4].id, created_by_id=admin.id),
-            IPAddress(address="10.0.2.101", subnet_id=subnet3.id, status=IPStatus.FREE, created_by_id=admin.id),
             IPAddress(address="2001:db8::1", subnet_id=subnet4.id, status=IPStatus.RESERVED, hostname="ipv6-gateway", created_by_id=admin.id),
         ]
         
@@ -135,6 +136,15 @@ def seed_database():
         db.commit()
         print("✓ Created IP addresses")
         
+        # Seed the utilization counters the API keeps up to date from here on
+        usage = {}
+        for ip in ips:
+            counters = usage.setdefault(ip.subnet_id, {column: 0 for column in STATUS_COLUMNS.values()})
+            counters[STATUS_COLUMNS[ip.status]] += 1
+        db.add_all([SubnetUsage(subnet_id=subnet_id, **counters) for subnet_id, counters in usage.items()])
+        db.commit()
+        print("✓ Created subnet usage counters")
+        
         print("\n✅ Database seeded successfully!")
         print("\nDefault credentials:")
         print("  Admin:    admin@ipam.local / Admin123!")
@@ -1,29 +1,85 @@
+import asyncio
+import gzip
+import json
 import pytest
+from datetime import datetime, timedelta, timezone
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 from app.main import app
 from app.core.database import Base, get_db
-from app.core.security import get_password_hash
+from app.core.security import get_password_hash, principal_cache, password_hasher, pwd_context
 from app.models.user import User, UserRole
+from app.models.ip_address import IPAddress, IPStatus
+from app.models.audit_log import AuditLog
+from app.services.audit_service import AuditWriter
+from app.core.cache import read_cache
+from collections import OrderedDict
+from app.services import ip_allocator
+from app.services.ip_allocator import invalidate_allocator
+from app.services.ip_service import IPService
+from app.services import lease_service
+from app.services.usage_service import reconcile_usage
+from app.models.subnet_usage import SubnetUsage
+from app.models.scan_lease import ScanLease
 
 # Test database
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
 engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-def override_get_db():
-    try:
-        db = TestingSessionLocal()
+# The API runs on an async session; TestClient may use a fresh event loop per request, so skip pooling
+async_engine = create_async_engine("sqlite+aiosqlite:///./test.db", poolclass=NullPool)
+TestingAsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+class FakeRedis:
+    """Just enough of redis.asyncio.Redis for the read cache"""
+    
+    def __init__(self, fail=False):
+        self.data = {}
+        self.fail = fail
+        self.gets = 0
+    
+    def _check(self):
+        if self.fail:
+            raise ConnectionError("redis is down")
+    
+    async def get(self, key):
+        self._check()
+        self.gets += 1
+        value = self.data.get(key)
+        return value.encode() if isinstance(value, str) else value
+    
+    async def set(self, key, value, ex=None):
+        self._check()
+        self.data[key] = value
+        return True
+    
+    async def delete(self, *keys):
+        self._check()
+        return sum(1 for key in keys if self.data.pop(key, None) is not None)
+    
+    async def incr(self, key):
+        self._check()
+        self.data[key] = str(int(self.data.get(key) or 0) + 1)
+        return int(self.data[key])
+
+async def override_get_db():
+    async with TestingAsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 app.dependency_overrides[get_db] = override_get_db
 
 @pytest.fixture(scope="function")
 def client():
     Base.metadata.create_all(bind=engine)
+    # Ids are reused once the tables are recreated
+    principal_cache.clear()
+    invalidate_allocator()
+    read_cache.client = FakeRedis()
     yield TestClient(app)
     Base.metadata.drop_all(bind=engine)
 
@@ -64,6 +120,61 @@ def test_login_invalid_credentials(client, test_user):
     })
     assert response.status_code == 401
 
+def test_login_sheds_load_when_hashing_pool_is_saturated(client, test_user, monkeypatch):
+    monkeypatch.setattr(password_hasher, "max_pending", 0)
+    response = client.post("/api/v1/auth/login", json={
+        "email": "test@example.com",
+        "password": "testpass123"
+    })
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+
+def test_login_rehashes_outdated_password_hash(client, test_user):
+    db = TestingSessionLocal()
+    user = db.query(User).filter(User.id == test_user.id).first()
+    user.hashed_password = pwd_context.hash("testpass123", rounds=4)
+    db.commit()
+    db.close()
+    
+    response = client.post("/api/v1/auth/login", json={
+        "email": "test@example.com",
+        "password": "testpass123"
+    })
+    assert response.status_code == 200
+    
+    db = TestingSessionLocal()
+    hashed_password = db.query(User).filter(User.id == test_user.id).first().hashed_password
+    db.close()
+    assert not pwd_context.needs_update(hashed_password)
+    assert pwd_context.verify("testpass123", hashed_password)
+
+def test_deactivated_user_loses_cached_access(client, test_user):
+    login_response = client.post("/api/v1/auth/login", json={
+        "email": "test@example.com",
+        "password": "testpass123"
+    })
+    admin_headers = {"Authorization": f"Bearer {login_response.json()['access_token']}"}
+    
+    user_id = client.post("/api/v1/users", json={
+        "username": "scanner",
+        "email": "scanner@example.com",
+        "password": "scannerpass123",
+        "role": "read_only"
+    }, headers=admin_headers).json()["id"]
+    token = client.post("/api/v1/auth/login", json={
+        "email": "scanner@example.com",
+        "password": "scannerpass123"
+    }).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    
+    # The second call is served from the principal cache
+    assert client.get("/api/v1/auth/me", headers=headers).status_code == 200
+    assert client.get("/api/v1/auth/me", headers=headers).json()["username"] == "scanner"
+    
+    response = client.put(f"/api/v1/users/{user_id}", json={"active": False}, headers=admin_headers)
+    assert response.status_code == 200
+    assert client.get("/api/v1/auth/me", headers=headers).status_code == 403
+
 def test_create_subnet(client, test_user):
     # Login first
     login_response = client.post("/api/v1/auth/login", json={
@@ -125,3 +236,600 @@ def test_allocate_ip(client, test_user):
     )
     assert response.status_code == 200
     assert len(response.json()) == 1
+
+def test_allocate_ips_are_sequential_and_distinct(client, test_user):
+    login_response = client.post("/api/v1/auth/login", json={
+        "email": "test@example.com",
+        "password": "testpass123"
+    })
+    token = login_response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    
+    subnet_response = client.post(
+        "/api/v1/subnets",
+        json={"cidr": "10.0.2.0/24", "reserved_ranges": [{"start": "10.0.2.1", "end": "10.0.2.5"}]},
+        headers=headers
+    )
+    subnet_id = subnet_response.json()["id"]
+    
+    first = client.post("/api/v1/ips/allocate", json={"subnet_id": subnet_id, "count": 2}, headers=headers)
+    second = client.post("/api/v1/ips/allocate", json={"subnet_id": subnet_id, "count": 2}, headers=headers)
+    addresses = [ip["address"] for ip in first.json() + second.json()]
+    assert addresses == ["10.0.2.6", "10.0.2.7", "10.0.2.8", "10.0.2.9"]
+
+def test_create_overlapping_subnet_conflicts(client, test_user):
+    login_response = client.post("/api/v1/auth/login", json={
+        "email": "test@example.com",
+        "password": "testpass123"
+    })
+    token = login_response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    
+    response = client.post("/api/v1/subnets", json={"cidr": "10.5.0.0/16"}, headers=headers)
+    assert response.status_code == 201
+    
+    response = client.post("/api/v1/subnets", json={"cidr": "10.5.3.0/24"}, headers=headers)
+    assert response.status_code == 409
+    
+    response = client.post("/api/v1/subnets", json={"cidr": "10.6.0.0/24"}, headers=headers)
+    assert response.status_code == 201
+
+def test_lookup_subnet_for_address(client, test_user):
+    login_response = client.post("/api/v1/auth/login", json={
+        "email": "test@example.com",
+        "password": "testpass123"
+    })
+    token = login_response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    
+    client.post("/api/v1/subnets", json={"cidr": "172.16.0.0/24"}, headers=headers)
+    
+    response = client.get("/api/v1/subnets/lookup", params={"address": "172.16.0.42"}, headers=headers)
+    assert response.status_code == 200
+    assert response.json()["cidr"] == "172.16.0.0/24"
+    
+    response = client.get("/api/v1/subnets/lookup", params={"address": "172.17.0.1"}, headers=headers)
+    assert response.status_code == 404
+
+def test_allocate_retries_after_concurrent_insert(client, test_user):
+    login_response = client.post("/api/v1/auth/login", json={
+        "email": "test@example.com",
+        "password": "testpass123"
+    })
+    token = login_response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    
+    subnet_id = client.post("/api/v1/subnets", json={"cidr": "10.0.3.0/24"}, headers=headers).json()["id"]
+    first = client.post("/api/v1/ips/allocate", json={"subnet_id": subnet_id, "count": 1}, headers=headers)
+    assert first.json()[0]["address"] == "10.0.3.1"
+    
+    # Simulate another worker taking the next address behind this process's back
+    db = TestingSessionLocal()
+    db.add(IPAddress(address="10.0.3.2", subnet_id=subnet_id, status=IPStatus.ASSIGNED))
+    db.commit()
+    db.close()
+    
+    second = client.post("/api/v1/ips/allocate", json={"subnet_id": subnet_id, "count": 1}, headers=headers)
+    assert second.status_code == 200
+    assert second.json()[0]["address"] == "10.0.3.3"
+
+def test_allocate_does_not_retry_other_integrity_errors(client, test_user, monkeypatch):
+    login_response = client.post("/api/v1/auth/login", json={
+        "email": "test@example.com",
+        "password": "testpass123"
+    })
+    token = login_response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    
+    subnet_id = client.post("/api/v1/subnets", json={"cidr": "10.0.4.0/24"}, headers=headers).json()["id"]
+    attempts = []
+    
+    async def violate_foreign_key(self, *args):
+        attempts.append(args)
+        raise IntegrityError("INSERT INTO ip_addresses ...", {}, Exception("FOREIGN KEY constraint failed"))
+    
+    monkeypatch.setattr(IPService, "_allocate_once", violate_foreign_key)
+    with pytest.raises(IntegrityError):
+        client.post("/api/v1/ips/allocate", json={"subnet_id": subnet_id, "count": 1}, headers=headers)
+    assert len(attempts) == 1
+
+def test_subnet_stats_are_cached_until_an_allocation(client, test_user):
+    login_response = client.post("/api/v1/auth/login", json={
+        "email": "test@example.com",
+        "password": "testpass123"
+    })
+    token = login_response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    
+    subnet_id = client.post("/api/v1/subnets", json={"cidr": "10.0.5.0/24"}, headers=headers).json()["id"]
+    assert client.get(f"/api/v1/subnets/{subnet_id}", headers=headers).json()["used_ips"] == 0
+    assert f"ipam:subnet_stats:{subnet_id}" in read_cache.client.data
+    
+    client.post("/api/v1/ips/allocate", json={"subnet_id": subnet_id, "count": 1}, headers=headers)
+    assert f"ipam:subnet_stats:{subnet_id}" not in read_cache.client.data
+    
+    ip_id = client.get(f"/api/v1/ips?subnet_id={subnet_id}", headers=headers).json()[0]["id"]
+    device_id = client.post("/api/v1/devices", json={"hostname": "web-1"}, headers=headers).json()["id"]
+    client.put(f"/api/v1/ips/{ip_id}/assign", json={"device_id": device_id}, headers=headers)
+    assert client.get(f"/api/v1/subnets/{subnet_id}", headers=headers).json()["used_ips"] == 1
+
+def test_subnet_usage_counters_track_ip_writes(client, test_user):
+    login_response = client.post("/api/v1/auth/login", json={
+        "email": "test@example.com",
+        "password": "testpass123"
+    })
+    token = login_response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    
+    subnet_id = client.post("/api/v1/subnets", json={"cidr": "10.0.6.0/24"}, headers=headers).json()["id"]
+    ips = client.post("/api/v1/ips/allocate", json={"subnet_id": subnet_id, "count": 3}, headers=headers).json()
+    device_id = client.post("/api/v1/devices", json={"hostname": "db-1"}, headers=headers).json()["id"]
+    client.put(f"/api/v1/ips/{ips[0]['id']}/assign", json={"device_id": device_id}, headers=headers)
+    client.post(f"/api/v1/ips/{ips[1]['id']}/conflict-resolve", json={"action": "quarantine"}, headers=headers)
+    client.delete(f"/api/v1/ips/{ips[2]['id']}", headers=headers)
+    
+    db = TestingSessionLocal()
+    usage = db.query(SubnetUsage).filter(SubnetUsage.subnet_id == subnet_id).first()
+    assert (usage.free_count, usage.assigned_count, usage.quarantined_count) == (0, 1, 1)
+    assert client.get(f"/api/v1/subnets/{subnet_id}", headers=headers).json()["used_ips"] == 1
+    
+    # Simulate drift from a write that bypassed the service layer
+    usage.assigned_count = 7
+    db.commit()
+    db.close()
+    
+    async def reconcile(repair):
+        async with TestingAsyncSessionLocal() as session:
+            return await reconcile_usage(session, repair=repair)
+    
+    drift = asyncio.run(reconcile(repair=True))
+    assert [(item["subnet_id"], item["stored"]["assigned_count"], item["actual"]["assigned_count"]) for item in drift] == [(subnet_id, 7, 1)]
+    assert asyncio.run(reconcile(repair=False)) == []
+
+def test_subnet_tree_rolls_up_usage(client, test_user):
+    login_response = client.post("/api/v1/auth/login", json={
+        "email": "test@example.com",
+        "password": "testpass123"
+    })
+    token = login_response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    
+    root_id = client.post("/api/v1/subnets", json={"cidr": "10.10.0.0/16"}, headers=headers).json()["id"]
+    child_id = client.post(f"/api/v1/subnets/{root_id}/allocate-prefix", json={"prefix_length": 24}, headers=headers).json()["id"]
+    leaf_id = client.post(f"/api/v1/subnets/{child_id}/allocate-prefix", json={"prefix_length": 25}, headers=headers).json()["id"]
+    ip_id = client.post("/api/v1/ips/allocate", json={"subnet_id": leaf_id, "count": 1}, headers=headers).json()[0]["id"]
+    device_id = client.post("/api/v1/devices", json={"hostname": "edge-1"}, headers=headers).json()["id"]
+    client.put(f"/api/v1/ips/{ip_id}/assign", json={"device_id": device_id}, headers=headers)
+    
+    response = client.get("/api/v1/subnets/tree", headers=headers)
+    assert response.status_code == 200
+    [root] = response.json()
+    assert root["id"] == root_id
+    assert root["children"][0]["children"][0]["id"] == leaf_id
+    assert (root["used_ips"], root["subtree_used_ips"]) == (0, 1)
+    # Nested ranges are part of the parent, so the subtree is exactly the /16
+    assert root["subtree_total_ips"] == 65536
+    assert root["subtree_free_ips"] == 65536 - 1
+    assert root["children"][0]["subtree_total_ips"] == 256
+    
+    # Deeper levels are cut from the output but still count in the totals
+    [child] = client.get(f"/api/v1/subnets/tree?root_id={child_id}&max_depth=0", headers=headers).json()
+    assert child["children"] == [] and child["children_count"] == 1
+    assert child["subtree_used_ips"] == 1
+    
+    assert client.get("/api/v1/subnets/tree?root_id=999", headers=headers).status_code == 404
+
+def test_subnet_reads_survive_cache_outage(client, test_user):
+    login_response = client.post("/api/v1/auth/login", json={
+        "email": "test@example.com",
+        "password": "testpass123"
+    })
+    token = login_response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    
+    read_cache.client = FakeRedis(fail=True)
+    parent_id = client.post("/api/v1/subnets", json={"cidr": "10.1.0.0/16"}, headers=headers).json()["id"]
+    child = client.post(f"/api/v1/subnets/{parent_id}/allocate-prefix", json={"prefix_length": 24}, headers=headers)
+    assert child.json()["cidr"] == "10.1.0.0/24"
+    
+    assert client.get(f"/api/v1/subnets/{parent_id}", headers=headers).json()["children_count"] == 1
+    assert len(client.get(f"/api/v1/subnets/{parent_id}/children", headers=headers).json()) == 1
+
+def test_audit_writer_flushes_in_batches(client):
+    writer = AuditWriter(batch_size=2, flush_interval=60, max_queue_size=3)
+    for i in range(4):
+        writer.enqueue(async_engine, {"user_id": None, "action": f"test_{i}", "target_type": "test"})
+    
+    # The fourth record exceeds max_queue_size and is dropped
+    assert asyncio.run(writer.flush()) == 3
+    
+    db = TestingSessionLocal()
+    actions = sorted(log.action for log in db.query(AuditLog).all())
+    db.close()
+    assert actions == ["test_0", "test_1", "test_2"]
+
+def test_audit_logs_cursor_pagination(client, test_user):
+    login_response = client.post("/api/v1/auth/login", json={
+        "email": "test@example.com",
+        "password": "testpass123"
+    })
+    token = login_response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    for i in range(4):
+        client.post("/api/v1/vlans", json={"name": f"vlan-{i}", "number": 100 + i}, headers=headers)
+    
+    seen = []
+    response = client.get("/api/v1/audit-logs", params={"limit": 2}, headers=headers)
+    while True:
+        assert response.status_code == 200
+        seen.extend(log["id"] for log in response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+        response = client.get("/api/v1/audit-logs", params={"limit": 2, "cursor": cursor}, headers=headers)
+    
+    # One login plus four VLAN creations, newest first and without repeats
+    assert len(seen) == 5
+    assert len(set(seen)) == 5
+    assert seen == sorted(seen, reverse=True)
+    
+    response = client.get("/api/v1/audit-logs", params={"cursor": "not-a-cursor"}, headers=headers)
+    assert response.status_code == 400
+
+def test_list_devices_cursor_pagination(client, test_user):
+    login_response = client.post("/api/v1/auth/login", json={
+        "email": "test@example.com",
+        "password": "testpass123"
+    })
+    token = login_response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    for i in range(5):
+        client.post("/api/v1/devices", json={"hostname": f"host-{i}"}, headers=headers)
+    
+    page = client.get("/api/v1/devices", params={"limit": 3}, headers=headers)
+    assert [d["hostname"] for d in page.json()] == ["host-0", "host-1", "host-2"]
+    
+    cursor = page.headers["X-Next-Cursor"]
+    page = client.get("/api/v1/devices", params={"limit": 3, "cursor": cursor}, headers=headers)
+    assert [d["hostname"] for d in page.json()] == ["host-3", "host-4"]
+    assert "X-Next-Cursor" not in page.headers
+
+def test_export_ips_csv_streams_gzip(client, test_user):
+    login_response = client.post("/api/v1/auth/login", json={
+        "email": "test@example.com",
+        "password": "testpass123"
+    })
+    token = login_response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    subnet_id = client.post("/api/v1/subnets", json={"cidr": "10.0.4.0/24"}, headers=headers).json()["id"]
+    client.post("/api/v1/ips/allocate", json={"subnet_id": subnet_id, "count": 3}, headers=headers)
+    
+    response = client.get("/api/v1/export/csv", params={"entity_type": "ips", "gzip": True}, headers=headers)
+    assert response.status_code == 200
+    lines = gzip.decompress(response.content).decode().splitlines()
+    assert lines[0].startswith("id,address,subnet_id")
+    assert [line.split(",")[1] for line in lines[1:]] == ["10.0.4.1", "10.0.4.2", "10.0.4.3"]
+
+def test_import_ips_csv_reports_row_errors(client, test_user):
+    login_response = client.post("/api/v1/auth/login", json={
+        "email": "test@example.com",
+        "password": "testpass123"
+    })
+    token = login_response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    subnet_id = client.post("/api/v1/subnets", json={"cidr": "10.0.5.0/24"}, headers=headers).json()["id"]
+    
+    content = "\n".join([
+        "address,subnet_id,status,hostname",
+        f"10.0.5.10,{subnet_id},assigned,web-1",
+        f"not-an-ip,{subnet_id},assigned,web-2",
+        f"10.0.5.11,{subnet_id},assigned,web-3",
+        f"10.0.5.10,{subnet_id},assigned,web-4",
+        f"10.9.9.9,{subnet_id},assigned,web-5",
+    ])
+    response = client.post(
+        "/api/v1/import/csv",
+        params={"entity_type": "ips"},
+        files={"file": ("ips.csv", content, "text/csv")},
+        headers=headers
+    )
+    assert response.status_code == 200
+    result = response.json()
+    assert result["created"] == 2
+    assert result["failed"] == 3
+    assert [error.split(":")[0] for error in result["errors"]] == ["Row 3", "Row 6", "Row 5"]
+    assert "rows_per_second" in result
+
+def test_free_addresses_are_synthesized_not_stored(client, test_user):
+    login_response = client.post("/api/v1/auth/login", json={
+        "email": "test@example.com",
+        "password": "testpass123"
+    })
+    token = login_response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    
+    subnet_id = client.post("/api/v1/subnets", json={"cidr": "10.0.9.0/29"}, headers=headers).json()["id"]
+    ips = client.post("/api/v1/ips/allocate", json={"subnet_id": subnet_id, "count": 2}, headers=headers).json()
+    assert [ip["status"] for ip in ips] == ["reserved", "reserved"]
+    
+    response = client.get(f"/api/v1/ips?subnet_id={subnet_id}&status=free&limit=2", headers=headers)
+    assert [ip["address"] for ip in response.json()] == ["10.0.9.3", "10.0.9.4"]
+    assert response.json()[0]["id"] is None
+    cursor = response.headers["X-Next-Cursor"]
+    response = client.get(f"/api/v1/ips?subnet_id={subnet_id}&status=free&limit=2&cursor={cursor}", headers=headers)
+    assert [ip["address"] for ip in response.json()] == ["10.0.9.5", "10.0.9.6"]
+    
+    # Releasing deletes the row and puts the address back in the free pool
+    client.post(f"/api/v1/ips/{ips[0]['id']}/conflict-resolve", json={"action": "release"}, headers=headers)
+    assert client.get(f"/api/v1/ips/{ips[0]['id']}", headers=headers).status_code == 404
+    response = client.get(f"/api/v1/ips?subnet_id={subnet_id}&status=free", headers=headers)
+    assert [ip["address"] for ip in response.json()][:2] == ["10.0.9.1", "10.0.9.3"]
+    stats = client.get(f"/api/v1/subnets/{subnet_id}", headers=headers).json()
+    assert (stats["used_ips"], stats["free_ips"]) == (1, 7)
+    
+    assert client.get("/api/v1/ips?status=free", headers=headers).status_code == 400
+    assert client.put(f"/api/v1/ips/{ips[1]['id']}", json={"status": "free"}, headers=headers).status_code == 422
+
+def test_allocator_cache_sees_release_by_another_worker(client, test_user, monkeypatch):
+    login_response = client.post("/api/v1/auth/login", json={
+        "email": "test@example.com",
+        "password": "testpass123"
+    })
+    token = login_response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    
+    subnet_id = client.post("/api/v1/subnets", json={"cidr": "10.0.10.0/29"}, headers=headers).json()["id"]
+    ips = client.post("/api/v1/ips/allocate", json={"subnet_id": subnet_id, "count": 3}, headers=headers).json()
+    assert [ip["address"] for ip in ips] == ["10.0.10.1", "10.0.10.2", "10.0.10.3"]
+    
+    # Release through a second worker's cache; this process still has 10.0.10.1 marked used
+    this_worker = ip_allocator._allocators
+    monkeypatch.setattr(ip_allocator, "_allocators", OrderedDict())
+    client.post(f"/api/v1/ips/{ips[0]['id']}/conflict-resolve", json={"action": "release"}, headers=headers)
+    monkeypatch.setattr(ip_allocator, "_allocators", this_worker)
+    assert this_worker[subnet_id].is_used(ip_allocator.address_to_int("10.0.10.1"))
+    
+    response = client.get(f"/api/v1/ips?subnet_id={subnet_id}&status=free&limit=2", headers=headers)
+    assert [ip["address"] for ip in response.json()] == ["10.0.10.1", "10.0.10.4"]
+    response = client.post("/api/v1/ips/allocate", json={"subnet_id": subnet_id, "count": 1}, headers=headers)
+    assert response.json()[0]["address"] == "10.0.10.1"
+    
+    # Our own writes keep the cached map valid instead of forcing a rebuild
+    allocator = ip_allocator._allocators[subnet_id]
+    client.post("/api/v1/ips/allocate", json={"subnet_id": subnet_id, "count": 1}, headers=headers)
+    assert ip_allocator._allocators[subnet_id] is allocator
+
+def test_allocate_prefix_carves_lowest_free_block(client, test_user):
+    login_response = client.post("/api/v1/auth/login", json={
+        "email": "test@example.com",
+        "password": "testpass123"
+    })
+    token = login_response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    
+    parent_id = client.post("/api/v1/subnets", json={"cidr": "10.50.0.0/22"}, headers=headers).json()["id"]
+    
+    def allocate(prefix_length):
+        return client.post(f"/api/v1/subnets/{parent_id}/allocate-prefix", json={"prefix_length": prefix_length}, headers=headers)
+    
+    first = allocate(24)
+    assert first.status_code == 201
+    assert (first.json()["cidr"], first.json()["parent_subnet_id"]) == ("10.50.0.0/24", parent_id)
+    assert allocate(25).json()["cidr"] == "10.50.1.0/25"
+    assert allocate(23).json()["cidr"] == "10.50.2.0/23"
+    assert allocate(25).json()["cidr"] == "10.50.1.128/25"
+    assert allocate(24).status_code == 409
+    assert allocate(16).status_code == 400
+    
+    client.delete(f"/api/v1/subnets/{first.json()['id']}", headers=headers)
+    assert allocate(26).json()["cidr"] == "10.50.0.0/26"
+    assert len(client.get(f"/api/v1/subnets/{parent_id}/children", headers=headers).json()) == 4
+
+def test_allocate_in_parent_skips_carved_child_prefix(client, test_user):
+    login_response = client.post("/api/v1/auth/login", json={
+        "email": "test@example.com",
+        "password": "testpass123"
+    })
+    token = login_response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    
+    parent_id = client.post("/api/v1/subnets", json={"cidr": "10.20.0.0/16"}, headers=headers).json()["id"]
+    # Warm the parent's cached occupancy map before the carve
+    assert client.get(f"/api/v1/ips?subnet_id={parent_id}&status=free&limit=1", headers=headers).json()[0]["address"] == "10.20.0.1"
+    child = client.post(f"/api/v1/subnets/{parent_id}/allocate-prefix", json={"prefix_length": 24}, headers=headers).json()
+    assert child["cidr"] == "10.20.0.0/24"
+    
+    response = client.post("/api/v1/ips/allocate", json={"subnet_id": parent_id, "count": 2}, headers=headers)
+    assert response.status_code == 200
+    assert [ip["address"] for ip in response.json()] == ["10.20.1.0", "10.20.1.1"]
+    child_ip = client.post("/api/v1/ips/allocate", json={"subnet_id": child["id"], "count": 1}, headers=headers).json()[0]
+    assert child_ip["address"] == "10.20.0.1"
+
+def test_ipv6_allocation_strategies_and_exact_stats(client, test_user):
+    login_response = client.post("/api/v1/auth/login", json={
+        "email": "test@example.com",
+        "password": "testpass123"
+    })
+    token = login_response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    
+    subnet_id = client.post("/api/v1/subnets", json={"cidr": "2001:db8:7::/64"}, headers=headers).json()["id"]
+    
+    response = client.post("/api/v1/ips/allocate", json={
+        "subnet_id": subnet_id, "strategy": "eui64", "mac_address": "00:11:22:33:44:55"
+    }, headers=headers)
+    assert response.json()[0]["address"] == "2001:db8:7:0:211:22ff:fe33:4455"
+    response = client.post("/api/v1/ips/allocate", json={"subnet_id": subnet_id, "count": 3, "strategy": "random"}, headers=headers)
+    assert len({ip["address"] for ip in response.json()}) == 3
+    assert client.post("/api/v1/ips/allocate", json={"subnet_id": subnet_id, "count": 2}, headers=headers).json()[0]["address"] == "2001:db8:7::1"
+    assert client.post("/api/v1/ips/allocate", json={"subnet_id": subnet_id, "strategy": "eui64"}, headers=headers).status_code == 422
+    
+    stats = client.get(f"/api/v1/subnets/{subnet_id}", headers=headers).json()
+    assert stats["total_ips_exact"] == str(2 ** 64)
+    assert stats["free_ips_exact"] == str(2 ** 64 - 6)
+    assert stats["used_ips"] == 6
+
+def test_scan_results_are_applied_in_one_batch(client, test_user):
+    login_response = client.post("/api/v1/auth/login", json={
+        "email": "test@example.com",
+        "password": "testpass123"
+    })
+    token = login_response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    
+    subnet_id = client.post("/api/v1/subnets", json={"cidr": "10.0.11.0/24"}, headers=headers).json()["id"]
+    ips = client.post("/api/v1/ips/allocate", json={"subnet_id": subnet_id, "count": 2}, headers=headers).json()
+    
+    lines = [
+        {"id": ips[0]["id"], "last_seen": "2024-05-01T12:00:00", "reachability": "reachable", "open_ports": [443, 22]},
+        {"address": "10.0.11.2", "reachability": "unreachable"},
+        {"address": "10.0.11.99", "reachability": "reachable"},
+    ]
+    response = client.post(
+        "/api/v1/ips/scan-results",
+        content="\n".join(json.dumps(line) for line in lines),
+        headers={**headers, "Content-Type": "application/x-ndjson"}
+    )
+    assert response.status_code == 200
+    assert response.json() == {"received": 3, "updated": 2, "unmatched": ["10.0.11.99"]}
+    
+    db = TestingSessionLocal()
+    first, second = (db.get(IPAddress, ip["id"]) for ip in ips)
+    assert first.last_seen.replace(tzinfo=None) == datetime(2024, 5, 1, 12, 0)
+    metadata = db.execute(
+        select(IPAddress.__table__.c["metadata"]).where(IPAddress.__table__.c.id == first.id)
+    ).scalar()
+    assert metadata["scan"] == {"reachability": "reachable", "open_ports": [22, 443], "scanned_at": metadata["scan"]["scanned_at"]}
+    assert second.last_seen is None
+    db.close()
+    
+    response = client.post("/api/v1/ips/scan-results", json=[{"reachability": "reachable"}], headers=headers)
+    assert response.status_code == 422
+
+def test_scan_targets_stream_as_ndjson(client, test_user):
+    login_response = client.post("/api/v1/auth/login", json={
+        "email": "test@example.com",
+        "password": "testpass123"
+    })
+    token = login_response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    
+    subnet_id = client.post("/api/v1/subnets", json={"cidr": "10.0.12.0/24"}, headers=headers).json()["id"]
+    ips = client.post("/api/v1/ips/allocate", json={"subnet_id": subnet_id, "count": 6}, headers=headers).json()
+    client.post("/api/v1/ips/scan-results", json=[
+        {"id": ips[0]["id"], "last_seen": datetime.utcnow().isoformat(), "reachability": "reachable"}
+    ], headers=headers)
+    
+    def targets(**params):
+        response = client.get("/api/v1/scan/targets", params={"status": "reserved", "subnet_id": subnet_id, **params}, headers=headers)
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        return [json.loads(line) for line in response.text.splitlines()]
+    
+    assert [target["address"] for target in targets()] == [f"10.0.12.{i}" for i in range(1, 7)]
+    assert [target["id"] for target in targets(stale_seconds=3600)] == [ip["id"] for ip in ips[1:]]
+    shards = [{target["id"] for target in targets(shard=shard, shards=2)} for shard in (0, 1)]
+    assert shards[0].isdisjoint(shards[1]) and shards[0] | shards[1] == {ip["id"] for ip in ips}
+    assert [target["id"] for target in targets(after_id=ips[3]["id"])] == [ips[4]["id"], ips[5]["id"]]
+    assert client.get("/api/v1/scan/targets", params={"shard": 2, "shards": 2}, headers=headers).status_code == 400
+
+def test_scan_leases_split_subnets_between_agents(client, test_user):
+    login_response = client.post("/api/v1/auth/login", json={
+        "email": "test@example.com",
+        "password": "testpass123"
+    })
+    token = login_response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    
+    subnet_ids = [
+        client.post("/api/v1/subnets", json={"cidr": f"10.0.{20 + i}.0/24"}, headers=headers).json()["id"]
+        for i in range(5)
+    ]
+    
+    def call(action, holder, **body):
+        response = client.post(f"/api/v1/scan/leases/{action}", json={"holder": holder, **body}, headers=headers)
+        assert response.status_code == 200
+        return set(response.json()["subnet_ids"])
+    
+    # The first agent holds everything until a second one asks for its share
+    assert call("claim", "agent-a") == set(subnet_ids)
+    assert call("claim", "agent-b") == set()
+    a = call("renew", "agent-a")
+    b = call("claim", "agent-b")
+    assert len(a) == 3 and len(b) == 2
+    assert a.isdisjoint(b) and a | b == set(subnet_ids)
+    assert call("claim", "agent-a") == a and call("claim", "agent-b") == b
+    
+    # Leases of an agent that stopped renewing are taken over once they expire
+    db = TestingSessionLocal()
+    db.query(ScanLease).filter(ScanLease.holder == "agent-a").update({"expires_at": datetime(2000, 1, 1)})
+    db.commit()
+    db.close()
+    assert call("claim", "agent-b") == set(subnet_ids)
+    assert call("renew", "agent-a") == set()
+    
+    assert call("release", "agent-b", subnet_ids=subnet_ids[:2]) == set(subnet_ids[2:])
+    assert call("claim", "agent-c", limit=1) == {subnet_ids[0]}
+    leases = client.get("/api/v1/scan/leases", headers=headers).json()
+    assert {lease["subnet_id"]: lease["holder"] for lease in leases} == {
+        subnet_ids[0]: "agent-c", **{subnet_id: "agent-b" for subnet_id in subnet_ids[2:]}
+    }
+    
+    ips = [
+        client.post("/api/v1/ips/allocate", json={"subnet_id": subnet_id, "count": 1}, headers=headers).json()[0]
+        for subnet_id in subnet_ids[:3]
+    ]
+    response = client.get(
+        "/api/v1/scan/targets",
+        params={"status": "reserved", "subnet_id": subnet_ids[1:3]},
+        headers=headers
+    )
+    assert [json.loads(line)["id"] for line in response.text.splitlines()] == [ip["id"] for ip in ips[1:]]
+    
+    # Agents fetch their own subnets by holder; expired leases drop out of the feed
+    def held_targets(holder):
+        response = client.get("/api/v1/scan/targets", params={"status": "reserved", "holder": holder}, headers=headers)
+        return [json.loads(line)["id"] for line in response.text.splitlines()]
+    
+    assert held_targets("agent-b") == [ips[2]["id"]]
+    assert held_targets("agent-c") == [ips[0]["id"]]
+    db = TestingSessionLocal()
+    db.query(ScanLease).filter(ScanLease.holder == "agent-c").update({"expires_at": datetime(2000, 1, 1)})
+    db.commit()
+    db.close()
+    assert held_targets("agent-c") == []
+
+def test_scan_lease_agents_never_overlap(client, test_user, monkeypatch):
+    login_response = client.post("/api/v1/auth/login", json={
+        "email": "test@example.com",
+        "password": "testpass123"
+    })
+    token = login_response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    
+    subnet_ids = {
+        client.post("/api/v1/subnets", json={"cidr": f"10.0.{40 + i}.0/24"}, headers=headers).json()["id"]
+        for i in range(9)
+    }
+    clock = {"now": datetime(2024, 5, 1, tzinfo=timezone.utc)}
+    monkeypatch.setattr(lease_service, "utcnow", lambda: clock["now"])
+    ttl, tick = 30, timedelta(seconds=10)
+    
+    # Agents claim every third of the TTL like scanner.py; agent-a stops in round 8 without releasing
+    joins = {"agent-a": 0, "agent-b": 1, "agent-c": 3}
+    beliefs, last_call = {}, {}
+    for round_number in range(16):
+        live = [agent for agent, joined in joins.items() if joined <= round_number and not (agent == "agent-a" and round_number >= 8)]
+        for agent in live[round_number % len(live):] + live[:round_number % len(live)]:
+            response = client.post("/api/v1/scan/leases/claim", json={"holder": agent, "ttl_seconds": ttl}, headers=headers)
+            beliefs[agent] = set(response.json()["subnet_ids"])
+            last_call[agent] = clock["now"]
+            # An agent counts as scanning its subnets until its leases run out
+            scanning = [
+                held for holder, held in beliefs.items()
+                if clock["now"] < last_call[holder] + timedelta(seconds=ttl)
+            ]
+            assert sum(map(len, scanning)) == len(set().union(*scanning))
+        clock["now"] += tick
+    
+    assert beliefs["agent-b"] | beliefs["agent-c"] == subnet_ids
+    assert sorted(map(len, (beliefs["agent-b"], beliefs["agent-c"]))) == [4, 5]
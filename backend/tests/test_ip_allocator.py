@@ -0,0 +1,76 @@
+import pytest
+from app.services.ip_allocator import AddressAllocator, AllocationStrategy, address_to_int
+from app.services.reserved_ranges import normalize_reserved_ranges
+
+
+def test_next_free_skips_used_runs():
+    allocator = AddressAllocator("10.0.0.0/29")
+    allocator.load(address_to_int(f"10.0.0.{i}") for i in (1, 2, 3, 5))
+    assert [allocator.to_address(v) for v in allocator.next_free(3)] == ["10.0.0.4", "10.0.0.6"]
+
+
+def test_reserved_ranges_are_skipped():
+    allocator = AddressAllocator("10.0.0.0/24", [{"start": "10.0.0.1", "end": "10.0.0.10"}])
+    assert allocator.to_address(allocator.next_free(1)[0]) == "10.0.0.11"
+
+
+def test_mark_used_and_free_keep_runs_merged():
+    allocator = AddressAllocator("192.168.0.0/24")
+    for i in (1, 3, 2):
+        allocator.mark_used(address_to_int(f"192.168.0.{i}"))
+    assert allocator.used_count == 3
+    allocator.mark_free(address_to_int("192.168.0.2"))
+    assert allocator.to_address(allocator.next_free(1)[0]) == "192.168.0.2"
+    assert allocator.used_count == 2
+
+
+def test_full_subnet_has_no_free_addresses():
+    allocator = AddressAllocator("10.1.0.0/30")
+    allocator.load([address_to_int("10.1.0.1"), address_to_int("10.1.0.2")])
+    assert allocator.next_free(1) == []
+
+
+def test_normalize_reserved_ranges_merges_and_sorts():
+    ranges = [
+        {"start": "10.0.0.20", "end": "10.0.0.30"},
+        {"start": "10.0.0.1", "end": "10.0.0.10"},
+        {"start": "10.0.0.11", "end": "10.0.0.12"},
+    ]
+    assert normalize_reserved_ranges("10.0.0.0/24", ranges) == [
+        {"start": "10.0.0.1", "end": "10.0.0.12"},
+        {"start": "10.0.0.20", "end": "10.0.0.30"},
+    ]
+
+
+def test_normalize_reserved_ranges_rejects_out_of_subnet():
+    with pytest.raises(ValueError):
+        normalize_reserved_ranges("10.0.0.0/24", [{"start": "10.0.0.250", "end": "10.0.1.5"}])
+
+
+def test_reserved_spans_are_skipped_as_whole_blocks():
+    allocator = AddressAllocator("10.0.0.0/16", [{"start": "10.0.0.1", "end": "10.0.255.200"}])
+    assert list(allocator.reserved_spans()) == [(address_to_int("10.0.0.1"), address_to_int("10.0.255.200"))]
+    assert allocator.to_address(allocator.next_free(1)[0]) == "10.0.255.201"
+
+
+def test_eui64_address_from_mac():
+    allocator = AddressAllocator("2001:db8::/64")
+    value = allocator.choose(1, AllocationStrategy.EUI64, "00:11:22:33:44:55")[0]
+    assert allocator.to_address(value) == "2001:db8::211:22ff:fe33:4455"
+    allocator.mark_used(value)
+    assert allocator.eui64("00-11-22-33-44-55") == []
+    with pytest.raises(ValueError):
+        AddressAllocator("10.0.0.0/24").eui64("00:11:22:33:44:55")
+
+
+def test_random_allocation_stays_in_range_without_enumerating():
+    allocator = AddressAllocator("2001:db8::/48")
+    values = allocator.random_free(50)
+    assert len(set(values)) == 50
+    assert all(allocator.first <= value <= allocator.last for value in values)
+
+
+def test_random_allocation_falls_back_when_nearly_full():
+    allocator = AddressAllocator("10.2.0.0/29")
+    allocator.load(address_to_int(f"10.2.0.{i}") for i in (1, 2, 3, 5, 6))
+    assert sorted(allocator.to_address(v) for v in allocator.random_free(3)) == ["10.2.0.4"]
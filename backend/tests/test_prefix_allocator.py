@@ -0,0 +1,28 @@
+from app.services.prefix_allocator import FreeBlockIndex, network_span
+
+
+def test_lowest_aligned_block_is_taken_first():
+    index = FreeBlockIndex("10.0.0.0/16", [network_span("10.0.0.0/24")])
+    assert str(index.to_network(index.allocate(25), 25)) == "10.0.1.0/25"
+    assert str(index.to_network(index.allocate(24), 24)) == "10.0.2.0/24"
+    assert str(index.to_network(index.allocate(25), 25)) == "10.0.1.128/25"
+
+
+def test_unaligned_gaps_are_skipped():
+    occupied = [network_span("10.0.0.0/26"), network_span("10.0.1.7/32")]
+    index = FreeBlockIndex("10.0.0.0/22", occupied)
+    assert str(index.to_network(index.allocate(24), 24)) == "10.0.2.0/24"
+    assert index.allocate(23) is None
+    assert str(index.to_network(index.allocate(24), 24)) == "10.0.3.0/24"
+    assert str(index.to_network(index.allocate(26), 26)) == "10.0.0.64/26"
+
+
+def test_full_parent_has_no_blocks():
+    index = FreeBlockIndex("192.168.0.0/24", [network_span("192.168.0.0/25"), network_span("192.168.0.128/25")])
+    assert index.allocate(30) is None
+
+
+def test_ipv6_blocks():
+    index = FreeBlockIndex("2001:db8::/48", [network_span("2001:db8::/64")])
+    assert str(index.to_network(index.allocate(64), 64)) == "2001:db8:0:1::/64"
+    assert str(index.to_network(index.allocate(56), 56)) == "2001:db8:0:100::/56"
@@ -0,0 +1,36 @@
+from app.services.prefix_trie import PrefixTrie
+
+
+def make_trie():
+    trie = PrefixTrie()
+    trie.insert(1, "10.0.0.0/16")
+    trie.insert(2, "10.0.1.0/24")
+    trie.insert(3, "10.0.2.0/24")
+    trie.insert(4, "2001:db8::/48")
+    return trie
+
+
+def test_overlap_detects_supernets_and_subnets():
+    trie = make_trie()
+    assert trie.overlaps("10.0.1.128/25")
+    assert trie.overlaps("10.0.0.0/8")
+    assert not trie.overlaps("10.1.0.0/16")
+    assert trie.overlaps("2001:db8:0:1::/64")
+    assert not trie.overlaps("2001:db9::/32")
+
+
+def test_covering_and_contained():
+    trie = make_trie()
+    assert trie.covering("10.0.1.7/32") == [1, 2]
+    assert sorted(trie.contained("10.0.0.0/16")) == [1, 2, 3]
+    assert trie.contained("192.168.0.0/16") == []
+
+
+def test_remove_updates_queries_and_version():
+    trie = make_trie()
+    version = trie.version
+    trie.remove(2)
+    assert trie.version > version
+    assert trie.covering("10.0.1.7/32") == [1]
+    trie.remove(1)
+    assert not trie.overlaps("10.0.1.0/24")
@@ -0,0 +1,174 @@
+"""
+Concurrent scan engine for the scanner agent
+
+Hosts are probed with asyncio TCP connects, a bounded number at a time,
+under a global packets-per-second budget. A refused connection still
+proves the host is up, so no ICMP (and no root or ping subprocess) is
+needed.
+"""
+import asyncio
+import errno
+import os
+import random
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import AsyncIterable, AsyncIterator, Iterable, List, Optional, Union
+
+SCAN_CONCURRENCY = int(os.getenv('SCAN_CONCURRENCY', os.getenv('SCANNER_CONCURRENT_SCANS', '50')))
+SCAN_RATE_PPS = float(os.getenv('SCAN_RATE_PPS', '500'))
+SCAN_PORTS = [int(port) for port in os.getenv('SCAN_PORTS', '22,80,443').split(',') if port.strip()]
+SCAN_CONNECT_TIMEOUT = float(os.getenv('SCAN_CONNECT_TIMEOUT', os.getenv('SCANNER_TIMEOUT_SECONDS', '2')))
+SCAN_HOST_TIMEOUT = float(os.getenv('SCAN_HOST_TIMEOUT', '5'))
+
+# Connect errors that mean something answered, so the host is up
+_HOST_UP_ERRNOS = {errno.ECONNREFUSED, errno.ECONNRESET}
+
+
+@dataclass
+class ScanResult:
+    address: str
+    id: Optional[int] = None
+    reachable: bool = False
+    open_ports: List[int] = field(default_factory=list)
+    last_seen: Optional[str] = None
+    error: Optional[str] = None
+
+    @property
+    def status(self) -> str:
+        if self.error:
+            return f"Error: {self.error}"
+        status = "Reachable" if self.reachable else "Unreachable"
+        if self.open_ports:
+            status += " | Open ports: " + ", ".join(str(port) for port in self.open_ports)
+        return status
+
+
+class TokenBucket:
+    """Async token bucket shared by every probe of an engine"""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(rate / 10, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class ScanEngine:
+    def __init__(
+        self,
+        concurrency: int = SCAN_CONCURRENCY,
+        rate_pps: float = SCAN_RATE_PPS,
+        ports: Optional[List[int]] = None,
+        connect_timeout: float = SCAN_CONNECT_TIMEOUT,
+        host_timeout: float = SCAN_HOST_TIMEOUT,
+        mock: bool = False
+    ):
+        self.concurrency = max(concurrency, 1)
+        self.ports = list(ports if ports is not None else SCAN_PORTS)
+        self.connect_timeout = connect_timeout
+        self.host_timeout = host_timeout
+        self.mock = mock
+        self.bucket = TokenBucket(rate_pps)
+
+    async def probe_port(self, address: str, port: int) -> Optional[bool]:
+        """True if the port accepted, False if the host refused, None if nothing answered"""
+        await self.bucket.acquire()
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_connection(address, port), self.connect_timeout)
+        except asyncio.TimeoutError:
+            return None
+        except OSError as e:
+            return False if e.errno in _HOST_UP_ERRNOS else None
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except OSError:
+            pass
+        return True
+
+    async def scan_host(self, target: dict) -> ScanResult:
+        """Probe every configured port of one target within the per-host timeout"""
+        result = ScanResult(address=target['address'], id=target.get('id'))
+        if self.mock:
+            # Mock mode - simulate a reachable host without touching the network
+            await asyncio.sleep(random.uniform(0, 0.01))
+            result.reachable = True
+            result.last_seen = datetime.utcnow().isoformat()
+            return result
+
+        try:
+            answers = await asyncio.wait_for(
+                asyncio.gather(*(self.probe_port(result.address, port) for port in self.ports)),
+                self.host_timeout
+            )
+        except asyncio.TimeoutError:
+            answers = []
+        except Exception as e:
+            result.error = str(e)
+            return result
+
+        result.open_ports = [port for port, answer in zip(self.ports, answers) if answer]
+        result.reachable = any(answer is not None for answer in answers)
+        if result.reachable:
+            result.last_seen = datetime.utcnow().isoformat()
+        return result
+
+    async def scan(self, targets: Union[Iterable[dict], AsyncIterable[dict]]) -> AsyncIterator[ScanResult]:
+        """Scan targets with at most `concurrency` hosts in flight, yielding results as they finish.
+
+        Targets are pulled lazily, so an async source can still be
+        producing while the first hosts are probed.
+        """
+        pending: "asyncio.Queue" = asyncio.Queue(maxsize=self.concurrency * 2)
+        results: "asyncio.Queue" = asyncio.Queue(maxsize=self.concurrency * 2)
+        done = object()
+
+        async def feed():
+            try:
+                if hasattr(targets, '__aiter__'):
+                    async for target in targets:
+                        await pending.put(target)
+                else:
+                    for target in targets:
+                        await pending.put(target)
+            finally:
+                for _ in range(self.concurrency):
+                    await pending.put(done)
+
+        async def work():
+            while True:
+                target = await pending.get()
+                if target is done:
+                    break
+                await results.put(await self.scan_host(target))
+            await results.put(done)
+
+        tasks = [asyncio.create_task(feed())] + [asyncio.create_task(work()) for _ in range(self.concurrency)]
+        try:
+            remaining = self.concurrency
+            while remaining:
+                item = await results.get()
+                if item is done:
+                    remaining -= 1
+                else:
+                    yield item
+            await tasks[0]
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
@@ -4,12 +4,15 @@ IPAM Scanner Agent - Discovers and monitors IP addresses
 Can run on-premises with network access for real scanning
 """
 import os
+import json
 import time
-import subprocess
 import socket
+import asyncio
 import requests
-from datetime import datetime
 import logging
+from scan_engine import ScanEngine
+from scheduler import ScanScheduler
+from state import ScanState
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -18,102 +21,264 @@ API_URL = os.getenv('API_URL', 'http://localhost:8000/api/v1')
 API_KEY = os.getenv('API_KEY', 'scanner-service-key')
 SCAN_INTERVAL = int(os.getenv('SCAN_INTERVAL', '300'))
 MOCK_MODE = os.getenv('MOCK_MODE', 'true').lower() == 'true'
+REPORT_BATCH_SIZE = int(os.getenv('SCAN_REPORT_BATCH_SIZE', '500'))
+STALE_SECONDS = os.getenv('SCAN_STALE_SECONDS')
+SUBNET_ID = os.getenv('SCAN_SUBNET_ID')
+SHARD = int(os.getenv('SCAN_SHARD', '0'))
+SHARDS = int(os.getenv('SCAN_SHARDS', '1'))
+REPORT_INTERVAL = float(os.getenv('SCAN_REPORT_INTERVAL', '10'))
+STATS_INTERVAL = float(os.getenv('SCAN_STATS_INTERVAL', '60'))
+# With leasing on, agents split the subnets between them through the backend instead of SCAN_SHARD/SCAN_SHARDS
+LEASES = os.getenv('SCAN_LEASES', 'false').lower() == 'true'
+AGENT_ID = os.getenv('SCAN_AGENT_ID') or socket.gethostname()
+LEASE_TTL = int(os.getenv('SCAN_LEASE_TTL', '120'))
+LEASE_LIMIT = os.getenv('SCAN_LEASE_LIMIT')
 
 class IPScanner:
     def __init__(self):
         self.session = requests.Session()
         self.session.headers.update({'Authorization': f'Bearer {API_KEY}'})
+        self.engine = ScanEngine(mock=MOCK_MODE)
+        self.state = ScanState()
+        self.scheduler = ScanScheduler(saved=self.state.load_schedule())
+        self._buffer = []
+        self.last_fetch_ok = False
+        self.reported = 0
+        self.skipped = 0
+        self.leased = set()
+        self._leases_valid_until = 0.0
+        self._targets_changed = None
     
-    def get_ips_to_scan(self):
-        """Fetch IPs that need scanning from API"""
+    def _target_params(self):
+        params = {'shard': SHARD, 'shards': SHARDS}
+        if LEASES:
+            # The server filters on our unexpired leases, however many subnets we hold
+            params = {'holder': AGENT_ID}
+        elif SUBNET_ID:
+            params['subnet_id'] = int(SUBNET_ID)
+        if STALE_SECONDS:
+            params['stale_seconds'] = int(STALE_SECONDS)
+        return params
+    
+    def _post_leases(self, action, **body):
+        response = self.session.post(f'{API_URL}/scan/leases/{action}', json={'holder': AGENT_ID, **body})
+        response.raise_for_status()
+        return set(response.json()['subnet_ids'])
+    
+    async def _claim_leases(self):
+        """Renew our subnet leases and take on more, dropping hosts of subnets we lost"""
+        body = {'ttl_seconds': LEASE_TTL}
+        if LEASE_LIMIT:
+            body['limit'] = int(LEASE_LIMIT)
         try:
-            response = self.session.get(f'{API_URL}/ips?status=assigned')
-            response.raise_for_status()
-            return response.json()
+            leased = await asyncio.to_thread(self._post_leases, 'claim', **body)
+            self._leases_valid_until = time.monotonic() + LEASE_TTL
         except Exception as e:
-            logger.error(f"Failed to fetch IPs: {e}")
-            return []
-    
-    def ping_ip(self, ip_address):
-        """Ping an IP address (real implementation)"""
-        if MOCK_MODE:
-            # Mock mode - simulate ping
-            return True, "Mock scan successful"
+            logger.error(f"Failed to claim scan leases: {e}")
+            if time.monotonic() < self._leases_valid_until:
+                return
+            # Our leases have run out, so another agent may be scanning these subnets now
+            leased = set()
         
+        lost, gained = self.leased - leased, leased - self.leased
+        self.leased = leased
+        if lost:
+            self.scheduler.retain([
+                key for key, host in self.scheduler.hosts.items() if host.target.get('subnet_id') not in lost
+            ])
+        if lost or gained:
+            logger.info(f"Leased {len(leased)} subnets ({len(gained)} gained, {len(lost)} lost)")
+            self._targets_changed.set()
+    
+    async def _maintain_leases(self):
+        while True:
+            await asyncio.sleep(LEASE_TTL / 3)
+            await self._claim_leases()
+    
+    def _release_leases(self):
         try:
-            # Real ping implementation
-            param = '-n' if os.name == 'nt' else '-c'
-            command = ['ping', param, '1', '-W', '2', ip_address]
-            result = subprocess.run(command, capture_output=True, timeout=3)
-            return result.returncode == 0, "Reachable" if result.returncode == 0 else "Unreachable"
+            self._post_leases('release')
         except Exception as e:
-            return False, str(e)
+            logger.warning(f"Failed to release scan leases: {e}")
+        self.leased = set()
     
-    def scan_port(self, ip_address, port=80, timeout=2):
-        """Check if a port is open"""
-        if MOCK_MODE:
-            return True
+    def _read_targets(self, loop, queue, done):
+        """Read the NDJSON target feed line by line, handing each target to the event loop.
         
+        Returns False if the feed could not be read to the end.
+        """
         try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(timeout)
-            result = sock.connect_ex((ip_address, port))
-            sock.close()
-            return result == 0
-        except:
+            with self.session.get(f'{API_URL}/scan/targets', params=self._target_params(), stream=True) as response:
+                response.raise_for_status()
+                for line in response.iter_lines():
+                    if line:
+                        # Blocks while the scan engine is busy, so the feed is read at scan speed
+                        asyncio.run_coroutine_threadsafe(queue.put(json.loads(line)), loop).result()
+            return True
+        except Exception as e:
+            logger.error(f"Failed to fetch scan targets: {e}")
             return False
+        finally:
+            asyncio.run_coroutine_threadsafe(queue.put(done), loop).result()
     
-    def update_ip_status(self, ip_id, last_seen, status):
-        """Update IP status in IPAM"""
-        try:
-            data = {
-                'last_seen': last_seen,
-                'metadata': {'scan_status': status}
+    async def iter_targets(self):
+        """Yield scan targets while the feed is still downloading"""
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=1000)
+        done = object()
+        reader = loop.run_in_executor(None, self._read_targets, loop, queue, done)
+        count = 0
+        while True:
+            target = await queue.get()
+            if target is done:
+                break
+            count += 1
+            yield target
+        self.last_fetch_ok = await reader
+        logger.info(f"Fetched {count} scan targets")
+    
+    def report_results(self, results):
+        """Send a batch of scan results to IPAM in one request; returns False if it failed"""
+        if not results:
+            return True
+        lines = []
+        for result in results:
+            item = {
+                'address': result.address,
+                'reachability': 'reachable' if result.reachable else 'unreachable',
+                'open_ports': result.open_ports,
             }
-            response = self.session.put(f'{API_URL}/ips/{ip_id}', json=data)
+            if result.id is not None:
+                item['id'] = result.id
+            if result.last_seen:
+                item['last_seen'] = result.last_seen
+            lines.append(json.dumps(item))
+        try:
+            response = self.session.post(
+                f'{API_URL}/ips/scan-results',
+                data='\n'.join(lines),
+                headers={'Content-Type': 'application/x-ndjson'}
+            )
             response.raise_for_status()
-            logger.info(f"Updated IP {ip_id}: {status}")
+            summary = response.json()
+            logger.info(f"Reported {summary['received']} results, {summary['updated']} IPs updated")
+            if summary['unmatched']:
+                logger.warning(f"{len(summary['unmatched'])} scanned IPs are unknown to IPAM")
+            return True
         except Exception as e:
-            logger.error(f"Failed to update IP {ip_id}: {e}")
+            logger.error(f"Failed to report {len(results)} scan results: {e}")
+            return False
     
-    def scan_all(self):
-        """Scan all assigned IPs"""
-        logger.info("Starting IP scan...")
-        ips = self.get_ips_to_scan()
-        logger.info(f"Found {len(ips)} IPs to scan")
-        
-        for ip in ips:
-            ip_address = ip['address']
-            ip_id = ip['id']
-            
-            logger.info(f"Scanning {ip_address}...")
-            reachable, status = self.ping_ip(ip_address)
-            
-            if reachable:
-                # Check common ports
-                port_80 = self.scan_port(ip_address, 80)
-                port_443 = self.scan_port(ip_address, 443)
-                status += f" | HTTP: {port_80} | HTTPS: {port_443}"
-            
-            self.update_ip_status(ip_id, datetime.utcnow().isoformat(), status)
-            time.sleep(0.1)  # Rate limiting
-        
-        logger.info("Scan complete")
+    async def _load_targets(self):
+        """Feed the target list into the scheduler; returns the keys it contained"""
+        keys, batch = [], []
+        async for target in self.iter_targets():
+            # Skip hosts of subnets whose lease we lost while the feed was downloading
+            if LEASES and target.get('subnet_id') not in self.leased:
+                continue
+            keys.append(ScanScheduler.key(target))
+            batch.append(target)
+            if len(batch) >= 1000:
+                self.scheduler.upsert(batch)
+                batch = []
+        self.scheduler.upsert(batch)
+        return keys
+    
+    async def _refresh_targets(self):
+        """Re-read the target feed every SCAN_INTERVAL, or when our leases change, so new and deleted hosts are picked up"""
+        while True:
+            self._targets_changed.clear()
+            if LEASES and not self.leased:
+                # Nothing is leased to us; the unfiltered feed would be every host
+                keys, self.last_fetch_ok = [], True
+            else:
+                keys = await self._load_targets()
+            if self.last_fetch_ok:
+                dropped = self.scheduler.retain(keys)
+                if dropped:
+                    self.state.forget(dropped)
+                    logger.info(f"Dropped {len(dropped)} hosts that are no longer scan targets")
+            try:
+                await asyncio.wait_for(self._targets_changed.wait(), SCAN_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+    
+    async def _flush(self):
+        """Report buffered transitions and checkpoint the schedule"""
+        batch, self._buffer = self._buffer, []
+        # Results that fail to report are not marked, so they are sent again next time
+        if await asyncio.to_thread(self.report_results, [result for _, result in batch]):
+            self.state.mark_reported(batch)
+        self.state.save_schedule(self.scheduler.drain_changes())
+    
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(REPORT_INTERVAL)
+            await self._flush()
+    
+    async def _report_stats(self):
+        while True:
+            await asyncio.sleep(STATS_INTERVAL)
+            stats = self.scheduler.stats()
+            logger.info(
+                f"Scheduler: {stats['rate_per_second']} hosts/s, lag {stats['lag_seconds']}s, "
+                f"{stats['overdue']}/{stats['hosts']} overdue, {stats['flapping']} flapping, "
+                f"{self.reported} results reported, {self.skipped} unchanged skipped"
+            )
+    
+    async def _run_scheduled(self):
+        self._targets_changed = asyncio.Event()
+        # Hosts the previous loop popped but never recorded would otherwise never come due again
+        stranded = self.scheduler.reset_in_flight()
+        if stranded:
+            logger.info(f"Requeued {stranded} hosts left in flight by the previous scan loop")
+        tasks = []
+        if LEASES:
+            await self._claim_leases()
+            tasks.append(asyncio.create_task(self._maintain_leases()))
+        tasks += [
+            asyncio.create_task(self._refresh_targets()),
+            asyncio.create_task(self._flush_periodically()),
+            asyncio.create_task(self._report_stats()),
+        ]
+        try:
+            async for result in self.engine.scan(self.scheduler.due_targets()):
+                key = ScanScheduler.key({'id': result.id, 'address': result.address})
+                self.scheduler.record(key, result.reachable)
+                # Only transitions and heartbeats go to IPAM
+                if not self.state.should_report(key, result):
+                    self.skipped += 1
+                    continue
+                self.reported += 1
+                self._buffer.append((key, result))
+                if len(self._buffer) >= REPORT_BATCH_SIZE:
+                    await self._flush()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self._flush()
+            if LEASES:
+                # Hand our subnets back now rather than making other agents wait out the TTL
+                await asyncio.to_thread(self._release_leases)
     
     def run(self):
-        """Main scanner loop"""
+        """Main scanner loop: rescan each host when the scheduler says it is due"""
         logger.info(f"Scanner started (Mock mode: {MOCK_MODE})")
         logger.info(f"API URL: {API_URL}")
-        logger.info(f"Scan interval: {SCAN_INTERVAL} seconds")
+        logger.info(f"Target refresh interval: {SCAN_INTERVAL} seconds")
+        logger.info(f"Concurrency: {self.engine.concurrency}, ports: {self.engine.ports}")
+        if LEASES:
+            logger.info(f"Subnet leasing as {AGENT_ID} (TTL {LEASE_TTL}s)")
         
         while True:
             try:
-                self.scan_all()
+                asyncio.run(self._run_scheduled())
+            except KeyboardInterrupt:
+                raise
             except Exception as e:
                 logger.error(f"Scan error: {e}")
-            
-            logger.info(f"Waiting {SCAN_INTERVAL} seconds until next scan...")
-            time.sleep(SCAN_INTERVAL)
+                time.sleep(5)
 
 if __name__ == '__main__':
     scanner = IPScanner()
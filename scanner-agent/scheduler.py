@@ -0,0 +1,229 @@
+"""
+Adaptive scan scheduler for the scanner agent
+
+Every host has its own rescan interval. Stable hosts back off
+exponentially up to their policy's maximum; hosts whose reachability keeps
+changing are held at the minimum. Due hosts come out of a heap, the ones
+unseen the longest first, and the scan engine's packets-per-second bucket
+keeps the whole agent inside its global probe budget.
+"""
+import asyncio
+import heapq
+import itertools
+import json
+import os
+import time
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, List, Optional
+
+SCAN_INTERVAL = int(os.getenv('SCAN_INTERVAL', '300'))
+SCAN_MIN_INTERVAL = float(os.getenv('SCAN_MIN_INTERVAL', '60'))
+SCAN_MAX_INTERVAL = float(os.getenv('SCAN_MAX_INTERVAL', '3600'))
+# Per-subnet overrides, e.g. {"12": {"min_interval": 10, "max_interval": 600}}
+SCAN_POLICIES = os.getenv('SCAN_POLICIES', '')
+FLAP_THRESHOLD = float(os.getenv('SCAN_FLAP_THRESHOLD', '2'))
+FLAP_DECAY = float(os.getenv('SCAN_FLAP_DECAY', '0.8'))
+# Seconds of completed scans the effective rate is averaged over
+RATE_WINDOW = 60.0
+
+
+@dataclass
+class ScanPolicy:
+    base_interval: float = SCAN_INTERVAL
+    min_interval: float = SCAN_MIN_INTERVAL
+    max_interval: float = SCAN_MAX_INTERVAL
+
+
+@dataclass
+class HostState:
+    target: dict
+    policy: ScanPolicy
+    interval: float
+    due: float
+    reachable: Optional[bool] = None
+    # Decaying count of reachability changes; at FLAP_THRESHOLD the host is flapping
+    flaps: float = 0.0
+    in_flight: bool = False
+
+    @property
+    def flapping(self) -> bool:
+        return self.flaps >= FLAP_THRESHOLD
+
+
+def load_policies(raw: str = SCAN_POLICIES) -> Dict[int, ScanPolicy]:
+    if not raw:
+        return {}
+    return {int(subnet_id): ScanPolicy(**policy) for subnet_id, policy in json.loads(raw).items()}
+
+
+def _age(last_seen: Optional[str], now: float) -> float:
+    """Seconds since last_seen by wall clock; hosts never seen are treated as infinitely stale"""
+    if not last_seen:
+        return float('inf')
+    seen = datetime.fromisoformat(last_seen)
+    if seen.tzinfo is None:
+        seen = seen.replace(tzinfo=timezone.utc)
+    return max(now - seen.timestamp(), 0.0)
+
+
+class ScanScheduler:
+    def __init__(
+        self,
+        default_policy: Optional[ScanPolicy] = None,
+        policies: Optional[Dict[int, ScanPolicy]] = None,
+        saved: Optional[Dict[str, dict]] = None,
+        clock: Callable[[], float] = time.monotonic,
+        wall_clock: Callable[[], float] = time.time
+    ):
+        self.default_policy = default_policy or ScanPolicy()
+        # Due times use clock; last_seen ages and checkpoints use wall_clock
+        self.clock = clock
+        self.wall_clock = wall_clock
+        self.policies = policies if policies is not None else load_policies()
+        self.hosts: Dict[str, HostState] = {}
+        # Schedules checkpointed by a previous run, applied when their host is first seen
+        self._saved = dict(saved or {})
+        self._dirty = set()
+        self._heap = []
+        self._seq = itertools.count()
+        self._wake = asyncio.Event()
+        self._completed = deque()
+
+    @staticmethod
+    def key(target: dict) -> str:
+        return str(target['id'] if target.get('id') is not None else target['address'])
+
+    def _push(self, key: str, state: HostState, rank: float = 0.0):
+        # Stale entries stay in the heap and are skipped when their due time no longer matches
+        heapq.heappush(self._heap, (state.due, rank, next(self._seq), key))
+
+    def upsert(self, targets: Iterable[dict], now: Optional[float] = None) -> int:
+        """Add new targets (the longest unseen first) and refresh known ones; returns how many were new"""
+        now = self.clock() if now is None else now
+        wall = self.wall_clock()
+        added = 0
+        for target in targets:
+            key = self.key(target)
+            state = self.hosts.get(key)
+            if state is not None:
+                state.target = target
+                continue
+            policy = self.policies.get(target.get('subnet_id'), self.default_policy)
+            state = HostState(target=target, policy=policy, interval=policy.base_interval, due=now)
+            saved = self._saved.pop(key, None)
+            if saved is not None:
+                state.reachable = saved['reachable']
+                state.interval = saved['interval'] or policy.base_interval
+                state.flaps = saved['flaps'] or 0.0
+                state.due = now + max(saved['due_at'] - wall, 0.0)
+            self.hosts[key] = state
+            self._push(key, state, rank=-_age(target.get('last_seen'), wall))
+            added += 1
+        if added:
+            self._wake.set()
+        return added
+
+    def retain(self, keys: Iterable[str]) -> List[str]:
+        """Forget hosts that are no longer targets; returns their keys"""
+        keep = set(keys)
+        dropped = [key for key in self.hosts if key not in keep]
+        for key in dropped:
+            del self.hosts[key]
+            self._dirty.discard(key)
+        return dropped
+
+    def pop_due(self, now: Optional[float] = None) -> Optional[dict]:
+        now = self.clock() if now is None else now
+        while self._heap and self._heap[0][0] <= now:
+            due, _, _, key = heapq.heappop(self._heap)
+            state = self.hosts.get(key)
+            if state is None or state.in_flight or state.due != due:
+                continue
+            state.in_flight = True
+            return state.target
+        return None
+
+    def reset_in_flight(self, now: Optional[float] = None) -> int:
+        """Requeue hosts popped by a scan loop that died before recording them; returns how many"""
+        now = self.clock() if now is None else now
+        stranded = [(key, state) for key, state in self.hosts.items() if state.in_flight]
+        for key, state in stranded:
+            state.in_flight = False
+            state.due = now
+            self._push(key, state)
+        if stranded:
+            self._wake.set()
+        return len(stranded)
+
+    def next_due(self) -> Optional[float]:
+        while self._heap:
+            due, _, _, key = self._heap[0]
+            state = self.hosts.get(key)
+            if state is not None and not state.in_flight and state.due == due:
+                return due
+            heapq.heappop(self._heap)
+        return None
+
+    def record(self, key: str, reachable: bool, now: Optional[float] = None) -> Optional[HostState]:
+        """Reschedule a host from its latest result"""
+        now = self.clock() if now is None else now
+        self._completed.append(now)
+        state = self.hosts.get(key)
+        if state is None:
+            return None
+        changed = state.reachable is not None and state.reachable != reachable
+        state.flaps = state.flaps * FLAP_DECAY + (1 if changed else 0)
+        if changed or state.flapping:
+            state.interval = state.policy.min_interval
+        else:
+            state.interval = min(state.interval * 2, state.policy.max_interval)
+        state.reachable = reachable
+        state.in_flight = False
+        state.due = now + state.interval
+        self._push(key, state)
+        self._dirty.add(key)
+        self._wake.set()
+        return state
+
+    def drain_changes(self) -> List[tuple]:
+        """(key, reachable, interval, flaps, due_at) of hosts rescheduled since the last call, due_at in wall-clock time"""
+        offset = self.wall_clock() - self.clock()
+        rows = [
+            (key, state.reachable, state.interval, state.flaps, state.due + offset)
+            for key, state in ((key, self.hosts.get(key)) for key in self._dirty)
+            if state is not None
+        ]
+        self._dirty.clear()
+        return rows
+
+    async def due_targets(self):
+        """Yield targets forever as they come due, sleeping while none are"""
+        self._wake = asyncio.Event()
+        while True:
+            target = self.pop_due()
+            if target is not None:
+                yield target
+                continue
+            self._wake.clear()
+            next_due = self.next_due()
+            timeout = None if next_due is None else max(next_due - self.clock(), 0)
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self, now: Optional[float] = None) -> Dict:
+        """Effective scan rate, queue lag and queue composition"""
+        now = self.clock() if now is None else now
+        while self._completed and self._completed[0] < now - RATE_WINDOW:
+            self._completed.popleft()
+        next_due = self.next_due()
+        return {
+            'hosts': len(self.hosts),
+            'overdue': sum(1 for state in self.hosts.values() if not state.in_flight and state.due <= now),
+            'flapping': sum(1 for state in self.hosts.values() if state.flapping),
+            'rate_per_second': round(len(self._completed) / RATE_WINDOW, 2),
+            'lag_seconds': round(max(now - next_due, 0.0), 1) if next_due is not None else 0.0,
+        }
@@ -0,0 +1,94 @@
+"""
+Local checkpoint of the scanner agent
+
+One SQLite row per host keeps the last reported result (as a hash), when
+it was reported and where the host stands in the schedule. With it the
+agent only reports hosts whose result changed, plus a heartbeat for the
+rest, and picks a sweep up where it left off after a restart.
+"""
+import hashlib
+import os
+import sqlite3
+import time
+from typing import Dict, Iterable, Optional
+
+STATE_PATH = os.getenv('SCAN_STATE_PATH', 'scanner-state.db')
+# Unchanged hosts are still reported this often, which keeps last_seen fresh in IPAM
+HEARTBEAT_INTERVAL = float(os.getenv('SCAN_HEARTBEAT_INTERVAL', '3600'))
+
+
+def result_hash(result) -> str:
+    raw = f"{int(result.reachable)}|{','.join(str(port) for port in sorted(result.open_ports))}"
+    return hashlib.blake2b(raw.encode(), digest_size=8).hexdigest()
+
+
+class ScanState:
+    def __init__(self, path: str = STATE_PATH, heartbeat_interval: float = HEARTBEAT_INTERVAL):
+        self.heartbeat_interval = heartbeat_interval
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS hosts (
+                key TEXT PRIMARY KEY,
+                result_hash TEXT,
+                reported_at REAL,
+                reachable INTEGER,
+                interval REAL,
+                flaps REAL,
+                due_at REAL
+            )
+        ''')
+        self.db.commit()
+        self._reported: Dict[str, tuple] = {
+            key: (digest, reported_at)
+            for key, digest, reported_at in self.db.execute('SELECT key, result_hash, reported_at FROM hosts')
+        }
+
+    def should_report(self, key: str, result, now: Optional[float] = None) -> bool:
+        """True if the result differs from the last reported one or the heartbeat is due"""
+        now = time.time() if now is None else now
+        previous = self._reported.get(key)
+        if previous is None or previous[0] != result_hash(result):
+            return True
+        return previous[1] is None or now - previous[1] >= self.heartbeat_interval
+
+    def mark_reported(self, items: Iterable[tuple], now: Optional[float] = None):
+        """Remember (key, result) pairs that IPAM accepted"""
+        now = time.time() if now is None else now
+        rows = [(key, result_hash(result), now) for key, result in items]
+        for key, digest, reported_at in rows:
+            self._reported[key] = (digest, reported_at)
+        self.db.executemany('''
+            INSERT INTO hosts (key, result_hash, reported_at) VALUES (?, ?, ?)
+            ON CONFLICT (key) DO UPDATE SET result_hash = excluded.result_hash, reported_at = excluded.reported_at
+        ''', rows)
+        self.db.commit()
+
+    def save_schedule(self, rows: Iterable[tuple]):
+        """Persist (key, reachable, interval, flaps, due_at) with due_at as wall-clock time"""
+        self.db.executemany('''
+            INSERT INTO hosts (key, reachable, interval, flaps, due_at) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (key) DO UPDATE SET
+                reachable = excluded.reachable, interval = excluded.interval,
+                flaps = excluded.flaps, due_at = excluded.due_at
+        ''', list(rows))
+        self.db.commit()
+
+    def load_schedule(self) -> Dict[str, dict]:
+        return {
+            key: {'reachable': None if reachable is None else bool(reachable), 'interval': interval, 'flaps': flaps, 'due_at': due_at}
+            for key, reachable, interval, flaps, due_at in self.db.execute(
+                'SELECT key, reachable, interval, flaps, due_at FROM hosts WHERE due_at IS NOT NULL'
+            )
+        }
+
+    def forget(self, keys: Iterable[str]):
+        keys = list(keys)
+        for key in keys:
+            self._reported.pop(key, None)
+        self.db.executemany('DELETE FROM hosts WHERE key = ?', [(key,) for key in keys])
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,98 @@
+import asyncio
+import socket
+import time
+from scan_engine import ScanEngine, TokenBucket
+
+
+def _unused_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def _listener():
+    async def close(reader, writer):
+        writer.close()
+
+    server = await asyncio.start_server(close, '127.0.0.1', 0)
+    return server, server.sockets[0].getsockname()[1]
+
+
+def test_open_refused_and_silent_ports_are_told_apart(monkeypatch):
+    async def probe():
+        server, port = await _listener()
+        engine = ScanEngine(rate_pps=0, connect_timeout=0.2)
+        async with server:
+            opened = await engine.probe_port('127.0.0.1', port)
+            refused = await engine.probe_port('127.0.0.1', _unused_port())
+
+        async def never_answers(host, port):
+            await asyncio.sleep(10)
+
+        monkeypatch.setattr(asyncio, 'open_connection', never_answers)
+        silent = await engine.probe_port('127.0.0.1', port)
+        return opened, refused, silent
+
+    # A refusal still proves the host is up; only silence means unreachable
+    assert asyncio.run(probe()) == (True, False, None)
+
+
+def test_scan_host_reports_open_ports_and_reachability():
+    async def scan():
+        server, port = await _listener()
+        closed = _unused_port()
+        engine = ScanEngine(rate_pps=0, ports=[port, closed], connect_timeout=0.5)
+        async with server:
+            return await engine.scan_host({'id': 7, 'address': '127.0.0.1'}), port
+
+    result, port = asyncio.run(scan())
+    assert (result.id, result.reachable, result.open_ports) == (7, True, [port])
+    assert result.last_seen is not None
+
+
+def test_host_timeout_bounds_a_slow_host():
+    engine = ScanEngine(rate_pps=0, ports=[22, 80], host_timeout=0.2)
+
+    async def hangs(address, port):
+        await asyncio.sleep(10)
+
+    engine.probe_port = hangs
+    started = time.monotonic()
+    result = asyncio.run(engine.scan_host({'address': '127.0.0.1'}))
+    assert time.monotonic() - started < 1
+    assert (result.reachable, result.open_ports, result.error) == (False, [], None)
+
+
+def test_token_bucket_holds_the_rate():
+    async def drain():
+        bucket = TokenBucket(rate=50, burst=1)
+        started = time.monotonic()
+        for _ in range(11):
+            await bucket.acquire()
+        return time.monotonic() - started
+
+    # One token up front, then ten more at 50 per second
+    elapsed = asyncio.run(drain())
+    assert 0.18 <= elapsed < 1
+
+
+def test_scan_never_exceeds_concurrency():
+    engine = ScanEngine(concurrency=3, rate_pps=0)
+    in_flight, peak = 0, 0
+
+    async def scan_host(target):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return target['address']
+
+    engine.scan_host = scan_host
+
+    async def run():
+        return [address async for address in engine.scan({'address': f'10.0.0.{i}'} for i in range(12))]
+
+    scanned = asyncio.run(run())
+    assert sorted(scanned) == sorted(f'10.0.0.{i}' for i in range(12))
+    assert peak == 3
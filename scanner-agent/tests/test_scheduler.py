@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta, timezone
+from scheduler import ScanPolicy, ScanScheduler
+
+WALL = datetime(2024, 5, 1, 12, 0, tzinfo=timezone.utc)
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def make_scheduler(clock=None):
+    clock = clock or FakeClock()
+    policy = ScanPolicy(base_interval=10, min_interval=5, max_interval=40)
+    scheduler = ScanScheduler(default_policy=policy, policies={}, clock=clock, wall_clock=WALL.timestamp)
+    return scheduler, clock
+
+
+def test_stalest_hosts_come_due_first():
+    scheduler, _ = make_scheduler()
+    seen = lambda ago: (WALL - ago).isoformat()
+    scheduler.upsert([
+        {'id': 1, 'address': '10.0.0.1', 'last_seen': seen(timedelta(minutes=1))},
+        {'id': 2, 'address': '10.0.0.2', 'last_seen': None},
+        {'id': 3, 'address': '10.0.0.3', 'last_seen': seen(timedelta(hours=1))},
+    ])
+    order = [scheduler.pop_due()['id'] for _ in range(3)]
+    assert order == [2, 3, 1]
+    assert scheduler.pop_due() is None
+
+
+def test_stable_unreachable_host_backs_off_to_the_maximum():
+    scheduler, clock = make_scheduler()
+    scheduler.upsert([{'id': 1, 'address': '10.0.0.1'}])
+    intervals = []
+    for _ in range(4):
+        assert scheduler.pop_due()['id'] == 1
+        state = scheduler.record('1', False)
+        intervals.append(state.interval)
+        assert scheduler.pop_due() is None
+        clock.now = state.due
+    assert intervals == [20, 40, 40, 40]
+
+
+def test_flapping_host_is_held_at_the_minimum_until_it_settles():
+    scheduler, _ = make_scheduler()
+    scheduler.upsert([{'id': 1, 'address': '10.0.0.1'}])
+    for reachable in (True, False, True, False):
+        state = scheduler.record('1', reachable)
+    assert state.flapping and state.interval == 5
+    assert scheduler.stats()['flapping'] == 1
+
+    # Each unchanged result decays the flap score; below the threshold backoff resumes
+    state = scheduler.record('1', False)
+    assert not state.flapping
+    assert state.interval == 10
+    assert scheduler.record('1', False).interval == 20
+
+
+
+def test_hosts_left_in_flight_are_requeued_after_a_restart():
+    scheduler, clock = make_scheduler()
+    scheduler.upsert([{'id': 1, 'address': '10.0.0.1'}, {'id': 2, 'address': '10.0.0.2'}])
+    assert scheduler.pop_due()['id'] == 1
+    scheduler.record('1', True)
+    # The scan loop died with host 2 popped but never recorded
+    assert scheduler.pop_due()['id'] == 2
+    assert scheduler.pop_due() is None and scheduler.next_due() == clock.now + 20
+
+    clock.now += 3
+    assert scheduler.reset_in_flight() == 1
+    assert scheduler.next_due() == clock.now
+    assert scheduler.pop_due()['id'] == 2
+    assert scheduler.reset_in_flight() == 1
+    scheduler.record('2', True)
+    assert scheduler.reset_in_flight() == 0
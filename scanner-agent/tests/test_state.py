@@ -0,0 +1,63 @@
+from scan_engine import ScanResult
+from scheduler import ScanPolicy, ScanScheduler
+from state import ScanState
+
+
+def result(reachable=True, open_ports=()):
+    return ScanResult(address='10.0.0.1', id=1, reachable=reachable, open_ports=list(open_ports))
+
+
+def test_only_changes_and_heartbeats_are_reported(tmp_path):
+    state = ScanState(str(tmp_path / 'state.db'), heartbeat_interval=3600)
+    assert state.should_report('1', result(), now=0)
+    state.mark_reported([('1', result(open_ports=[22, 80]))], now=0)
+
+    assert not state.should_report('1', result(open_ports=[80, 22]), now=60)
+    assert state.should_report('1', result(open_ports=[22]), now=60)
+    assert state.should_report('1', result(reachable=False, open_ports=[22, 80]), now=60)
+    # Unchanged hosts are still sent once per heartbeat so last_seen stays fresh
+    assert state.should_report('1', result(open_ports=[22, 80]), now=3600)
+    state.close()
+
+
+def test_reported_results_survive_a_restart(tmp_path):
+    path = str(tmp_path / 'state.db')
+    state = ScanState(path, heartbeat_interval=3600)
+    state.mark_reported([('1', result()), ('2', result(reachable=False))], now=100)
+    state.forget(['2'])
+    state.close()
+
+    reopened = ScanState(path, heartbeat_interval=3600)
+    assert not reopened.should_report('1', result(), now=200)
+    assert reopened.should_report('2', result(reachable=False), now=200)
+    reopened.close()
+
+
+def test_schedule_is_resumed_after_a_restart(tmp_path):
+    path = str(tmp_path / 'state.db')
+    wall = [1_000_000.0]
+    policy = ScanPolicy(base_interval=10, min_interval=5, max_interval=40)
+
+    def scheduler(saved=None):
+        return ScanScheduler(
+            default_policy=policy, policies={}, saved=saved, clock=lambda: 50.0, wall_clock=lambda: wall[0]
+        )
+
+    state = ScanState(path)
+    first = scheduler()
+    first.upsert([{'id': 1, 'address': '10.0.0.1'}, {'id': 2, 'address': '10.0.0.2'}])
+    first.record('1', True)
+    state.save_schedule(first.drain_changes())
+    assert first.drain_changes() == []
+    state.close()
+
+    # Five seconds later the restarted agent waits out the rest of host 1's interval
+    wall[0] += 5
+    state = ScanState(path)
+    second = scheduler(saved=state.load_schedule())
+    second.upsert([{'id': 1, 'address': '10.0.0.1'}, {'id': 2, 'address': '10.0.0.2'}])
+    assert second.hosts['1'].reachable is True and second.hosts['1'].interval == 20
+    assert second.pop_due()['id'] == 2
+    assert second.pop_due() is None
+    assert second.next_due() == 50.0 + 15
+    state.close()